@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from common.models import Chat, ChatMessage
+from user.models import User
+
+
+def recount_unread(chat):
+    """旧版 signal 每条消息执行的重新统计, 作为对照"""
+    return ChatMessage.objects.filter(chat_item=chat, read=False, created_by=chat.sender).count()
+
+
+class Command(BaseCommand):
+    help = 'Send many messages into one conversation, each committed like a real request, and report ' \
+           'the per-message cost of the incremental unread counter next to the cost of the old ' \
+           'per-message recount. The synthetic users, chat and messages are deleted afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10000, help='number of messages to send')
+        parser.add_argument('--block', type=int, default=1000,
+                            help='report the average cost every BLOCK messages')
+
+    def handle(self, *args, **options):
+        rows = []
+        sender = User.objects.create(username='bench_chat_sender', nickname='bench_chat_sender')
+        receiver = User.objects.create(username='bench_chat_receiver', nickname='bench_chat_receiver')
+        chat, _ = Chat.get_or_create_chat(sender=sender, receiver=receiver, classify='user')
+        try:
+            chat.refresh_from_db()
+            author = chat.sender
+            for sent in range(0, options['messages'], options['block']):
+                block = min(options['block'], options['messages'] - sent)
+                start = time.perf_counter()
+                for i in range(block):
+                    # 不在事务中, 每条消息与其未读数更新各自提交
+                    ChatMessage.objects.create(content=f'message {sent + i}', chat_item=chat,
+                                               created_by=author)
+                per_message = (time.perf_counter() - start) / block
+                recount = []
+                for _ in range(5):
+                    start = time.perf_counter()
+                    recount_unread(chat)
+                    recount.append(time.perf_counter() - start)
+                rows.append((sent + block, per_message, min(recount)))
+            chat.refresh_from_db()
+            unread = chat.receiver_unread_count
+        finally:
+            with transaction.atomic():
+                ChatMessage.objects.filter(chat_item=chat)._raw_delete(connection.alias)
+                chat.delete()
+                User.objects.filter(pk__in=[sender.pk, receiver.pk]).delete()
+
+        for sent, per_message, recount in rows:
+            self.stdout.write(f'{sent:>7} messages: {per_message * 1000:.2f}ms per message sent, '
+                              f'old recount would add {recount * 1000:.2f}ms')
+        self.stdout.write(f'receiver unread counter: {unread}')
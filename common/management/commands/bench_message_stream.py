@@ -0,0 +1,188 @@
+import asyncio
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.urls import reverse
+
+from common.notifications import broker, notify
+from settings.asgi import application
+from user.models import User
+
+PREFIX = 'bench_stream'
+
+
+def request_host():
+    host = settings.ALLOWED_HOSTS[0].lstrip('.')
+    return 'localhost' if host == '*' else host
+
+
+def rss_kb():
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith('VmRSS:'))
+
+
+class StreamConnection:
+    """直接调用 ASGI application 的一个空闲 SSE 连接, 不经过网络, 只测量服务端的开销"""
+
+    def __init__(self, session_key, path):
+        self.scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [
+                (b'host', request_host().encode()),
+                (b'cookie', f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode()),
+            ],
+            'client': ('127.0.0.1', 0),
+            'server': ('127.0.0.1', 80),
+        }
+        self.requested = False
+        self.ready = asyncio.Event()
+        self.received = asyncio.Event()
+        self.received_at = None
+        self.status = None
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # 客户端一直不断开
+        await asyncio.Event().wait()
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            if self.status != 200:
+                self.ready.set()
+        elif message['type'] == 'http.response.body':
+            body = message.get('body', b'')
+            if body.startswith(b'event: unread') and not self.ready.is_set():
+                self.ready.set()
+            elif body.startswith(b'event: message'):
+                self.received_at = time.perf_counter()
+                self.received.set()
+
+    async def run(self):
+        await application(self.scope, self.receive, self.send)
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark idle SSE message stream connections: open them against the ASGI application '
+        'in-process, measure memory and event loop lag while idle, then push one event to every '
+        'user and measure delivery'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections', type=int, default=2000, help='number of idle stream connections'
+        )
+        parser.add_argument(
+            '--users', type=int, default=500, help='connections are spread over this many users'
+        )
+        parser.add_argument(
+            '--idle', type=float, default=20, help='seconds to keep the connections idle'
+        )
+
+    def populate(self, user_total):
+        users = User.objects.bulk_create(
+            [
+                User(
+                    username=f'{PREFIX}_user_{i}',
+                    nickname=f'{PREFIX}_user_{i}',
+                    email=f'{PREFIX}_{i}@example.com',
+                )
+                for i in range(user_total)
+            ]
+        )
+        session_keys = []
+        for user in users:
+            session = SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.create()
+            session_keys.append(session.session_key)
+        return users, session_keys
+
+    def cleanup(self, session_keys):
+        with transaction.atomic():
+            Session.objects.filter(session_key__in=session_keys).delete()
+            User.objects.filter(username__startswith=f'{PREFIX}_user_').delete()
+
+    async def measure_lag(self, seconds, interval=0.1):
+        lags = []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append((time.perf_counter() - start - interval) * 1000)
+        return max(lags)
+
+    async def bench(self, users, session_keys, connection_total, idle):
+        path = reverse('api:message_stream')
+        streams = [
+            StreamConnection(session_keys[i % len(users)], path) for i in range(connection_total)
+        ]
+        rss_before = rss_kb()
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(stream.run()) for stream in streams]
+        await asyncio.gather(*(stream.ready.wait() for stream in streams))
+        connect_seconds = time.perf_counter() - start
+        statuses = {stream.status for stream in streams}
+        if statuses != {200}:
+            raise CommandError(f'Unexpected response status: {statuses}')
+        await sync_to_async(broker.listener.listening.wait, thread_sensitive=False)(10)
+        rss_per_connection = (rss_kb() - rss_before) / connection_total
+        max_lag = await self.measure_lag(idle)
+
+        def push():
+            with transaction.atomic():
+                for user in users:
+                    notify(user.id, {'type': 'message', 'classify': 'user'})
+
+        start = time.perf_counter()
+        await sync_to_async(push)()
+        await asyncio.wait_for(asyncio.gather(*(stream.received.wait() for stream in streams)), 120)
+        latencies = sorted((stream.received_at - start) * 1000 for stream in streams)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await sync_to_async(connections.close_all)()
+        return connect_seconds, rss_per_connection, max_lag, latencies
+
+    def handle(self, *args, **options):
+        self.stdout.write('Creating users and sessions...')
+        with transaction.atomic():
+            users, session_keys = self.populate(options['users'])
+        try:
+            connect_seconds, rss_per_connection, max_lag, latencies = asyncio.run(
+                self.bench(users, session_keys, options['connections'], options['idle'])
+            )
+        finally:
+            broker.stop()
+            self.cleanup(session_keys)
+
+        quantiles = statistics.quantiles(latencies, n=20, method='inclusive')
+        self.stdout.write(
+            f'{options["connections"]} connections over {options["users"]} users opened in '
+            f'{connect_seconds:.1f}s, about {rss_per_connection:.1f}KB each'
+        )
+        self.stdout.write(f'max event loop lag while idle for {options["idle"]:.0f}s: {max_lag:.1f}ms')
+        self.stdout.write(
+            f'one event per user delivered: p50 {quantiles[9]:.1f}ms, p95 {quantiles[18]:.1f}ms, '
+            f'max {latencies[-1]:.1f}ms'
+        )
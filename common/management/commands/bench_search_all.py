@@ -0,0 +1,158 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from pypinyin import lazy_pinyin
+
+from common.search import SEARCHES, search_all, uncached_search
+from course_assessment.management.commands.bench_search import WORDS
+from course_assessment.managers import build_search_vector
+from course_assessment.models import Course, Review, School, Semeseter, Teacher
+from user.models import User
+
+PREFIX = 'bench_search_all'
+
+
+def sequential_search(keyword, page_size):
+    """改动前前端的做法: 依次请求三种搜索, 每次各自转换拼音"""
+    return {
+        search_type: uncached_search(search_type, keyword, 1, page_size) for search_type in SEARCHES
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the concurrent "all" search against three sequential searches, on synthetic '
+        'data that is committed (the search threads use their own connections) and deleted afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reviews', type=int, default=50000, help='number of synthetic reviews')
+        parser.add_argument('--queries', type=int, default=30, help='number of searches per variant')
+        parser.add_argument('--page-size', type=int, default=10)
+
+    def populate(self, review_total):
+        school = School.objects.create(name=PREFIX)
+        semester = Semeseter.objects.create(name=PREFIX)
+        user_total = 100
+        users = User.objects.bulk_create(
+            [
+                User(username=f'{PREFIX}_user_{i}', nickname=f'{PREFIX}_user_{i}')
+                for i in range(user_total)
+            ]
+        )
+        rng = random.Random(0)
+        word_pinyin = {word: ''.join(lazy_pinyin(word)) for word in WORDS}
+
+        def phrase(low, high):
+            words = rng.choices(WORDS, k=rng.randint(low, high))
+            return ''.join(words), ''.join(word_pinyin[word] for word in words)
+
+        courses = []
+        for i in range(review_total // user_total + 1):
+            name, pinyin = phrase(1, 2)
+            courses.append(
+                Course(
+                    name=name,
+                    pinyin=pinyin,
+                    course_code=str(i),
+                    classification='general',
+                    school=school,
+                )
+            )
+        courses = Course.objects.bulk_create(courses, batch_size=5000)
+        teachers = []
+        for _ in range(len(courses) // 2):
+            name, pinyin = phrase(1, 1)
+            teachers.append(Teacher(name=name, pinyin=pinyin, school=school))
+        Teacher.objects.bulk_create(teachers, batch_size=5000)
+        for start in range(0, review_total, 5000):
+            reviews = []
+            for i in range(start, min(start + 5000, review_total)):
+                content, pinyin = phrase(10, 60)
+                reviews.append(
+                    Review(
+                        course=courses[i // user_total],
+                        created_by=users[i % user_total],
+                        semester=semester,
+                        content=content,
+                        pinyin=pinyin,
+                        rating=rng.randint(1, 5),
+                        difficulty=1,
+                        grade=1,
+                        homework=1,
+                        reward=1,
+                    )
+                )
+            Review.objects.bulk_create(reviews)
+        Course.objects.filter(school=school).update(search_vector=build_search_vector('name'))
+        Teacher.objects.filter(school=school).update(search_vector=build_search_vector('name'))
+        Review.objects.filter(semester=semester).update(search_vector=build_search_vector('content'))
+        with connection.cursor() as cursor:
+            for model in (Course, Teacher, Review):
+                cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+        return school, semester
+
+    def cleanup(self, school, semester):
+        # 合成数据没有触发信号, 直接删除各表中的行即可
+        with transaction.atomic():
+            Review.all_objects.filter(semester=semester)._raw_delete(connection.alias)
+            Course.objects.filter(school=school)._raw_delete(connection.alias)
+            Teacher.objects.filter(school=school)._raw_delete(connection.alias)
+            User.objects.filter(username__startswith=f'{PREFIX}_user_')._raw_delete(connection.alias)
+            semester.delete()
+            school.delete()
+
+    def measure(self, search, keywords, page_size):
+        latencies = []
+        for keyword in keywords:
+            start = time.perf_counter()
+            search(keyword, page_size)
+            latencies.append((time.perf_counter() - start) * 1000)
+        quantiles = statistics.quantiles(latencies, n=20)
+        return quantiles[9], quantiles[18]
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        keywords = [
+            rng.choice(WORDS) if i % 2 else ''.join(lazy_pinyin(rng.choice(WORDS)))
+            for i in range(options['queries'])
+        ]
+        self.stdout.write('Populating synthetic data...')
+        with transaction.atomic():
+            school, semester = self.populate(options['reviews'])
+        try:
+            # 单独的各类搜索, 合并搜索的延迟下限为其中最慢的一个
+            results = {
+                search_type: self.measure(
+                    lambda keyword, page_size, search_type=search_type: uncached_search(
+                        search_type, keyword, 1, page_size
+                    ),
+                    keywords,
+                    options['page_size'],
+                )
+                for search_type in SEARCHES
+            }
+            results.update(
+                {
+                    'sequential': self.measure(sequential_search, keywords, options['page_size']),
+                    'all': self.measure(
+                        lambda keyword, page_size: search_all(
+                            keyword, page_size, search=uncached_search
+                        ),
+                        keywords,
+                        options['page_size'],
+                    ),
+                }
+            )
+        finally:
+            self.cleanup(school, semester)
+
+        for name in results:
+            p50, p95 = results[name]
+            self.stdout.write(
+                f'{name}: p50 {p50:.1f}ms, p95 {p95:.1f}ms over {len(keywords)} searches '
+                f'on {options["reviews"]} reviews'
+            )
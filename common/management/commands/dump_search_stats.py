@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from utils.search_stats import clear_search_stats, get_search_stats
+
+
+class Command(BaseCommand):
+    help = 'Print the search latency histograms and the EXPLAIN plans of recent slow search queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true',
+                            help='reset the histograms and the slow query buffer')
+
+    def handle(self, *args, **options):
+        stats = get_search_stats()
+        for search_type, histogram in stats['latency_ms'].items():
+            buckets = ', '.join(f'<={bucket}ms {count}' for bucket, count in histogram.items() if count)
+            self.stdout.write(f'{search_type}: {buckets}')
+            outcome_counts = stats['outcomes'][search_type].items()
+            outcomes = ', '.join(f'{outcome} {count}' for outcome, count in outcome_counts if count)
+            if outcomes:
+                self.stdout.write(f'  {outcomes}')
+        self.stdout.write(f'{len(stats["slow_queries"])} slow queries')
+        for entry in stats['slow_queries']:
+            timed_out = ' (timed out)' if entry['timed_out'] else ''
+            self.stdout.write(f'\n[{entry["time"]:%Y-%m-%d %H:%M:%S}] '
+                              f'{entry["type"]} "{entry["keyword"]}": '
+                              f'query {entry["query_ms"]}ms{timed_out} '
+                              f'of {entry["outcome"]} search {entry["search_ms"]}ms')
+            self.stdout.write(f'{entry["sql"]}\nparams: {entry["params"]}\n{entry["plan"]}')
+        if options['clear']:
+            clear_search_stats()
+            self.stdout.write(self.style.SUCCESS('Cleared search stats'))
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from common.models import Chat, ChatLike, ChatMessage, ChatReply
+from common.unread import invalidate_unread_counts
+
+
+def count(queryset):
+    counts = queryset.order_by().values('chat_item').annotate(c=Count('id')).values('c')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def expected_unread_counts():
+    """按与增量更新相同的归属规则统计: sender 发的消息与发给 receiver 的提醒计入 receiver, 其余计入 sender"""
+    messages = ChatMessage.objects.filter(chat_item=OuterRef('pk'), read=False)
+    messages_from_sender = count(messages.filter(created_by=OuterRef('sender')))
+    sender_unread, receiver_unread = count(messages) - messages_from_sender, messages_from_sender
+    for model in (ChatLike, ChatReply):
+        notices = model.objects.filter(chat_item=OuterRef('pk'), read=False)
+        notices_to_sender = count(notices.filter(receiver=OuterRef('sender')))
+        sender_unread += notices_to_sender
+        receiver_unread += count(notices) - notices_to_sender
+    return sender_unread, receiver_unread
+
+
+class Command(BaseCommand):
+    help = 'Reconcile the incrementally maintained unread counters of chats ' \
+           'with their unread messages and notices'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Starting to reconcile unread counters...')
+        sender_unread, receiver_unread = expected_unread_counts()
+        with transaction.atomic():
+            in_sync = Q(sender_unread_count=sender_unread) & Q(receiver_unread_count=receiver_unread)
+            drifted = Chat.objects.select_for_update().exclude(in_sync)
+            users = set()
+            for sender_id, receiver_id in drifted.values_list('sender', 'receiver'):
+                users.update((sender_id, receiver_id))
+            repaired = drifted.update(sender_unread_count=sender_unread,
+                                      receiver_unread_count=receiver_unread)
+            invalidate_unread_counts(*users)
+        self.stdout.write(self.style.SUCCESS(f'Repaired unread counters for {repaired} chats'))
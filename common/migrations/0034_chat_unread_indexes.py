@@ -0,0 +1,21 @@
+# Generated by Django 4.2.14 on 2026-10-18 20:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0033_alter_about_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['sender', 'classify'], name='common_chat_sender_classify'),
+        ),
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['receiver', 'classify'], name='common_chat_receiver_classify'),
+        ),
+    ]
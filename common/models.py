@@ -1,6 +1,6 @@
 from django.conf import settings
 from django.db import models
-from django.db.models import CharField
+from django.db.models import CharField, Q, Sum
 
 from user.models import User
 
@@ -73,6 +73,10 @@ class Chat(models.Model):
                 name='unique_chat_pair_reverse',
             ),
         ]
+        indexes = [
+            models.Index(fields=['sender', 'classify'], name='common_chat_sender_classify'),
+            models.Index(fields=['receiver', 'classify'], name='common_chat_receiver_classify'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.sender is not None and self.sender_id > self.receiver_id:
@@ -91,6 +95,18 @@ class Chat(models.Model):
             sender, receiver = receiver, sender
         return Chat.objects.get(sender=sender, receiver=receiver, classify=classify)
 
+    @classmethod
+    def count_unread(cls, user_id):
+        """一条语句按 classify 分组, 分别累加用户作为 sender 与作为 receiver 的未读数"""
+        unread_counts = {classify: 0 for classify, _ in cls.classify_MESSAGE}
+        unread = (Sum('sender_unread_count', filter=Q(sender_id=user_id), default=0) +
+                  Sum('receiver_unread_count', filter=Q(receiver_id=user_id), default=0))
+        unread_counts.update(cls.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id))
+                             .values('classify').order_by()
+                             .annotate(unread=unread)
+                             .values_list('classify', 'unread'))
+        return unread_counts
+
 
 class ChatMessage(models.Model):
     content = models.TextField()
@@ -107,7 +123,31 @@ class ChatMessage(models.Model):
         ]
 
 
-class ChatReply(models.Model):
+class UnreadSnapshotMixin:
+    """记录已入库的所属 Chat, 接收者与是否未读, 供 signal 增量维护 Chat 的未读数"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not {'chat_item_id', 'receiver_id', 'read'} & instance.get_deferred_fields():
+            instance.snapshot_unread()
+        return instance
+
+    def snapshot_unread(self):
+        self._unread_snapshot = (self.chat_item_id, self.receiver_id, not self.read)
+
+    def unread_deltas(self, deleted=False):
+        """{(chat_id, 接收者 id): 未读数增量}"""
+        deltas = {}
+        before = getattr(self, '_unread_snapshot', (None, None, False))
+        after = (self.chat_item_id, self.receiver_id, not deleted and not self.read)
+        for (chat_id, receiver_id, unread), sign in ((before, -1), (after, 1)):
+            if chat_id is not None and unread:
+                deltas[(chat_id, receiver_id)] = deltas.get((chat_id, receiver_id), 0) + sign
+        return deltas
+
+
+class ChatReply(UnreadSnapshotMixin, models.Model):
     read = models.BooleanField(default=False)
     reply_content = models.ForeignKey('course_assessment.ReviewReply', on_delete=models.CASCADE)
     reply_classify = [
@@ -122,7 +162,7 @@ class ChatReply(models.Model):
     chat_item = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='reply_messages', null=True)
 
 
-class ChatLike(models.Model):
+class ChatLike(UnreadSnapshotMixin, models.Model):
     reply_classify = [
         ('review', '评价'),
         ('reply', '评论回复'),
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+from contextlib import asynccontextmanager
+
+import psycopg2
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+logger = logging.getLogger(__name__)
+
+# LISTEN/NOTIFY 的频道名, 各进程的监听线程把收到的通知转发给本进程中对应用户的连接
+CHANNEL = 'user_notifications'
+# 每个连接最多积压的事件数, 超出的事件丢弃, 之后推送的未读数会纠正
+QUEUE_SIZE = 100
+# 监听连接断开后重连的间隔(秒)
+RECONNECT_INTERVAL = 5
+
+
+def notify(user_id, event):
+    """
+    通过 NOTIFY 推送事件给所有进程中该用户的连接. 在事务中调用时事务提交后才发出, 回滚则不发出.
+    payload 不能超过 8000 字节, 事件中只放 id 与摘要
+    """
+    payload = json.dumps({'user': user_id, 'event': event}, cls=DjangoJSONEncoder)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, payload])
+
+
+class Broker:
+    """进程内的发布订阅: 每个连接在自己的事件循环中持有一个队列, 监听线程收到通知后线程安全地放入"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.listener = None
+
+    @asynccontextmanager
+    async def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = Listener(self)
+                self.listener.start()
+        try:
+            yield queue
+        finally:
+            with self.lock:
+                subscribers = self.subscribers.get(user_id)
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[user_id]
+
+    def publish(self, user_id, event):
+        with self.lock:
+            subscribers = list(self.subscribers.get(user_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._put, queue, event)
+
+    def publish_all(self, event):
+        with self.lock:
+            user_ids = list(self.subscribers)
+        for user_id in user_ids:
+            self.publish(user_id, event)
+
+    @staticmethod
+    def _put(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    def connection_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+    def stop(self):
+        with self.lock:
+            listener, self.listener = self.listener, None
+        if listener is not None:
+            listener.stop()
+
+
+class Listener(threading.Thread):
+    """用单独的 autocommit 连接 LISTEN, 不占用 Django 的连接; 断线重连后通知所有连接重新拉取未读数"""
+
+    def __init__(self, broker):
+        super().__init__(name='notification-listener', daemon=True)
+        self.broker = broker
+        self.stopped = threading.Event()
+        self.listening = threading.Event()
+
+    def connect(self):
+        conn = psycopg2.connect(**connections[DEFAULT_DB_ALIAS].get_connection_params())
+        conn.set_session(autocommit=True)
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN {CHANNEL}')
+        return conn
+
+    def run(self):
+        reconnected = False
+        while not self.stopped.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                self.listening.set()
+                if reconnected:
+                    self.broker.publish_all({'type': 'resync'})
+                while not self.stopped.is_set():
+                    if select.select([conn], [], [], 1)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self.dispatch(conn.notifies.pop(0).payload)
+            except psycopg2.Error:
+                logger.exception('Notification listener disconnected')
+                self.listening.clear()
+                reconnected = True
+                self.stopped.wait(RECONNECT_INTERVAL)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def dispatch(self, payload):
+        try:
+            message = json.loads(payload)
+            self.broker.publish(message['user'], message['event'])
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f'Invalid notification payload: {payload!r}')
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+broker = Broker()
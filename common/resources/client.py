@@ -0,0 +1,183 @@
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from utils.search_cache import search_cache
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = 2
+READ_TIMEOUT = 5
+POOL_SIZE = 10
+# 连续失败 FAILURE_THRESHOLD 次后熔断, RESET_TIMEOUT 秒内不再请求, 之后放行一次试探请求
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+
+class ResourceSearchError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # 半开: 只放行一次试探请求, 其结果决定是否恢复
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures, self.opened_at, self.probing = 0, None, False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at, self.probing = time.monotonic(), False
+
+    def release(self):
+        """请求出错但与资源站是否可用无关, 不计入成败, 只结束半开状态的试探, 下次请求重新试探"""
+        with self.lock:
+            self.probing = False
+
+
+class ResourceSearchClient:
+    """
+    资源站文件搜索的客户端: 复用连接池中的连接, 限制连接与读取的等待时间, 结果经搜索缓存缓存.
+    资源站持续出错时熔断, 直接返回标记为 degraded 的空结果, 不再占用 worker 等待
+    """
+
+    def __init__(
+        self,
+        base_url,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        pool_size=POOL_SIZE,
+        breaker=None,
+    ):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.breaker = breaker or CircuitBreaker()
+
+    def fetch(self, keyword, current_page, page_size, scope=0):
+        if not self.breaker.allow():
+            raise ResourceSearchError('circuit open')
+        try:
+            response = self.session.post(
+                self.base_url + '/api/fs/search',
+                timeout=self.timeout,
+                json={
+                    'parent': '/',
+                    'keywords': keyword,
+                    'scope': scope,
+                    'page': current_page,
+                    'per_page': page_size,
+                    'password': '',
+                },
+            )
+            response.raise_for_status()
+            search_result_json = response.json()
+            if search_result_json['code'] != 200:
+                raise ResourceSearchError(f"resource search returned code {search_result_json['code']}")
+            result = self.parse(search_result_json['data'], current_page, page_size)
+        except requests.HTTPError as e:
+            # 4xx 说明请求本身有误, 资源站仍然可用, 不计入熔断
+            if e.response is not None and e.response.status_code < 500:
+                self.breaker.release()
+            else:
+                self.breaker.record_failure()
+            raise ResourceSearchError(str(e)) from e
+        except (
+            requests.RequestException,
+            ValueError,
+            KeyError,
+            TypeError,
+            AttributeError,
+            ResourceSearchError,
+        ) as e:
+            # 超时, 连接失败与格式错误的响应计为失败
+            self.breaker.record_failure()
+            raise ResourceSearchError(str(e)) from e
+        except BaseException:
+            # 本地的错误不说明资源站不可用, 只结束可能的试探, 熔断器不会停在试探中
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def parse(self, data, current_page, page_size):
+        file_list = [
+            {
+                'name': file['name'],
+                'size': file['size'],
+                'path': file['parent'],
+                'type': 'dir' if file['is_dir'] else 'file',
+                'url': self.base_url + file['parent'],
+            }
+            for file in data['content'] or []
+        ]
+        total = data['total']
+        page_info = {
+            'total_pages': total // page_size + (0 if total % page_size == 0 else 1),
+            'current_page': current_page,
+            'has_next': total > current_page * page_size,
+            'has_previous': current_page > 1,
+            'total_count': total,
+        }
+        return page_info, file_list
+
+    def search(self, keyword, current_page, page_size):
+        """返回 (分页信息, 文件列表), 资源站不可用时返回空列表, 分页信息中 degraded 为 True"""
+        if page_size < 1 or current_page < 1:
+            raise ValueError(f'Invalid page {current_page} or page size {page_size}')
+        try:
+            return search_cache.get_or_set(
+                'resource',
+                keyword,
+                current_page,
+                page_size,
+                lambda: self.fetch(keyword, current_page, page_size),
+            )
+        except ResourceSearchError as e:
+            logger.warning(f'Resource search degraded: {e}')
+            return {
+                'total_pages': 0,
+                'current_page': current_page,
+                'has_next': False,
+                'has_previous': current_page > 1,
+                'total_count': 0,
+                'degraded': True,
+            }, []
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_resource_client():
+    """每个进程对同一资源站复用一个客户端, 以共享连接池与熔断状态"""
+    base_url = settings.RESOURCES_WEBSITE_URL
+    with _clients_lock:
+        if base_url not in _clients:
+            _clients[base_url] = ResourceSearchClient(base_url)
+        return _clients[base_url]
@@ -0,0 +1,249 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from pypinyin import lazy_pinyin
+
+from course_assessment.likes import merge_pending_review_likes
+from course_assessment.models import Course, Review, Teacher
+from utils.search_cache import search_cache
+from utils.utils import userUtils
+
+# 进程内合并搜索共用的线程数, 也是合并搜索额外占用的数据库连接数上限. 各线程的连接保持打开, 供之后的搜索复用
+SEARCH_THREADS = 8
+# 评价搜索结果中摘要的最大长度
+SNIPPET_LENGTH = 80
+_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix='search')
+_pool_connections = set()
+_pool_connections_lock = threading.Lock()
+
+
+def split_page(result):
+    return {k: v for k, v in result.items() if k != 'results'}, result['results']
+
+
+def course_search(keyword, current_page, page_size, pinyin_query=None):
+    page_info, courses = split_page(
+        Course.objects.search(
+            keyword,
+            page_size=page_size,
+            current_page=current_page,
+            select_related_fields=['school'],
+            pinyin_query=pinyin_query,
+        )
+    )
+    return page_info, [
+        {
+            'id': course.id,
+            'name': course.name,
+            'teacher': course.teachers_display,
+            'classification': course.get_classification(),
+            'school': course.school.get_name(),
+            'semester': course.semesters_display,
+            'rating': {
+                'average_rating': course.average_rating,
+                'normalized_rating': course.normalized_rating,
+            },
+            'like': {'like': course.like_count, 'dislike': course.dislike_count},
+            'review_count': course.review_count,
+            'latest_review_time': course.last_review_time,
+        }
+        for course in courses
+    ]
+
+
+def pinyin_char_index(content):
+    """拼音中每个字母对应的原文下标. lazy_pinyin 把每个汉字转为一个音节, 其余字符原样保留"""
+    index, position = [], 0
+    for segment in lazy_pinyin(content):
+        if content.startswith(segment, position):
+            index.extend(range(position, position + len(segment)))
+            position += len(segment)
+        else:
+            index.extend([position] * len(segment))
+            position += 1
+    return index
+
+
+def find_spans(text, target):
+    spans, start = [], 0
+    while target and (start := text.find(target, start)) != -1:
+        spans.append([start, start + len(target)])
+        start += len(target)
+    return spans
+
+
+def find_matches(content, keyword, pinyin_query):
+    """关键词在原文中出现的 [起, 止) 区间; 原文中没有时按拼音匹配, 再映射回对应的汉字"""
+    spans = find_spans(content.lower(), keyword.lower())
+    if spans or not pinyin_query:
+        return spans
+    char_index = pinyin_char_index(content)
+    return [
+        [char_index[start], char_index[end - 1] + 1]
+        for start, end in find_spans(''.join(lazy_pinyin(content)).lower(), pinyin_query.lower())
+    ]
+
+
+def build_snippet(content, keyword, pinyin_query, length=SNIPPET_LENGTH):
+    """
+    截取第一处匹配附近至多 length 个字符作为摘要. offset 为摘要在原文中的起点,
+    highlights 为摘要内匹配的 [起, 止) 区间, 只匹配了全文检索的分词时没有高亮, 摘要取原文开头
+    """
+    spans = find_matches(content, keyword, pinyin_query)
+    start = max(0, min(spans[0][0] - length // 4, len(content) - length)) if spans else 0
+    end = min(len(content), start + length)
+    return {
+        'text': content[start:end],
+        'offset': start,
+        'highlights': [
+            [span_start - start, span_end - start]
+            for span_start, span_end in spans
+            if span_start >= start and span_end <= end
+        ],
+    }
+
+
+def review_search(keyword, current_page, page_size, pinyin_query=None):
+    if pinyin_query is None:
+        pinyin_query = ''.join(lazy_pinyin(keyword))
+    page_info, reviews = split_page(
+        Review.objects.search(
+            keyword,
+            page_size=page_size,
+            current_page=current_page,
+            select_related_fields=['course', 'semester', 'created_by'],
+            pinyin_query=pinyin_query,
+        )
+    )
+    # 只为当前页的评价生成摘要
+    return page_info, [
+        {
+            'id': review.id,
+            'course': {
+                'id': review.course.id,
+                'name': review.course.get_name(),
+            },
+            'content': review.content,
+            'snippet': build_snippet(review.content, keyword, pinyin_query),
+            'rating': review.rating,
+            'created_by': userUtils.get_user_info_in_review(review),
+            'modify_time': review.modify_time,
+            'like': {
+                'like': review.like_count,
+                'dislike': review.dislike_count,
+            },
+            'semester': review.semester.name,
+        }
+        for review in merge_pending_review_likes(reviews)
+    ]
+
+
+def teacher_search(keyword, current_page, page_size, pinyin_query=None):
+    page_info, teachers = split_page(
+        Teacher.objects.search(
+            keyword,
+            page_size=page_size,
+            current_page=current_page,
+            select_related_fields=['school'],
+            pinyin_query=pinyin_query,
+        )
+    )
+    return page_info, [
+        {
+            'id': teacher.id,
+            'name': teacher.name,
+            'school': teacher.school.get_name(),
+            'avatar_uuid': teacher.avatar_uuid,
+        }
+        for teacher in teachers
+    ]
+
+
+SEARCHES = {'course': course_search, 'teacher': teacher_search, 'review': review_search}
+
+
+def is_complete(result):
+    page_info, _ = result
+    return not page_info.get('degraded')
+
+
+def cached_search(search_type, keyword, current_page, page_size, pinyin_query=None):
+    """返回 (分页信息, 结果列表), 经搜索缓存. 超时退化的结果不缓存, 下次请求重新完整搜索"""
+    return search_cache.get_or_set(
+        search_type,
+        keyword,
+        current_page,
+        page_size,
+        lambda: SEARCHES[search_type](keyword, current_page, page_size, pinyin_query),
+        should_cache=is_complete,
+    )
+
+
+def uncached_search(search_type, keyword, current_page, page_size, pinyin_query=None):
+    return SEARCHES[search_type](keyword, current_page, page_size, pinyin_query)
+
+
+def without_content(search_result_list):
+    """评价搜索结果默认只返回摘要, 缓存中保留全文以便按需返回"""
+    return [{k: v for k, v in review.items() if k != 'content'} for review in search_result_list]
+
+
+def _run_in_pool(func, *args):
+    """
+    线程池中的线程不经过请求开始与结束时的清理, 连接在各次搜索间复用.
+    出错后连接可能已不可用, 检查后关闭, 下次搜索重新连接
+    """
+    pool_connection = connections[DEFAULT_DB_ALIAS]
+    with _pool_connections_lock:
+        _pool_connections.add(pool_connection)
+    try:
+        return func(*args)
+    finally:
+        if pool_connection.errors_occurred:
+            if pool_connection.is_usable():
+                pool_connection.errors_occurred = False
+            else:
+                pool_connection.close()
+
+
+def close_pool_connections():
+    """关闭线程池中各线程保留的连接, 在线程池空闲时调用, 如测试结束需要删除数据库时"""
+    with _pool_connections_lock:
+        for pool_connection in _pool_connections:
+            pool_connection.inc_thread_sharing()
+            try:
+                pool_connection.close()
+            finally:
+                pool_connection.dec_thread_sharing()
+        _pool_connections.clear()
+
+
+def search_all(keyword, page_size, search=cached_search, full_content=False):
+    """
+    同时搜索课程, 教师与评价, 各返回第一页的 page_size 条. 拼音只转换一次, 评价在当前线程中用已有的连接搜索,
+    课程与教师在线程池中使用线程各自保留的连接并发执行. 当前连接处于事务中时其它连接看不到未提交的数据, 此时依次搜索
+    """
+    pinyin_query = ''.join(lazy_pinyin(keyword))
+    if connection.in_atomic_block:
+        results = {
+            search_type: search(search_type, keyword, 1, page_size, pinyin_query)
+            for search_type in SEARCHES
+        }
+    else:
+        futures = {
+            search_type: _executor.submit(
+                _run_in_pool, search, search_type, keyword, 1, page_size, pinyin_query
+            )
+            for search_type in SEARCHES
+            if search_type != 'review'
+        }
+        results = {'review': search('review', keyword, 1, page_size, pinyin_query)}
+        results.update({search_type: future.result() for search_type, future in futures.items()})
+    if not full_content:
+        page_info, search_result_list = results['review']
+        results['review'] = page_info, without_content(search_result_list)
+    return {
+        search_type: {'search_result': search_result_list, **page_info}
+        for search_type, (page_info, search_result_list) in results.items()
+    }
@@ -62,11 +62,19 @@ class ChatMessageGetSerializer(serializers.Serializer):
 
 class SearchSerializer(serializers.Serializer):
     keyword = serializers.CharField(required=True)
-    page_size = serializers.IntegerField(required=False, default=10)
-    current_page = serializers.IntegerField(required=False, default=1)
+    page_size = serializers.IntegerField(required=False, default=10, min_value=1, max_value=100)
+    current_page = serializers.IntegerField(required=False, default=1, min_value=1, max_value=1000)
     type = serializers.CharField(required=True)
+    # 评价搜索默认只返回摘要
+    full_content = serializers.BooleanField(required=False, default=False)
 
     def validate(self, data):
-        if data.get('type') not in ['course', 'teacher', 'review', 'resource']:
+        if data.get('type') not in ['course', 'teacher', 'review', 'resource', 'all']:
             raise serializers.ValidationError({'type': get_err_msg('operation_error')})
         return data
+
+
+class AutocompleteSerializer(serializers.Serializer):
+    keyword = serializers.CharField(required=True)
+    type = serializers.ChoiceField(choices=['course', 'teacher'], required=False)
+    limit = serializers.IntegerField(required=False, default=10, min_value=1, max_value=20)
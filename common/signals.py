@@ -1,40 +1,60 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import Signal, receiver
 
-from common.models import ChatMessage, ChatLike, ChatReply
+from common.models import ChatLike
+from common.notifications import notify
+from common.unread import add_unread, invalidate_unread_counts
 
 soft_delete_signal = Signal()
+# 推送的新消息摘要的最大长度
+PREVIEW_LENGTH = 100
 
 
 @receiver(post_save, sender='common.ChatMessage')
-def chat_message_handler(sender, instance, **kwargs):
+def chat_message_handler(sender, instance, created, **kwargs):
+    if not created:
+        return
     chat_item = instance.chat_item
-    chat_item.last_message_content = instance.content
-    chat_item.last_message_datetime = instance.create_time
-    chat_item.last_message_id = instance.id
-    if chat_item.sender == instance.created_by:
-        chat_item.receiver_unread_count = ChatMessage.objects.filter(chat_item=chat_item, read=False,
-                                                                     created_by=chat_item.sender).count()
+    # sender 发的消息计入 receiver 的未读数, 其余计入 sender 的
+    if chat_item.sender_id == instance.created_by_id:
+        recipient_id = chat_item.receiver_id
     else:
-        chat_item.sender_unread_count = ChatMessage.objects.filter(chat_item=chat_item, read=False,
-                                                                   created_by=chat_item.receiver).count()
-        # 不知道会不会有严重的性能问题
-    chat_item.save()
+        recipient_id = chat_item.sender_id
+    add_unread(chat_item.id, recipient_id, 1, last_message_content=instance.content,
+               last_message_datetime=instance.create_time, last_message_id=instance.id)
+    notify(recipient_id, {
+        'type': 'message',
+        'classify': chat_item.classify,
+        'chat_id': chat_item.id,
+        'message_id': instance.id,
+        'created_by': instance.created_by_id,
+        'content': instance.content[:PREVIEW_LENGTH],
+        'datetime': instance.create_time,
+    })
+
+
+def apply_unread_deltas(instance, deleted=False):
+    for (chat_id, receiver_id), delta in instance.unread_deltas(deleted).items():
+        add_unread(chat_id, receiver_id, delta)
+    instance.snapshot_unread()
 
 
 @receiver(post_save, sender='common.ChatLike')
-def chat_like_handler(sender, instance, **kwargs):
-    chat_item = instance.chat_item
-    if chat_item is None:
-        return
-    chat_item.receiver_unread_count = ChatLike.objects.filter(receiver=chat_item.sender, read=False).count()
-    chat_item.save()
-
-
 @receiver(post_save, sender='common.ChatReply')
-def chat_reply_handler(sender, instance, **kwargs):
-    chat_item = instance.chat_item
-    if chat_item is None:
-        return
-    chat_item.receiver_unread_count = ChatReply.objects.filter(receiver=chat_item.sender, read=False).count()
-    chat_item.save()
+@receiver(post_delete, sender='common.ChatLike')
+@receiver(post_delete, sender='common.ChatReply')
+def chat_notice_handler(sender, instance, signal, **kwargs):
+    apply_unread_deltas(instance, deleted=signal is post_delete)
+    # 已读时也会保存, 只推送未读的提醒
+    if signal is post_save and instance.chat_item_id is not None and not instance.read:
+        classify = 'like' if sender is ChatLike else 'reply'
+        notify(instance.receiver_id, {'type': classify, 'classify': classify, 'notice_id': instance.id,
+                                      'raw_post_id': instance.raw_post_id,
+                                      'raw_post_classify': instance.raw_post_classify})
+
+
+@receiver(post_save, sender='common.Chat')
+@receiver(post_delete, sender='common.Chat')
+def chat_changed(sender, instance, **kwargs):
+    # add_unread 以 update() 修改未读数时自行使缓存失效, 这里处理直接保存或删除 Chat 的情况
+    invalidate_unread_counts(instance.sender_id, instance.receiver_id)
@@ -0,0 +1,136 @@
+import asyncio
+import json
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+from django.urls import reverse
+
+from common.notifications import broker
+from common.unread import get_unread_counts
+from utils.utils import get_err_msg
+
+# 没有事件时发送注释行的间隔(秒), 使代理不断开空闲连接
+KEEPALIVE = 15
+# 断线后浏览器重连的等待时间(毫秒)
+RETRY = 5000
+
+
+def format_event(event_type, data):
+    return f'event: {event_type}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'.encode()
+
+
+def authenticate(session_key):
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    user = auth.get_user(request)
+    return user.id if user.is_authenticated else None
+
+
+async def run_sync(func, *args):
+    # 在共享的线程池中执行, 数据库连接数以线程数为上限, 不随推送连接数增长
+    return await sync_to_async(func, thread_sensitive=False)(*args)
+
+
+class MessageStreamApp:
+    """
+    以 Server-Sent Events 推送新消息, 点赞与回复提醒, 每个事件后附带最新的未读数, 连接时先推送一次未读数.
+    直接处理推送路径的请求, 其余交给 Django: Django 的中间件是同步的, 每个请求在响应结束前会独占一个线程
+    与一个数据库连接, 推送连接却一直不结束. 这里只用会话认证, 空闲的连接只占用一个协程与一个队列
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.path = reverse('api:message_stream')
+        self.pending_unread = {}
+
+    async def fetch_unread_counts(self, user_id, event):
+        """
+        同一次发布会把同一个事件对象放入该用户所有连接的队列, 这些连接共用一次未读数查询.
+        以事件对象区分, 不会复用收到事件之前开始的查询
+        """
+        key = (user_id, id(event))
+        future = self.pending_unread.get(key)
+        if future is None:
+            future = self.pending_unread[key] = asyncio.ensure_future(
+                run_sync(get_unread_counts, user_id)
+            )
+            future.add_done_callback(lambda _: self.pending_unread.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] != self.path or scope['method'] != 'GET':
+            return await self.application(scope, receive, send)
+        cookies = parse_cookie(dict(scope['headers']).get(b'cookie', b'').decode('latin-1'))
+        session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+        user_id = await run_sync(authenticate, session_key) if session_key else None
+        if user_id is None:
+            body = json.dumps(
+                {
+                    'message': '',
+                    'errors': [{'field': 'login', **get_err_msg('not_login')}],
+                    'contents': {},
+                }
+            ).encode()
+            await send(
+                {
+                    'type': 'http.response.start',
+                    'status': 401,
+                    'headers': [(b'content-type', b'application/json')],
+                }
+            )
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            await self.stream(user_id, send, disconnected)
+        finally:
+            disconnected.cancel()
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def stream(self, user_id, send, disconnected):
+        async with broker.subscribe(user_id) as queue:
+            await send(
+                {
+                    'type': 'http.response.start',
+                    'status': 200,
+                    'headers': [
+                        (b'content-type', b'text/event-stream'),
+                        (b'cache-control', b'no-cache'),
+                        # 关闭 nginx 的响应缓冲
+                        (b'x-accel-buffering', b'no'),
+                    ],
+                }
+            )
+            await send(
+                {
+                    'type': 'http.response.body',
+                    'body': f'retry: {RETRY}\n\n'.encode(),
+                    'more_body': True,
+                }
+            )
+            event = {'type': 'resync'}
+            while not disconnected.done():
+                if event is None:
+                    body = b': keepalive\n\n'
+                else:
+                    body = b'' if event['type'] == 'resync' else format_event(event['type'], event)
+                    body += format_event('unread', await self.fetch_unread_counts(user_id, event))
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+                next_event = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    [next_event, disconnected], timeout=KEEPALIVE, return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_event in done:
+                    event = next_event.result()
+                else:
+                    next_event.cancel()
+                    event = None
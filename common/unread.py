@@ -0,0 +1,58 @@
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, F, When
+from django.db.models.functions import Greatest
+
+from utils import constants
+from utils.coalescer import dirty_flusher, mark_dirty
+from .models import Chat
+
+# 失效在事务提交后进行, 提交前读到旧值并写入缓存的请求最多使结果滞后这么久(秒)
+UNREAD_COUNT_TIMEOUT = 300
+
+
+def unread_count_key(user_id):
+    return f"{constants.cache_key_dict['unread_count']}{user_id}"
+
+
+def get_unread_counts(user_id):
+    """用户各类消息的未读数与总数, 缓存到相关的 Chat 变化为止"""
+    key = unread_count_key(user_id)
+    unread = cache.get(key)
+    if unread is None:
+        unread_counts = Chat.count_unread(user_id)
+        unread = {'unread': unread_counts, 'total': sum(unread_counts.values())}
+        cache.set(key, unread, timeout=UNREAD_COUNT_TIMEOUT)
+    return unread
+
+
+def add_unread(chat_id, user_id, delta, **fields):
+    """
+    以 F() 原子地累加 user 在该 Chat 中的未读数, 开销与消息数量无关: user 是 Chat 的 sender 时累加 sender_unread_count,
+    否则累加 receiver_unread_count, 不小于 0. fields 为同时更新的其它字段. update() 不触发 post_save, 需手动使缓存失效
+    """
+    if user_id is not None and delta:
+        fields.update(
+            sender_unread_count=Case(When(sender_id=user_id,
+                                          then=Greatest(F('sender_unread_count') + delta, 0)),
+                                     default=F('sender_unread_count')),
+            receiver_unread_count=Case(When(sender_id=user_id, then=F('receiver_unread_count')),
+                                       default=Greatest(F('receiver_unread_count') + delta, 0)))
+    if fields:
+        Chat.objects.filter(pk=chat_id).update(**fields)
+    if user_id is not None and delta:
+        invalidate_unread_counts(user_id)
+
+
+def invalidate_unread_counts(*user_ids):
+    user_ids = [user_id for user_id in user_ids if user_id is not None]
+    if connection.in_atomic_block:
+        # 本事务随后的读取立即看到新值, 提交后再删除一次, 清除其它请求在提交前写入的旧值
+        cache.delete_many([unread_count_key(user_id) for user_id in user_ids])
+    for user_id in user_ids:
+        mark_dirty('unread_count', user_id)
+
+
+@dirty_flusher('unread_count')
+def flush_unread_count(items):
+    cache.delete_many([unread_count_key(user_id) for user_id in items])
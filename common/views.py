@@ -1,23 +1,26 @@
-import json
+from collections import defaultdict
 
-import requests
 from captcha.helpers import captcha_image_url
 from captcha.models import CaptchaStore
 from django.db.models import Q
 from rest_framework import status
 from rest_framework.generics import GenericAPIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
 
-from course_assessment.managers import SearchModuleErrorException
-from course_assessment.models import Course, Review, Teacher
-from settings import settings
+from common.resources.client import get_resource_client
+from common.search import SEARCHES, cached_search, search_all, without_content
+from common.unread import add_unread, get_unread_counts
+from course_assessment.autocomplete import autocomplete_index
 from user.models import User
 from utils.custom_pagination import StandardResultsSetPagination
+from utils.search_cache import search_cache
+from utils.search_stats import get_search_stats
 from utils.throttle import CaptchaAnonRateThrottle, CaptchaUserRateThrottle
-from utils.utils import return_response, get_err_msg, userUtils
+from utils.utils import return_response, get_err_msg
 from .models import Bulletin, About, Chat, ChatMessage, ChatLike, ChatReply
-from .serializers import CaptchaSerializer, ChatMessageSerializer, ChatMessageGetSerializer, SearchSerializer
+from .serializers import CaptchaSerializer, ChatMessageSerializer, ChatMessageGetSerializer, \
+    SearchSerializer, AutocompleteSerializer
 
 
 class CaptchaView(APIView):
@@ -96,6 +99,16 @@ class AboutView(APIView):
         return return_response(contents={"about": tos_content_database.content})
 
 
+def mark_notices_read(model, notices, user_id):
+    """批量标记提醒为已读, 按各 Chat 实际标记的条数减少未读数"""
+    unread_ids = defaultdict(list)
+    for notice in notices:
+        if not notice.read and notice.chat_item_id is not None:
+            unread_ids[notice.chat_item_id].append(notice.id)
+    for chat_id, ids in unread_ids.items():
+        add_unread(chat_id, user_id, -model.objects.filter(id__in=ids, read=False).update(read=True))
+
+
 class MessageBoxView(GenericAPIView):
     permission_classes = [IsAuthenticated]
     pagination_class = StandardResultsSetPagination
@@ -131,17 +144,12 @@ class MessageBoxView(GenericAPIView):
                 chat_message = ChatMessage.objects.filter(chat_item=chat_object, id__gt=last_message_id).order_by(
                     '-create_time')
         message_page = self.paginate_queryset(chat_message)
-        unread_message_list = [
-            message for message in message_page if message.created_by != request.user]
-        ChatMessage.objects.filter(
-            id__in=[message.id for message in unread_message_list]).update(read=True)
-        if chat_object.sender != request.user:
-            chat_object.receiver_unread_count = ChatMessage.objects.filter(chat_item=chat_object, read=False,
-                                                                           created_by=chat_object.sender).count()
-        else:
-            chat_object.sender_unread_count = ChatMessage.objects.filter(chat_item=chat_object, read=False,
-                                                                         created_by=chat_object.receiver).count()
-        chat_object.save()
+        unread_message_list = [message for message in message_page
+                               if message.created_by != request.user and not message.read]
+        # 只按本次实际标记为已读的条数减少未读数, 并发读取同一页时不会重复减少
+        read_count = ChatMessage.objects.filter(
+            id__in=[message.id for message in unread_message_list], read=False).update(read=True)
+        add_unread(chat_object.id, request.user.id, -read_count)
         message_list = []
         for message in message_page:
             message_list.append({
@@ -173,8 +181,7 @@ class MessageBoxView(GenericAPIView):
                 },
                 'datetime': notice.latest_like_datetime,
             })
-            notice.read = True
-            notice.save()
+        mark_notices_read(ChatLike, notice_page, request.user.id)
         return self.get_paginated_response(notice_list)
 
     def get_reply_notice(self, request):
@@ -207,8 +214,9 @@ class MessageBoxView(GenericAPIView):
                     },
                     'datetime': notice.reply_content.create_time,
                 })
-                notice.read = True
-                notice.save()
+        received_notices = [notice for notice in notice_page
+                            if notice.reply_content.created_by != request.user]
+        mark_notices_read(ChatReply, received_notices, request.user.id)
         return self.get_paginated_response(notice_list)
 
     def get(self, request, classify, chatter_id=None):
@@ -260,14 +268,16 @@ class MessageBoxView(GenericAPIView):
 class MessageUnreadView(APIView):
 
     def get(self, request):
-        unread_counts = {}
-        for i in Chat.classify_MESSAGE:
-            unread_counts[i[0]] = 0
-        for chat in Chat.objects.filter(sender=request.user):
-            unread_counts[chat.classify] += chat.sender_unread_count
-        for chat in Chat.objects.filter(receiver=request.user):
-            unread_counts[chat.classify] += chat.receiver_unread_count
-        return return_response(contents={'unread': unread_counts, 'total': sum(unread_counts.values())})
+        return return_response(contents=get_unread_counts(request.user.id))
+
+
+class MessageStreamView(APIView):
+    """消息推送由 settings/asgi.py 中的 MessageStreamApp 直接处理, 请求到达这里说明没有通过 ASGI 部署"""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        return return_response(errors={'server': get_err_msg('asgi_required')},
+                               status_code=status.HTTP_501_NOT_IMPLEMENTED)
 
 
 class CourseTeacherSearchView(APIView):
@@ -281,104 +291,55 @@ class CourseTeacherSearchView(APIView):
     def post(self, request):
         serializer = SearchSerializer(data=request.data)
 
-        def course_search(search_keyword):
-            courses = Course.objects.search(search_keyword, page_size=page_size,
-                                            current_page=current_page,
-                                            prefetch_related_fields=['semester', 'teachers'])
-            search_result_list = [{'id': course.id, 'name': course.name, 'teacher': course.get_teachers(),
-                                   'classification': course.get_classification(),
-                                   'school': course.school.get_name(), 'semester': course.get_semester(),
-                                   'rating': {
-                                       'average_rating': course.average_rating,
-                                       'normalized_rating': course.normalized_rating},
-                                   'like': {
-                                       'like': course.like_count,
-                                       'dislike': course.dislike_count
-                                   },
-                                   'review_count': course.review_count,
-                                   'latest_review_time': course.last_review_time} for course in
-                                  courses['results']]
-            page_info = {k: v for k, v in courses.items() if k != 'results'}
-            return page_info, search_result_list
-
-        def review_search(search_keyword):
-            try:
-                reviews = Review.objects.search(search_keyword, page_size=page_size,
-                                                select_related_fields=['course', 'semester', 'created_by'])
-            except SearchModuleErrorException:
-                return return_response(errors={'module': get_err_msg('invalid_search_type')}, )
-            search_result_list = [{'id': review.id,
-                                   'course': {'id': review.course.id, 'name': review.course.get_name(), },
-                                   'content': review.content,
-                                   'rating': review.rating,
-                                   'created_by': userUtils.get_user_info_in_review(review),
-                                   'modify_time': review.modify_time,
-                                   'like': {
-                                       'like': review.like_count,
-                                       'dislike': review.dislike_count,
-                                   },
-                                   'semester': review.semester.name,
-                                   } for review in reviews['results']]
-            page_info = {k: v for k, v in reviews.items() if k != 'results'}
-            return page_info, search_result_list
-
-        def teacher_search(search_keyword):
-            teachers = Teacher.objects.search(search_keyword, page_size=page_size,
-                                              current_page=current_page, select_related_fields=['school'])
-            search_result_list = [{'id': teacher.id, 'name': teacher.name, 'school': teacher.school.get_name(),
-                                   'avatar_uuid': teacher.avatar_uuid} for
-                                  teacher in teachers['results']]
-            page_info = {k: v for k, v in teachers.items() if k != 'results'}
-            return page_info, search_result_list
-
-        def resources_search(keyword, scope=0):
-            base_url = settings.RESOURCES_WEBSITE_URL
-            json_data = {
-                'parent': '/',
-                'keywords': keyword,
-                'scope': scope,
-                'page': current_page,
-                'per_page': page_size,
-                'password': '',
-            }
-            response = requests.post(base_url + '/api/fs/search', json=json_data)
-            search_result_json = json.loads(response.text)
-            if search_result_json['code'] != 200:
-                return []
-            file_list = []
-            total = search_result_json['data']['total']
-            for file in search_result_json['data']['content']:
-                file_list.append({
-                    'name': file['name'],
-                    'size': file['size'],
-                    'path': file['parent'],
-                    'type': 'dir' if file['is_dir'] else 'file',
-                    'url': base_url + file['parent']
-                })
-            page_info = {
-                'total_pages': total // page_size + (0 if total % page_size == 0 else 1),
-                'current_page': current_page,
-                'has_next': total > current_page * page_size,
-                'has_previous': current_page > 1,
-                'total_count': total
-            }
-            return page_info, file_list
-
         if serializer.is_valid():
             search_type = serializer.validated_data['type']
             page_size = serializer.validated_data['page_size']
             current_page = serializer.validated_data['current_page']
             search_keyword = serializer.validated_data['keyword']
-            if search_type == 'teacher':
-                page_info, search_result_list = teacher_search(search_keyword)
-            elif search_type == 'course':
-                page_info, search_result_list = course_search(search_keyword)
-            elif search_type == 'review':
-                page_info, search_result_list = review_search(search_keyword)
+            full_content = serializer.validated_data['full_content']
+            if search_type == 'all':
+                results = search_all(search_keyword, page_size, full_content=full_content)
+                return return_response(contents={'search_result': results})
+            if search_type in SEARCHES:
+                page_info, search_result_list = cached_search(search_type, search_keyword, current_page,
+                                                              page_size)
+                if search_type == 'review' and not full_content:
+                    search_result_list = without_content(search_result_list)
             elif search_type == 'resource':
-                page_info, search_result_list = resources_search(search_keyword)
+                client = get_resource_client()
+                page_info, search_result_list = client.search(search_keyword, current_page, page_size)
             else:
                 return return_response(errors=get_err_msg('invalid_type_field'),
                                        status_code=status.HTTP_400_BAD_REQUEST)
             return return_response(contents={'search_result': search_result_list, **page_info})
         return return_response(errors=serializer.errors, status_code=status.HTTP_400_BAD_REQUEST)
+
+
+class SearchAutocompleteView(APIView):
+    """按名称, 全拼或拼音首字母前缀补全课程名与教师名, 每次按键都会请求, 只读进程内索引不访问数据库"""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        serializer = AutocompleteSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return return_response(errors=serializer.errors, status_code=status.HTTP_400_BAD_REQUEST)
+        suggestions = autocomplete_index.complete(serializer.validated_data['keyword'],
+                                                  kind=serializer.validated_data.get('type'),
+                                                  limit=serializer.validated_data['limit'])
+        return return_response(contents={'suggestions': suggestions})
+
+
+class SearchCacheStatsView(APIView):
+    """本进程搜索结果缓存的命中统计, 供监控使用"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return return_response(contents=search_cache.stats())
+
+
+class SearchStatsView(APIView):
+    """各类搜索的延迟直方图与慢查询的执行计划, 需开启 SEARCH_INSTRUMENTATION"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return return_response(contents=get_search_stats())
@@ -0,0 +1,154 @@
+import bisect
+import functools
+import heapq
+import threading
+import time
+from collections import Counter
+
+from pypinyin import Style, lazy_pinyin
+
+from utils.coalescer import dirty_flusher, mark_dirty
+from .models import Course, Teacher
+
+SOURCES = {'course': Course, 'teacher': Teacher}
+# 其它进程中的增删只能通过定期重建同步
+REFRESH_INTERVAL = 10 * 60
+# 拼音键缓存的名称数量上限, 应大于课程与教师名称的总数, 否则每次重建都要重新转换
+PREFIX_KEYS_CACHE_SIZE = 32768
+
+
+def normalize(text):
+    return ''.join(text.split()).lower()
+
+
+@functools.lru_cache(maxsize=PREFIX_KEYS_CACHE_SIZE)
+def prefix_keys(name):
+    """名称本身, 全拼与拼音首字母, 如 高等数学 -> 高等数学, gaodengshuxue, gdsx. 转换拼音较慢, 定期重建时复用"""
+    keys = {normalize(name), normalize(''.join(lazy_pinyin(name))),
+            normalize(''.join(lazy_pinyin(name, style=Style.FIRST_LETTER)))}
+    return frozenset(keys - {''})
+
+
+class AutocompleteIndex:
+    """
+    课程名与教师名的进程内前缀索引. 每类对象保存一个按键排序的 (键, 名称) 列表, 查询时二分定位前缀的起点.
+    同名的课程/教师只作为一条补全, 按引用计数增删. 首次查询时从数据库建立, 之后随保存/删除增量更新
+    """
+
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.entries = {kind: [] for kind in SOURCES}
+        self.names = {}
+        self.name_counts = Counter()
+        self.built_at = None
+
+    def load(self, rows):
+        """rows 为 (类型, id, 名称) 的可迭代对象"""
+        names = {(kind, pk): name for kind, pk, name in rows}
+        name_counts = Counter((kind, name) for (kind, _), name in names.items())
+        entries = {kind: [] for kind in SOURCES}
+        for kind, name in name_counts:
+            entries[kind].extend((key, name) for key in prefix_keys(name))
+        for kind_entries in entries.values():
+            kind_entries.sort()
+        with self.lock:
+            self.entries, self.names, self.name_counts = entries, names, name_counts
+            self.built_at = time.monotonic()
+
+    def build(self):
+        self.load((kind, pk, name) for kind, model in SOURCES.items()
+                  for pk, name in model.objects.order_by().values_list('pk', 'name').iterator())
+
+    def is_stale(self):
+        return self.built_at is None or time.monotonic() - self.built_at > self.refresh_interval
+
+    def ensure_built(self):
+        """
+        同一时间只有一个线程重建. 尚未建立时其它线程等待建立完成; 定期重建时其它线程不等待, 继续使用旧索引
+        """
+        if not self.is_stale():
+            return
+        if not self.build_lock.acquire(blocking=self.built_at is None):
+            return
+        try:
+            if self.is_stale():
+                self.build()
+        finally:
+            self.build_lock.release()
+
+    def _add_name(self, kind, name):
+        self.name_counts[(kind, name)] += 1
+        if self.name_counts[(kind, name)] == 1:
+            for key in prefix_keys(name):
+                bisect.insort(self.entries[kind], (key, name))
+
+    def _remove_name(self, kind, name):
+        self.name_counts[(kind, name)] -= 1
+        if self.name_counts[(kind, name)] > 0:
+            return
+        del self.name_counts[(kind, name)]
+        kind_entries = self.entries[kind]
+        for key in prefix_keys(name):
+            index = bisect.bisect_left(kind_entries, (key, name))
+            if index < len(kind_entries) and kind_entries[index] == (key, name):
+                del kind_entries[index]
+
+    def update(self, items):
+        """items 为 {(类型, id): 名称}, 名称为 None 表示已删除. 尚未建立索引时忽略, 首次查询时会读到最新数据"""
+        with self.lock:
+            if self.built_at is None:
+                return
+            for (kind, pk), name in items.items():
+                old = self.names.pop((kind, pk), None)
+                if old is not None:
+                    self._remove_name(kind, old)
+                if name is not None:
+                    self.names[(kind, pk)] = name
+                    self._add_name(kind, name)
+
+    def _complete_kind(self, kind, prefix, limit):
+        kind_entries = self.entries[kind]
+        results, seen = [], set()
+        index = bisect.bisect_left(kind_entries, (prefix,))
+        while index < len(kind_entries) and len(results) < limit:
+            key, name = kind_entries[index]
+            if not key.startswith(prefix):
+                break
+            if name not in seen:
+                seen.add(name)
+                results.append((key, kind, name))
+            index += 1
+        return results
+
+    def complete(self, keyword, kind=None, limit=10):
+        """返回键以 keyword 开头的至多 limit 条补全, 按匹配的键排序"""
+        prefix = normalize(keyword)
+        if not prefix:
+            return []
+        self.ensure_built()
+        with self.lock:
+            matches = [self._complete_kind(source, prefix, limit) for source in SOURCES
+                       if kind is None or source == kind]
+        results = []
+        for _, match_kind, name in heapq.merge(*matches):
+            if len(results) == limit:
+                break
+            results.append({'type': match_kind, 'name': name})
+        return results
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+def mark_autocomplete_dirty(kind, instance, deleted=False):
+    mark_dirty('autocomplete', (kind, instance.pk), None if deleted else instance.name)
+
+
+@dirty_flusher('autocomplete')
+def flush_autocomplete(items):
+    autocomplete_index.update(items)
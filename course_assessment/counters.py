@@ -0,0 +1,19 @@
+from utils.counters import register_counter
+from .models import Course, Review
+
+ALL_COURSES = 'all'
+
+
+def count_courses(classification):
+    courses = Course.objects.all()
+    if classification != ALL_COURSES:
+        courses = courses.filter(classification=classification)
+    return courses.count()
+
+
+# 各分类及全部课程的数量, 分组为分类或 'all'
+course_counter = register_counter(
+    'total_courses_count', count_courses,
+    groups=lambda: [choice[0] for choice in Course.classification_choices] + [ALL_COURSES])
+# 未删除的评价数量
+review_counter = register_counter('total_review_count', lambda group: Review.objects.count())
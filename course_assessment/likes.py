@@ -0,0 +1,256 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from utils.db import advisory_xact_lock
+
+from .models import (
+    Course,
+    CourseLike,
+    Review,
+    ReviewAndReplyLike,
+    ReviewLikeBuffer,
+    ReviewReply,
+)
+from .signals import bump_course_version, update_chat_like_counts
+
+MAX_TOGGLE_ATTEMPTS = 5
+REVIEW_LIKE_CONFLICT = '(review_id, created_by_id) WHERE review_reply_id IS NULL'
+REVIEW_REPLY_LIKE_CONFLICT = '(review_reply_id, created_by_id) WHERE review_reply_id IS NOT NULL'
+
+TOGGLE_LIKE_SQL = '''
+WITH inserted AS (
+    INSERT INTO {like_table} ({key_columns}, "like", create_time)
+    SELECT {key_values}, %(like)s, %(now)s WHERE %(like)s <> 0
+    ON CONFLICT {conflict} DO NOTHING
+    RETURNING 0 AS old_like, "like" AS new_like
+), existing AS (
+    SELECT id, COALESCE("like", 0) AS "like" FROM {like_table} WHERE {lookup} FOR UPDATE
+), updated AS (
+    UPDATE {like_table} SET "like" = %(like)s FROM existing
+    WHERE {like_table}.id = existing.id AND %(like)s NOT IN (0, existing."like")
+    RETURNING existing."like" AS old_like, {like_table}."like" AS new_like
+), deleted AS (
+    DELETE FROM {like_table} USING existing
+    WHERE {like_table}.id = existing.id AND %(like)s IN (0, existing."like")
+    RETURNING existing."like" AS old_like, 0 AS new_like
+), changes AS (
+    SELECT * FROM inserted UNION ALL SELECT * FROM updated UNION ALL SELECT * FROM deleted
+)
+'''
+
+LIKE_DELTA_SQL = '''(
+    SELECT COALESCE(SUM((new_like = {like})::int - (old_like = {like})::int), 0) FROM changes
+)'''
+
+# 插入与并发提交的同一条记录冲突, 而该记录又不在本条语句的快照中时什么都不会做, 此时不返回行, 由调用方重试
+TOGGLE_RESOLVED_SQL = '''(
+    %(like)s = 0 OR EXISTS (SELECT 1 FROM inserted) OR EXISTS (SELECT 1 FROM existing)
+)'''
+
+WRITE_THROUGH_SQL = f'''
+UPDATE {{post_table}} SET
+    like_count = like_count + {LIKE_DELTA_SQL.format(like=1)},
+    dislike_count = dislike_count + {LIKE_DELTA_SQL.format(like=-1)}
+WHERE id = %(post_id)s AND {TOGGLE_RESOLVED_SQL}
+RETURNING like_count, dislike_count
+'''
+
+WRITE_BEHIND_SQL = f'''
+, buffered AS (
+    INSERT INTO {{buffer_table}} ({{buffer_column}}, like_delta, dislike_delta, create_time)
+    SELECT %(post_id)s, {LIKE_DELTA_SQL.format(like=1)}, {LIKE_DELTA_SQL.format(like=-1)}, %(now)s
+    WHERE EXISTS (SELECT 1 FROM changes)
+    RETURNING like_delta, dislike_delta
+), pending AS (
+    SELECT like_delta, dislike_delta FROM {{buffer_table}} WHERE {{buffer_column}} = %(post_id)s
+    UNION ALL SELECT * FROM buffered
+)
+SELECT like_count + (SELECT COALESCE(SUM(like_delta), 0) FROM pending),
+       dislike_count + (SELECT COALESCE(SUM(dislike_delta), 0) FROM pending)
+FROM {{post_table}}
+WHERE id = %(post_id)s AND {TOGGLE_RESOLVED_SQL}
+'''
+
+FLUSH_LIKE_BUFFER_SQL = '''
+WITH flushed AS (
+    DELETE FROM {buffer_table} RETURNING {buffer_column} AS post_id, like_delta, dislike_delta
+), totals AS (
+    SELECT post_id, SUM(like_delta) AS like_delta, SUM(dislike_delta) AS dislike_delta
+    FROM flushed GROUP BY post_id
+), updated AS (
+    UPDATE {post_table}
+    SET like_count = like_count + totals.like_delta,
+        dislike_count = dislike_count + totals.dislike_delta
+    FROM totals
+    WHERE {post_table}.id = totals.post_id AND (totals.like_delta <> 0 OR totals.dislike_delta <> 0)
+)
+SELECT {columns} FROM {post_table} JOIN totals ON {post_table}.id = totals.post_id
+'''
+
+
+class LikeConflictError(Exception):
+    """同一条点赞记录上的并发冲突重试 MAX_TOGGLE_ATTEMPTS 次后仍未完成"""
+
+
+def toggle_like(like_model, post_model, post_id, key, conflict, like, buffer_model=None):
+    """
+    在一条语句内完成点赞切换与计数更新: 没有记录时插入, 与已有记录相同或 like 为 0 时删除, 否则改为新值.
+    key 为唯一标识一条点赞记录的 {列名: 值}, conflict 为对应唯一索引的 ON CONFLICT 目标.
+    给出 buffer_model 时计数增量写入缓冲表而不改写被点赞对象的行, 返回值已合并缓冲表中尚未写回的增量.
+    返回更新后的 {'like_count', 'dislike_count'}, 调用方需保证被点赞对象存在. 重试次数用尽时抛出 LikeConflictError
+    """
+    quote_name = connection.ops.quote_name
+    params = {'like': like, 'post_id': post_id}
+    key_values, lookup = [], []
+    for index, (column, value) in enumerate(key.items()):
+        params[f'key{index}'] = value
+        key_values.append(f'%(key{index})s')
+        lookup.append(
+            f'{quote_name(column)} IS NULL'
+            if value is None
+            else f'{quote_name(column)} = %(key{index})s'
+        )
+    sql = TOGGLE_LIKE_SQL + (WRITE_THROUGH_SQL if buffer_model is None else WRITE_BEHIND_SQL)
+    sql = sql.format(
+        like_table=quote_name(like_model._meta.db_table),
+        post_table=quote_name(post_model._meta.db_table),
+        key_columns=', '.join(map(quote_name, key)),
+        key_values=', '.join(key_values),
+        lookup=' AND '.join(lookup),
+        conflict=conflict,
+        **(buffer_tables(buffer_model, post_model) if buffer_model is not None else {}),
+    )
+    for _ in range(MAX_TOGGLE_ATTEMPTS):
+        params['now'] = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is not None:
+            return {'like_count': row[0], 'dislike_count': row[1]}
+    raise LikeConflictError(
+        f'{like_model.__name__} toggle on {post_model.__name__} {post_id} kept conflicting'
+    )
+
+
+def buffer_tables(buffer_model, post_model):
+    quote_name = connection.ops.quote_name
+    buffer_field = next(
+        field
+        for field in buffer_model._meta.concrete_fields
+        if field.is_relation and field.related_model is post_model
+    )
+    return {
+        'buffer_table': quote_name(buffer_model._meta.db_table),
+        'buffer_column': quote_name(buffer_field.column),
+    }
+
+
+def flush_like_buffer(buffer_model, post_model, *columns):
+    """
+    把缓冲表中的计数增量按对象汇总后写回. 返回缓冲表中有增量的每个对象的 (id, *columns),
+    增量相互抵消的对象也在其中: 展示时合并过这些增量的缓存同样需要失效
+    """
+    quote_name = connection.ops.quote_name
+    post_table = quote_name(post_model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            FLUSH_LIKE_BUFFER_SQL.format(
+                post_table=post_table,
+                columns=', '.join(f'{post_table}.{quote_name(column)}' for column in ('id', *columns)),
+                **buffer_tables(buffer_model, post_model),
+            )
+        )
+        return cursor.fetchall()
+
+
+def flush_review_like_buffer():
+    """写回评价的点赞增量, 并递增这些评价所属课程的缓存版本, 课程详情不再展示写回前合并的旧计数"""
+    with transaction.atomic():
+        flushed = flush_like_buffer(ReviewLikeBuffer, Review, 'course_id')
+        for course_id in {course_id for _, course_id in flushed}:
+            bump_course_version(course_id)
+    return len(flushed)
+
+
+def merge_pending_review_likes(reviews):
+    """写回模式下把缓冲表中尚未写回的增量合并到评价的点赞/点踩计数上, 仅用于展示, 合并后的对象不应再保存"""
+    reviews = list(reviews)
+    if not settings.REVIEW_LIKE_WRITE_BEHIND or not reviews:
+        return reviews
+    pending = {
+        review_id: (like_delta, dislike_delta)
+        for review_id, like_delta, dislike_delta in ReviewLikeBuffer.objects.filter(
+            review__in=[review.id for review in reviews]
+        )
+        .order_by()
+        .values('review')
+        .annotate(like_delta=Sum('like_delta'), dislike_delta=Sum('dislike_delta'))
+        .values_list('review', 'like_delta', 'dislike_delta')
+    }
+    for review in reviews:
+        like_delta, dislike_delta = pending.get(review.id, (0, 0))
+        review.like_count += like_delta
+        review.dislike_count += dislike_delta
+    return reviews
+
+
+def toggle_review_like(review, review_reply, user, like):
+    """
+    切换用户对评价(review_reply 为 None)或评价回复的点赞/点踩, 并更新消息通知.
+    计数更新会锁住被点赞对象的行, 同一事务内更新通知可使同一对象上的通知按顺序写入.
+    开启 REVIEW_LIKE_WRITE_BEHIND 时评价的计数增量写入缓冲表, 避免热门评价上的行锁与整行改写, 通知改用咨询锁串行化
+    """
+    buffer_model = None
+    if review_reply is None:
+        post_model, post, conflict = Review, review, REVIEW_LIKE_CONFLICT
+        if settings.REVIEW_LIKE_WRITE_BEHIND:
+            buffer_model = ReviewLikeBuffer
+    else:
+        post_model, post, conflict = ReviewReply, review_reply, REVIEW_REPLY_LIKE_CONFLICT
+    with transaction.atomic():
+        counts = toggle_like(
+            ReviewAndReplyLike,
+            post_model,
+            post.id,
+            {
+                'review_id': review.id,
+                'review_reply_id': review_reply.id if review_reply is not None else None,
+                'created_by_id': user.id,
+            },
+            conflict,
+            like,
+            buffer_model,
+        )
+        if buffer_model is not None:
+            advisory_xact_lock(post_model, post.id)
+        else:
+            bump_course_version(review.course_id)
+        post.like_count, post.dislike_count = counts['like_count'], counts['dislike_count']
+        update_chat_like_counts(
+            ReviewAndReplyLike(
+                review=review,
+                review_reply=review_reply,
+                created_by=user,
+                like=like,
+                create_time=timezone.now(),
+            ),
+            ReviewAndReplyLike,
+        )
+    return counts
+
+
+def toggle_course_like(course, user, like):
+    """切换用户对课程的点赞/点踩"""
+    counts = toggle_like(
+        CourseLike,
+        Course,
+        course.id,
+        {'course_id': course.id, 'created_by_id': user.id},
+        '(course_id, created_by_id)',
+        like,
+    )
+    course.like_count, course.dislike_count = counts['like_count'], counts['dislike_count']
+    bump_course_version(course.id)
+    return counts
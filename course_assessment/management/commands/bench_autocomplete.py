@@ -0,0 +1,120 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from pypinyin import Style, lazy_pinyin
+
+from course_assessment.autocomplete import AutocompleteIndex
+from course_assessment.models import Course
+
+COURSE_WORDS = [
+    '高等',
+    '数学',
+    '线性',
+    '代数',
+    '概率论',
+    '大学',
+    '物理',
+    '程序',
+    '设计',
+    '数据',
+    '结构',
+    '操作',
+    '系统',
+    '计算机',
+    '网络',
+    '编译',
+    '原理',
+    '英语',
+    '体育',
+    '实验',
+    '基础',
+    '导论',
+    '分析',
+    '化学',
+    '地质',
+    '历史',
+]
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘'
+GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰建国志红'
+
+
+def keystrokes(text):
+    return [text[:end] for end in range(1, len(text) + 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark per keystroke autocomplete latency of the in-memory prefix index '
+        'against the search endpoint'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--courses', type=int, default=20000, help='number of synthetic course names'
+        )
+        parser.add_argument(
+            '--teachers', type=int, default=5000, help='number of synthetic teacher names'
+        )
+        parser.add_argument('--queries', type=int, default=200, help='number of typed words')
+        parser.add_argument(
+            '--compare',
+            action='store_true',
+            help='also time Course.objects.search on the current database for the same keystrokes',
+        )
+
+    def measure(self, complete, typed):
+        latencies = []
+        for keyword in typed:
+            start = time.perf_counter()
+            complete(keyword)
+            latencies.append((time.perf_counter() - start) * 1000)
+        quantiles = statistics.quantiles(latencies, n=100)
+        return quantiles[49], quantiles[98], max(latencies)
+
+    def report(self, name, typed, result):
+        p50, p99, worst = result
+        self.stdout.write(
+            f'{name}: p50 {p50:.3f}ms, p99 {p99:.3f}ms, max {worst:.3f}ms over {len(typed)} keystrokes'
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        course_names = [
+            ''.join(rng.choices(COURSE_WORDS, k=rng.randint(2, 4))) for _ in range(options['courses'])
+        ]
+        teacher_names = [
+            rng.choice(SURNAMES) + ''.join(rng.choices(GIVEN_NAMES, k=rng.randint(1, 2)))
+            for _ in range(options['teachers'])
+        ]
+        rows = [('course', pk, name) for pk, name in enumerate(course_names)] + [
+            ('teacher', pk, name) for pk, name in enumerate(teacher_names)
+        ]
+        index = AutocompleteIndex()
+        # 第二次为定期重建, 名称的拼音已缓存
+        for build in ('Built', 'Rebuilt'):
+            start = time.perf_counter()
+            index.load(rows)
+            self.stdout.write(
+                f'{build} index of {len(course_names)} courses and {len(teacher_names)} teachers '
+                f'in {(time.perf_counter() - start) * 1000:.0f}ms'
+            )
+
+        # 依次模拟输入汉字, 全拼与拼音首字母
+        typed = []
+        for i in range(options['queries']):
+            name = rng.choice(course_names + teacher_names)
+            text = [
+                name,
+                ''.join(lazy_pinyin(name)),
+                ''.join(lazy_pinyin(name, style=Style.FIRST_LETTER)),
+            ][i % 3]
+            typed.extend(keystrokes(text))
+        self.report('autocomplete index', typed, self.measure(index.complete, typed))
+        if options['compare']:
+            self.report(
+                'search',
+                typed,
+                self.measure(lambda keyword: Course.objects.search(keyword, page_size=10), typed),
+            )
@@ -0,0 +1,140 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Avg, Count, Sum
+
+from course_assessment.models import Course, Review, School, Semeseter
+from course_assessment.rating import recompute_course_ratings
+from user.models import User
+
+
+def refresh_course_rating(course):
+    """旧版 signal 的逐课程重算逻辑, 作为对照"""
+    reviews = Review.objects.filter(course=course)
+    aggregated = reviews.aggregate(
+        rating_avg=Avg('rating'), rating_sum=Sum('rating'), rating_count=Count('id')
+    )
+    average_rating = aggregated['rating_avg'] or 0.0
+
+    total_courses = Course.objects.filter(review__isnull=False).distinct().count()
+    site_avg_rating = Review.objects.aggregate(Avg('rating'))['rating__avg'] or 0.0
+    site_avg_reviews_count = (
+        Review.objects.values('course')
+        .annotate(count=Count('id'))
+        .aggregate(Avg('count'))['count__avg']
+        or 0.0
+    )
+    if total_courses > 0 and site_avg_reviews_count > 0:
+        normalized_rating = (
+            (aggregated['rating_sum'] or 0) + (site_avg_rating * site_avg_reviews_count)
+        ) / (aggregated['rating_count'] + site_avg_reviews_count)
+    else:
+        normalized_rating = average_rating
+    Course.objects.filter(pk=course.pk).update(
+        average_rating=average_rating, normalized_rating=normalized_rating
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark batch course rating recompute against per-course recompute, '
+        'on rolled back synthetic data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=100000, help='number of synthetic courses')
+        parser.add_argument('--reviews', type=int, default=300000, help='number of synthetic reviews')
+        parser.add_argument(
+            '--sample',
+            type=int,
+            default=20,
+            help='courses refreshed one by one, the total is extrapolated from them',
+        )
+
+    def populate(self, course_total, review_total):
+        school = School.objects.create(name='bench_school')
+        semester = Semeseter.objects.create(name='bench_semester')
+        users = User.objects.bulk_create(
+            [
+                User(username=f'bench_user_{i}', nickname=f'bench_user_{i}')
+                for i in range(review_total // course_total + 1)
+            ]
+        )
+        courses = Course.objects.bulk_create(
+            [
+                Course(
+                    name=f'bench_course_{i}',
+                    course_code=str(i),
+                    classification='general',
+                    school=school,
+                )
+                for i in range(course_total)
+            ],
+            batch_size=5000,
+        )
+        reviews = [
+            Review(
+                course=courses[i % course_total],
+                created_by=users[i // course_total],
+                semester=semester,
+                content='bench',
+                rating=random.randint(1, 5),
+                difficulty=1,
+                grade=1,
+                homework=1,
+                reward=1,
+            )
+            for i in range(review_total)
+        ]
+        Review.objects.bulk_create(reviews, batch_size=5000)
+        return courses
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write('Populating synthetic data...')
+            courses = self.populate(options['courses'], options['reviews'])
+
+            start = time.perf_counter()
+            recompute_course_ratings()
+            cold_seconds = time.perf_counter() - start
+
+            # 新增一条评价使全站先验漂移, 所有课程的归一化评分都需要重写
+            Review.objects.bulk_create(
+                [
+                    Review(
+                        course=courses[0],
+                        created_by=User.objects.create(username='bench'),
+                        semester_id=courses[0].review_set.first().semester_id,
+                        content='bench',
+                        rating=5,
+                        difficulty=1,
+                        grade=1,
+                        homework=1,
+                        reward=1,
+                    )
+                ]
+            )
+            start = time.perf_counter()
+            recompute_course_ratings()
+            drift_seconds = time.perf_counter() - start
+
+            sample = courses[: options['sample']]
+            start = time.perf_counter()
+            for course in sample:
+                refresh_course_rating(course)
+            per_course_seconds = (time.perf_counter() - start) / len(sample)
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f'batch recompute, all counters rebuilt: {cold_seconds:.2f}s for {len(courses)} courses'
+        )
+        self.stdout.write(
+            f'batch recompute, site prior drifted: {drift_seconds:.2f}s for {len(courses)} courses'
+        )
+        self.stdout.write(
+            f'per-course recompute: {per_course_seconds * 1000:.1f}ms per course, '
+            f'~{per_course_seconds * len(courses):.0f}s estimated for {len(courses)} courses'
+        )
@@ -0,0 +1,151 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from course_assessment.likes import (
+    REVIEW_LIKE_CONFLICT,
+    flush_review_like_buffer,
+    toggle_like,
+)
+from course_assessment.models import (
+    Course,
+    Review,
+    ReviewAndReplyLike,
+    ReviewLikeBuffer,
+    School,
+    Semeseter,
+)
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark concurrent like throughput on one hot review, '
+        'with and without the write-behind buffer'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16, help='number of concurrent clients')
+        parser.add_argument('--clicks', type=int, default=200, help='like clicks per client')
+        parser.add_argument(
+            '--users', type=int, default=500, help='number of synthetic users liking the review'
+        )
+        parser.add_argument(
+            '--content-length', type=int, default=2000, help='length of the hot review content'
+        )
+        parser.add_argument(
+            '--flush-interval',
+            type=float,
+            default=0.5,
+            help='seconds between buffer flushes while the write-behind clients run',
+        )
+
+    def populate(self, user_total, content_length):
+        school = School.objects.create(name='bench_school')
+        semester = Semeseter.objects.create(name='bench_semester')
+        users = User.objects.bulk_create(
+            [
+                User(username=f'bench_like_user_{i}', nickname=f'bench_like_user_{i}')
+                for i in range(user_total)
+            ]
+        )
+        course = Course.objects.create(
+            name='bench_course', course_code='bench', classification='general', school=school
+        )
+        reviews = [
+            Review.objects.create(
+                course=course,
+                created_by=user,
+                semester=semester,
+                rating=5,
+                content='赞' * content_length,
+                difficulty=1,
+                grade=1,
+                homework=1,
+                reward=1,
+            )
+            for user in users[:2]
+        ]
+        return school, semester, users, reviews
+
+    def run(self, review, users, threads, clicks, buffer_model, flush_interval):
+        barrier = threading.Barrier(threads)
+        finished = threading.Event()
+
+        def flusher():
+            try:
+                while not finished.wait(flush_interval):
+                    flush_review_like_buffer()
+            finally:
+                connection.close()
+
+        def client(seed):
+            rng = random.Random(seed)
+            try:
+                barrier.wait()
+                for _ in range(clicks):
+                    user = rng.choice(users)
+                    toggle_like(
+                        ReviewAndReplyLike,
+                        Review,
+                        review.id,
+                        {'review_id': review.id, 'review_reply_id': None, 'created_by_id': user.id},
+                        REVIEW_LIKE_CONFLICT,
+                        rng.choice([1, -1]),
+                        buffer_model,
+                    )
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads + 1) as executor:
+            if buffer_model is not None:
+                executor.submit(flusher)
+            list(executor.map(client, range(threads)))
+            seconds = time.perf_counter() - start
+            finished.set()
+
+        flush_review_like_buffer()
+        review.refresh_from_db()
+        likes = ReviewAndReplyLike.objects.filter(review=review, review_reply=None)
+        exact = (review.like_count, review.dislike_count) == (
+            likes.filter(like=1).count(),
+            likes.filter(like=-1).count(),
+        )
+        return seconds, exact
+
+    def handle(self, *args, **options):
+        threads, clicks = options['threads'], options['clicks']
+        # 并发的客户端使用各自的连接, 数据需要提交后才可见, 结束时删除
+        self.stdout.write('Populating synthetic data...')
+        school, semester, users, reviews = self.populate(options['users'], options['content_length'])
+        try:
+            results = {}
+            for review, (name, buffer_model) in zip(
+                reviews, (('write-through', None), ('write-behind', ReviewLikeBuffer))
+            ):
+                results[name] = self.run(
+                    review, users, threads, clicks, buffer_model, options['flush_interval']
+                )
+        finally:
+            # 直接删除点赞记录, 避免逐条触发计数与消息通知的 signal
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {connection.ops.quote_name(ReviewAndReplyLike._meta.db_table)} '
+                    f'WHERE review_id IN %s',
+                    [tuple(review.id for review in reviews)],
+                )
+            school.delete()
+            semester.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+        total = threads * clicks
+        for name, (seconds, exact) in results.items():
+            self.stdout.write(
+                f'{name}: {total} clicks from {threads} clients in {seconds:.2f}s, '
+                f'{total / seconds:.0f} clicks/s, counters {"exact" if exact else "DRIFTED"}'
+            )
@@ -0,0 +1,173 @@
+import random
+import statistics
+import time
+
+from django.contrib.postgres.search import SearchQuery, SearchVector, TrigramSimilarity
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Q
+from pypinyin import lazy_pinyin
+
+from course_assessment.models import Course, Review, School, Semeseter
+from user.models import User
+
+WORDS = [
+    '高数',
+    '线代',
+    '概率论',
+    '大学物理',
+    '程序设计',
+    '数据结构',
+    '操作系统',
+    '计算机网络',
+    '编译原理',
+    '马原',
+    '毛概',
+    '思修',
+    '体育',
+    '英语',
+    '老师',
+    '讲得',
+    '很好',
+    '一般',
+    '点名',
+    '签到',
+    '作业',
+    '不多',
+    '考试',
+    '简单',
+    '给分',
+    '挺高',
+    '期末',
+    '划重点',
+    '推荐',
+    '选修',
+    '水课',
+    '收获',
+    '很大',
+    '实验',
+    '报告',
+    '课堂',
+    '有趣',
+    '无聊',
+]
+SEARCH_INDEXES = ['review_search_vector_idx', 'review_content_trgm_idx', 'review_pinyin_trgm_idx']
+
+
+def legacy_search(query, page_size):
+    """旧版的搜索: 逐行计算 tsvector, 总数与分页查询都需扫描全表"""
+    pinyin_query = ''.join(lazy_pinyin(query))
+    vector = SearchVector('content', weight='A') + SearchVector('pinyin', weight='B')
+    queryset = (
+        Review.objects.annotate(search=vector)
+        .filter(
+            Q(search=SearchQuery(query) | SearchQuery(pinyin_query))
+            | Q(content__icontains=query)
+            | Q(pinyin__icontains=pinyin_query)
+        )
+        .annotate(rank=TrigramSimilarity('content', query) + TrigramSimilarity('pinyin', pinyin_query))
+        .order_by('-rank')
+    )
+    paginator = Paginator(queryset, page_size)
+    return paginator.count, list(paginator.page(1))
+
+
+def current_search(query, page_size):
+    result = Review.objects.search(query, page_size=page_size)
+    return result['total_count'], result['results']
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark review search latency before and after the search indexes, '
+        'on rolled back synthetic data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reviews', type=int, default=200000, help='number of synthetic reviews')
+        parser.add_argument('--queries', type=int, default=30, help='number of searches per variant')
+        parser.add_argument('--page-size', type=int, default=10)
+
+    def populate(self, review_total):
+        school = School.objects.create(name='bench_school')
+        semester = Semeseter.objects.create(name='bench_semester')
+        # 同一用户对同一课程只能有一条评价
+        user_total = 100
+        users = User.objects.bulk_create(
+            [
+                User(username=f'bench_search_user_{i}', nickname=f'bench_search_user_{i}')
+                for i in range(user_total)
+            ]
+        )
+        courses = Course.objects.bulk_create(
+            [
+                Course(
+                    name=f'bench_course_{i}',
+                    course_code=str(i),
+                    classification='general',
+                    school=school,
+                )
+                for i in range(review_total // user_total + 1)
+            ],
+            batch_size=5000,
+        )
+        word_pinyin = {word: ''.join(lazy_pinyin(word)) for word in WORDS}
+        rng = random.Random(0)
+        for start in range(0, review_total, 5000):
+            reviews = []
+            for i in range(start, min(start + 5000, review_total)):
+                words = rng.choices(WORDS, k=rng.randint(10, 60))
+                reviews.append(
+                    Review(
+                        course=courses[i // user_total],
+                        created_by=users[i % user_total],
+                        semester=semester,
+                        content=''.join(words),
+                        pinyin=''.join(word_pinyin[word] for word in words),
+                        rating=rng.randint(1, 5),
+                        difficulty=1,
+                        grade=1,
+                        homework=1,
+                        reward=1,
+                    )
+                )
+            Review.objects.bulk_create(reviews)
+        Review.objects.update(
+            search_vector=SearchVector('content', weight='A') + SearchVector('pinyin', weight='B')
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(Review._meta.db_table)}')
+
+    def measure(self, search, keywords, page_size):
+        latencies = []
+        for keyword in keywords:
+            start = time.perf_counter()
+            search(keyword, page_size)
+            latencies.append((time.perf_counter() - start) * 1000)
+        quantiles = statistics.quantiles(latencies, n=20)
+        return quantiles[9], quantiles[18]
+
+    def handle(self, *args, **options):
+        rng = random.Random(1)
+        keywords = [
+            rng.choice(WORDS) if i % 2 else ''.join(lazy_pinyin(rng.choice(WORDS)))
+            for i in range(options['queries'])
+        ]
+        with transaction.atomic():
+            self.stdout.write('Populating synthetic data...')
+            self.populate(options['reviews'])
+            results = {'after': self.measure(current_search, keywords, options['page_size'])}
+            # 在事务内删除索引, 回滚后恢复; 删除期间其它连接无法访问评价表, 请勿在生产库运行
+            with connection.cursor() as cursor:
+                for index in SEARCH_INDEXES:
+                    cursor.execute(f'DROP INDEX IF EXISTS {connection.ops.quote_name(index)}')
+            results['before'] = self.measure(legacy_search, keywords, options['page_size'])
+            transaction.set_rollback(True)
+
+        for name in ('before', 'after'):
+            p50, p95 = results[name]
+            self.stdout.write(
+                f'{name}: p50 {p50:.1f}ms, p95 {p95:.1f}ms over {len(keywords)} searches '
+                f'on {options["reviews"]} reviews'
+            )
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from course_assessment.likes import flush_review_like_buffer
+
+
+class Command(BaseCommand):
+    help = 'Fold buffered review like/dislike deltas into review counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0,
+            help='Keep flushing every INTERVAL seconds instead of flushing once',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            updated = flush_review_like_buffer()
+            self.stdout.write(
+                self.style.SUCCESS(f'Successfully flushed like counters for {updated} reviews')
+            )
+            if options['interval'] <= 0:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from utils.counters import all_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount every registered cached counter (course totals per classification, review total)'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Starting to rebuild cached counters...')
+        for counter in all_counters():
+            for key, value in counter.rebuild().items():
+                self.stdout.write(f'{key} = {value}')
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt cached counters'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+
+from course_assessment.managers import build_search_vector, get_search_config
+from course_assessment.models import Course, Review, Teacher
+
+MODELS = {
+    'teacher': (Teacher, 'name'),
+    'course': (Course, 'name'),
+    'review': (Review, 'content'),
+}
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored search vectors in primary key batches, e.g. after changing SEARCH_CONFIG'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'modules', nargs='*', help=f'any of {", ".join(MODELS)}, defaults to all of them'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        config = get_search_config() or 'default'
+        self.stdout.write(f'Rebuilding search vectors with config {config}...')
+        unknown = set(options['modules']) - set(MODELS)
+        if unknown:
+            raise CommandError(f'Unknown modules: {", ".join(sorted(unknown))}')
+        batch_size = options['batch_size']
+        for module in options['modules'] or MODELS:
+            model, field = MODELS[module]
+            # 包括软删除的评价, 恢复后无需再重建
+            queryset = model._base_manager.all()
+            bounds = queryset.aggregate(min_id=Min('id'), max_id=Max('id'))
+            if bounds['min_id'] is None:
+                continue
+            updated = 0
+            for start in range(bounds['min_id'], bounds['max_id'] + 1, batch_size):
+                # 每批单独提交, 避免长事务长时间锁住大量的行
+                with transaction.atomic():
+                    updated += queryset.filter(id__gte=start, id__lt=start + batch_size).update(
+                        search_vector=build_search_vector(field)
+                    )
+            self.stdout.write(f'{module}: {updated} rows')
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt search vectors'))
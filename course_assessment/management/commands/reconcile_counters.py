@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from course_assessment.likes import flush_review_like_buffer
+from course_assessment.models import Course, CourseLike, Review, ReviewAndReplyLike, ReviewReply
+
+
+def reconcile(queryset, likes, group_by):
+    """用点赞表重新统计计数, 只重写与统计结果不一致的行"""
+    def count(like):
+        return Coalesce(Subquery(likes.filter(like=like).order_by().values(group_by)
+                                 .annotate(c=Count('id')).values('c')), Value(0))
+
+    like_count, dislike_count = count(1), count(-1)
+    return (queryset.exclude(Q(like_count=like_count) & Q(dislike_count=dislike_count))
+            .update(like_count=like_count, dislike_count=dislike_count))
+
+
+class Command(BaseCommand):
+    help = 'Reconcile like/dislike counters of reviews, replies and courses with their like records'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Starting to reconcile like counters...')
+        with transaction.atomic():
+            # 先写回缓冲的增量, 否则校对后的计数会在下次写回时被重复累加
+            flush_review_like_buffer()
+            targets = {
+                'reviews': reconcile(Review.all_objects.all(), ReviewAndReplyLike.objects.filter(
+                    review=OuterRef('pk'), review_reply=None), 'review'),
+                'replies': reconcile(ReviewReply.all_objects.all(), ReviewAndReplyLike.objects.filter(
+                    review_reply=OuterRef('pk')), 'review_reply'),
+                'courses': reconcile(Course.objects.all(), CourseLike.objects.filter(
+                    course=OuterRef('pk')), 'course'),
+            }
+        for name, repaired in targets.items():
+            self.stdout.write(self.style.SUCCESS(f'Repaired like counters for {repaired} {name}'))
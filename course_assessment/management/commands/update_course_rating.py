@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from course_assessment.rating import recompute_course_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute average and normalized rating for all courses'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Starting to recompute course rating...')
+        updated = recompute_course_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Successfully updated rating for {updated} courses'))
@@ -1,9 +1,17 @@
-from django.contrib.postgres.search import TrigramSimilarity, SearchVector, SearchQuery
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity, SearchQuery, SearchRank, SearchVector
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db import models
+from django.db import OperationalError, connection, models
 from pypinyin import lazy_pinyin
 
+from utils.db import is_statement_timeout, statement_timeout
 from utils.models import SoftDeleteManager
+from utils.search_stats import instrument_search
+
+logger = logging.getLogger(__name__)
 
 
 class SearchModuleErrorException(Exception):
@@ -12,22 +20,72 @@ class SearchModuleErrorException(Exception):
         super().__init__(self.message)
 
 
+# 检查结果在进程内缓存的秒数, 启动后创建或删除的配置最迟在这之后生效
+SEARCH_CONFIG_CHECK_INTERVAL = 60
+_search_configs = {}
+
+
+def search_config_exists(config):
+    checked = _search_configs.get(config)
+    if checked is not None and time.monotonic() - checked[1] < SEARCH_CONFIG_CHECK_INTERVAL:
+        return checked[0]
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_ts_config WHERE cfgname = %s', [config])
+        exists = cursor.fetchone() is not None
+    if not exists:
+        logger.warning(f'Text search configuration {config} does not exist, '
+                       'falling back to the default one')
+    _search_configs[config] = (exists, time.monotonic())
+    return exists
+
+
+def get_search_config():
+    """
+    settings.SEARCH_CONFIG 指定的文本搜索配置, 如迁移中基于 zhparser 创建的 chinese.
+    未开启或数据库中没有该配置时返回 None, 即使用数据库的默认配置
+    """
+    config = settings.SEARCH_CONFIG
+    if config and search_config_exists(config):
+        return config
+    return None
+
+
+def build_search_vector(field):
+    """写入 search_vector 的表达式, 文字部分按搜索配置分词, 拼音部分使用默认配置"""
+    return (SearchVector(field, weight='A', config=get_search_config())
+            + SearchVector('pinyin', weight='B'))
+
+
 class SearchQuerySet(models.QuerySet):
-    def search(self, query, query_table_name, select_related_fields=None, prefetch_related_fields=None):
-        pinyin_query = ''.join(lazy_pinyin(query))
-        vector = SearchVector(query_table_name, weight='A') + SearchVector('pinyin', weight='B')
-        search_query = SearchQuery(query) | SearchQuery(pinyin_query)
+    @staticmethod
+    def build_search_query(query, pinyin_query):
+        return SearchQuery(query, config=get_search_config()) | SearchQuery(pinyin_query)
+
+    def search_filter(self, query, query_table_name, pinyin_query=None):
+        """
+        只筛选匹配的行, 不计算相关度, 统计总数时使用.
+        全文匹配使用已存储并建有 GIN 索引的 search_vector, 模糊匹配由 UPPER(字段) 上的 trigram 索引支持
+        """
+        if pinyin_query is None:
+            pinyin_query = ''.join(lazy_pinyin(query))
         name_field = f"{query_table_name}__icontains"
-        queryset = self.annotate(
-            search=vector
-        ).filter(
-            models.Q(search=search_query) |
+        return self.filter(
+            models.Q(search_vector=self.build_search_query(query, pinyin_query)) |
             models.Q(**{name_field: query}) |
             models.Q(pinyin__icontains=pinyin_query)
-        ).annotate(
-            rank=TrigramSimilarity(query_table_name, query) +
-                 TrigramSimilarity('pinyin', pinyin_query)
-        ).order_by('-rank')
+        )
+
+    def search(self, query, query_table_name, select_related_fields=None, prefetch_related_fields=None,
+               pinyin_query=None):
+        if pinyin_query is None:
+            pinyin_query = ''.join(lazy_pinyin(query))
+        rank = TrigramSimilarity(query_table_name, query) + TrigramSimilarity('pinyin', pinyin_query)
+        if get_search_config() is not None:
+            # 分词后的 search_vector 才有意义, 按词的覆盖密度计算相关度
+            rank = SearchRank(models.F('search_vector'), self.build_search_query(query, pinyin_query),
+                              cover_density=True) + rank
+        queryset = (self.search_filter(query, query_table_name, pinyin_query)
+                    .annotate(rank=rank).order_by('-rank', 'pk'))
 
         if select_related_fields:
             queryset = queryset.select_related(*select_related_fields)
@@ -41,7 +99,9 @@ class SearchManager(models.Manager):
     def get_queryset(self):
         return SearchQuerySet(self.model, using=self._db)
 
-    def search(self, query, page_size=10, current_page=1, select_related_fields=None, prefetch_related_fields=None):
+    def search(self, query, page_size=10, current_page=1, select_related_fields=None,
+               prefetch_related_fields=None, pinyin_query=None):
+        """pinyin_query 为 query 的拼音, 同一关键词搜索多个模型时由调用方只转换一次"""
         query_model_table_name_dict = {
             'course': 'name',
             'teacher': 'name',
@@ -50,18 +110,38 @@ class SearchManager(models.Manager):
         query_table_name = query_model_table_name_dict.get(self.model._meta.model_name, None)
         if query_table_name is None:
             raise SearchModuleErrorException('Invalid module')
-        search_results = self.get_queryset().search(query, query_table_name, select_related_fields,
-                                                    prefetch_related_fields)
-        paginator = Paginator(search_results, page_size)
-        try:
-            paginated_results = paginator.page(current_page)
-        except PageNotAnInteger:
-            paginated_results = paginator.page(1)
-        except EmptyPage:
-            paginated_results = paginator.page(paginator.num_pages)
+        if pinyin_query is None:
+            pinyin_query = ''.join(lazy_pinyin(query))
+        model_name = self.model._meta.model_name
+        # 统计包含超时后的退化搜索, 在 statement_timeout 之外记录, 超时回滚后仍能 EXPLAIN 超时的语句
+        with instrument_search(model_name, query) as sample:
+            try:
+                with statement_timeout(settings.SEARCH_STATEMENT_TIMEOUT_MS), sample.recording():
+                    queryset = self.get_queryset()
+                    search_results = queryset.search(query, query_table_name, select_related_fields,
+                                                     prefetch_related_fields, pinyin_query)
+                    paginator = Paginator(search_results, page_size)
+                    # 总数只统计匹配的行, 不计算相关度, 也不连接关联表
+                    matches = queryset.search_filter(query, query_table_name, pinyin_query)
+                    paginator.count = matches.count()
+                    try:
+                        paginated_results = paginator.page(current_page)
+                    except PageNotAnInteger:
+                        paginated_results = paginator.page(1)
+                    except EmptyPage:
+                        paginated_results = paginator.page(paginator.num_pages)
+                    results = list(paginated_results)
+            except OperationalError as e:
+                if not is_statement_timeout(e):
+                    raise
+                logger.warning(f'{model_name} search for {query!r} timed out, '
+                               'falling back to a degraded search')
+                sample.outcome = 'degraded'
+                return self.degraded_search(query, query_table_name, page_size, pinyin_query,
+                                            select_related_fields, prefetch_related_fields)
 
         return {
-            'results': list(paginated_results),
+            'results': results,
             'total_pages': paginator.num_pages,
             'current_page': paginated_results.number,
             'has_next': paginated_results.has_next(),
@@ -69,6 +149,39 @@ class SearchManager(models.Manager):
             'total_count': paginator.count
         }
 
+    def degraded_search(self, query, query_table_name, page_size, pinyin_query,
+                        select_related_fields=None, prefetch_related_fields=None):
+        """
+        完整搜索超时后的退化搜索: 不计算相关度与总数, 只返回最新的至多 page_size 条.
+        课程与教师只做名称与拼音的前缀匹配; 评价没有名称, 按 id 倒序扫描到足够的匹配即停止, 关键词越常见越快
+        """
+        if query_table_name == 'name':
+            queryset = self.get_queryset().filter(models.Q(name__istartswith=query) |
+                                                  models.Q(pinyin__istartswith=pinyin_query))
+        else:
+            queryset = self.get_queryset().filter(**{f'{query_table_name}__icontains': query})
+        queryset = queryset.order_by('-pk')
+        if select_related_fields:
+            queryset = queryset.select_related(*select_related_fields)
+        if prefetch_related_fields:
+            queryset = queryset.prefetch_related(*prefetch_related_fields)
+        try:
+            with statement_timeout(settings.SEARCH_STATEMENT_TIMEOUT_MS):
+                results = list(queryset[:page_size])
+        except OperationalError as e:
+            if not is_statement_timeout(e):
+                raise
+            results = []
+        return {
+            'results': results,
+            'total_pages': 1,
+            'current_page': 1,
+            'has_next': False,
+            'has_previous': False,
+            'total_count': len(results),
+            'degraded': True,
+        }
+
 
 class SoftDeleteSearchManager(SoftDeleteManager, SearchManager):
     def get_queryset(self):
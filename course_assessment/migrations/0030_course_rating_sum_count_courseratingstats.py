@@ -0,0 +1,56 @@
+# Generated by Django 4.2.14 on 2026-10-18 18:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Course = apps.get_model('course_assessment', 'course')
+    Review = apps.get_model('course_assessment', 'review')
+    CourseRatingStats = apps.get_model('course_assessment', 'courseratingstats')
+    reviews = Review.objects.filter(course=OuterRef('pk'), is_deleted=False).order_by().values('course')
+    Course.objects.update(
+        rating_sum=Coalesce(Subquery(reviews.annotate(s=Sum('rating')).values('s')), Value(0)),
+        rating_count=Coalesce(Subquery(reviews.annotate(c=Count('id')).values('c')), Value(0)),
+    )
+    site = Course.objects.filter(rating_count__gt=0).aggregate(
+        rating_sum=Coalesce(Sum('rating_sum'), Value(0)),
+        rating_count=Coalesce(Sum('rating_count'), Value(0)),
+        rated_course_count=Count('id'),
+    )
+    CourseRatingStats.objects.update_or_create(pk=1, defaults=site)
+
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0029_alter_course_average_rating_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseRatingStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating_sum', models.BigIntegerField(default=0, verbose_name='全站评分总和')),
+                ('rating_count', models.IntegerField(default=0, verbose_name='全站评分数量')),
+                ('rated_course_count', models.IntegerField(default=0, verbose_name='有评分的课程数量')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_count',
+            field=models.IntegerField(default=0, verbose_name='评分数量'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_sum',
+            field=models.IntegerField(default=0, verbose_name='评分总和'),
+        ),
+        migrations.RunPython(fill_rating_aggregates, reverse_func),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.14 on 2026-10-18 18:52
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    ReviewAndReplyLike = apps.get_model('course_assessment', 'reviewandreplylike')
+    duplicates = (ReviewAndReplyLike.objects.order_by().values('review', 'review_reply', 'created_by')
+                  .annotate(c=Count('id'), last_id=Max('id')).filter(c__gt=1))
+    for duplicate in duplicates:
+        (ReviewAndReplyLike.objects.filter(review=duplicate['review'], review_reply=duplicate['review_reply'],
+                                           created_by=duplicate['created_by'])
+         .exclude(id=duplicate['last_id']).delete())
+
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0030_course_rating_sum_count_courseratingstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, reverse_func),
+        migrations.AddConstraint(
+            model_name='reviewandreplylike',
+            constraint=models.UniqueConstraint(condition=models.Q(('review_reply', None)), fields=('review', 'created_by'), name='unique_review_like'),
+        ),
+        migrations.AddConstraint(
+            model_name='reviewandreplylike',
+            constraint=models.UniqueConstraint(condition=models.Q(('review_reply__isnull', False)), fields=('review_reply', 'created_by'), name='unique_review_reply_like'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.14 on 2026-10-18 19:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0031_review_like_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewLikeBuffer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('like_delta', models.IntegerField(default=0)),
+                ('dislike_delta', models.IntegerField(default=0)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='course_assessment.review')),
+            ],
+        ),
+    ]
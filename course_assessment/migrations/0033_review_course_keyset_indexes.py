@@ -0,0 +1,21 @@
+# Generated by Django 4.2.14 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0032_reviewlikebuffer'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['course', 'is_deleted', 'create_time', 'id'], name='review_course_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['course', 'is_deleted', 'like_count', 'id'], name='review_course_like_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.14 on 2026-10-18 19:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0033_review_course_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='课程详情缓存版本'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.14 on 2026-10-18 19:22
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0034_course_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(django.db.models.functions.text.Replace(django.db.models.functions.text.Replace(models.F('name'), models.Value('）'), models.Value(')')), models.Value('（'), models.Value('(')), name='course_normalized_name_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.14 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0035_course_normalized_name_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['classification', '-average_rating', 'like_count', 'id'], name='course_class_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['classification', '-review_count', 'like_count', 'id'], name='course_class_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['-average_rating', 'like_count', 'id'], name='course_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['-review_count', 'like_count', 'id'], name='course_popular_idx'),
+        ),
+    ]
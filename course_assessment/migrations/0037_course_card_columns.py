@@ -0,0 +1,57 @@
+# Generated by Django 4.2.14 on 2026-10-18 19:38
+
+from django.contrib.postgres.aggregates import JSONBAgg, StringAgg
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, JSONObject, Replace
+
+
+def fill_course_cards(apps, schema_editor):
+    Course = apps.get_model('course_assessment', 'course')
+    course_teachers = Course.teachers.through.objects.filter(course=OuterRef('pk')).order_by().values('course')
+    course_semesters = Course.semester.through.objects.filter(course=OuterRef('pk')).order_by().values('course')
+    Course.objects.update(
+        display_name=Replace(Replace(F('name'), Value('）'), Value(')')), Value('（'), Value('(')),
+        teachers_display=Coalesce(Subquery(course_teachers.annotate(names=StringAgg(
+            'teacher__name', delimiter=',', ordering=('teacher__school', 'teacher_id'))).values('names')), Value('')),
+        teachers_brief=Coalesce(Subquery(course_teachers.annotate(brief=JSONBAgg(
+            JSONObject(id='teacher_id', name='teacher__name'), ordering=('teacher__school', 'teacher_id')))
+            .values('brief')), Value([], models.JSONField())),
+        semesters_display=Coalesce(Subquery(course_semesters.annotate(names=StringAgg(
+            'semeseter__name', delimiter=' ', ordering='semeseter_id')).values('names')), Value('')),
+    )
+
+
+def reverse_func(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0036_course_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='display_name',
+            field=models.CharField(blank=True, max_length=30, verbose_name='展示名称'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='semesters_display',
+            field=models.TextField(blank=True, default='', verbose_name='开课学期'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='teachers_brief',
+            field=models.JSONField(default=list, verbose_name='教师id与姓名'),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='teachers_display',
+            field=models.TextField(blank=True, default='', verbose_name='教师'),
+        ),
+        migrations.RunPython(fill_course_cards, reverse_func),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.14 on 2026-10-18 19:43
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+import django.db.models.functions.text
+
+
+def trigram_index(model_name, field):
+    return model_name, django.contrib.postgres.indexes.GinIndex(
+        django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(field), name='gin_trgm_ops'),
+        name=f'{model_name}_{field}_trgm_idx')
+
+
+TRIGRAM_INDEXES = [
+    trigram_index('course', 'name'),
+    trigram_index('course', 'pinyin'),
+    trigram_index('review', 'content'),
+    trigram_index('review', 'pinyin'),
+    trigram_index('teacher', 'name'),
+    trigram_index('teacher', 'pinyin'),
+]
+
+
+def add_trigram_indexes(apps, schema_editor):
+    # gin_trgm_ops 由 pg_trgm 提供, 数据库中的 pg_trgm 不提供该操作符类时跳过, 搜索仍可用, 只是模糊匹配走顺序扫描
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_opclass WHERE opcname = 'gin_trgm_ops'")
+        if cursor.fetchone() is None:
+            return
+    for model_name, index in TRIGRAM_INDEXES:
+        schema_editor.add_index(apps.get_model('course_assessment', model_name), index)
+
+
+def remove_trigram_indexes(apps, schema_editor):
+    # 正向迁移可能跳过了创建, 索引不存在时忽略
+    for _, index in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {schema_editor.quote_name(index.name)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0037_course_card_columns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='course',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='course_search_vector_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='review_search_vector_idx'),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[migrations.AddIndex(model_name=model_name, index=index)
+                              for model_name, index in TRIGRAM_INDEXES],
+            database_operations=[migrations.RunPython(add_trigram_indexes, remove_trigram_indexes)],
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+# 中文分词配置依赖 zhparser 扩展提供的解析器, 数据库未安装时跳过, 搜索继续使用默认配置
+CREATE_CHINESE_CONFIG = '''
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_ts_parser WHERE prsname = 'zhparser')
+       AND NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'chinese') THEN
+        CREATE TEXT SEARCH CONFIGURATION chinese (PARSER = zhparser);
+        ALTER TEXT SEARCH CONFIGURATION chinese ADD MAPPING FOR n, v, a, i, e, l, j WITH simple;
+    END IF;
+END $$;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0038_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_CHINESE_CONFIG, 'DROP TEXT SEARCH CONFIGURATION IF EXISTS chinese'),
+    ]
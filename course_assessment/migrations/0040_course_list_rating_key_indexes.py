@@ -0,0 +1,30 @@
+# Generated by Django 4.2.14 on 2026-10-18 21:59
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_assessment', '0039_chinese_search_config'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='course',
+            name='course_class_rating_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='course',
+            name='course_rating_idx',
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(models.F('classification'), models.OrderBy(django.db.models.functions.comparison.Coalesce(models.F('average_rating'), models.Value(0.0)), descending=True), models.F('like_count'), models.F('id'), name='course_class_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(models.OrderBy(django.db.models.functions.comparison.Coalesce(models.F('average_rating'), models.Value(0.0)), descending=True), models.F('like_count'), models.F('id'), name='course_rating_idx'),
+        ),
+    ]
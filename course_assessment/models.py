@@ -1,15 +1,22 @@
 import re
 import uuid
 
-from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.functions import Coalesce, Replace, Upper
 
 from course_assessment.managers import SearchManager, SoftDeleteSearchManager
 from user.models import User
 from utils.models import SoftDeleteModel
 
 
+def trigram_indexes(prefix, *fields):
+    """icontains 生成 UPPER(字段) LIKE UPPER(...), trigram 索引需建在同样的表达式上才能被使用"""
+    return [GinIndex(OpClass(Upper(field), name='gin_trgm_ops'), name=f'{prefix}_{field}_trgm_idx')
+            for field in fields]
+
+
 class Semeseter(models.Model):
     """开课学期"""
 
@@ -50,9 +57,21 @@ class Teacher(models.Model):
             GinIndex(fields=['search_vector']),
             models.Index(fields=['name']),
             models.Index(fields=['pinyin']),
+            *trigram_indexes('teacher', 'name', 'pinyin'),
         ]
 
 
+def normalized_course_name(field='name'):
+    """与 Course.get_name 相同的全角括号替换, 查询与函数索引共用同一表达式, 以便命中索引"""
+    return Replace(Replace(models.F(field), models.Value('）'), models.Value(')')),
+                   models.Value('（'), models.Value('('))
+
+
+def course_rating_key():
+    """课程列表按评分排序的键, 没有评分(NULL)的课程按 0 分排在最后, 排序, 游标与索引共用同一表达式"""
+    return Coalesce(models.F('average_rating'), models.Value(0.0))
+
+
 class Course(models.Model):
     classification_choices = (
         ('general', '通识'),
@@ -76,14 +95,48 @@ class Course(models.Model):
     like_count = models.IntegerField(default=0, db_index=True, verbose_name='推荐')
     dislike_count = models.IntegerField(default=0, db_index=True, verbose_name='不推荐')
     review_count = models.IntegerField(default=0, db_index=True, verbose_name='评价数量')
+    rating_sum = models.IntegerField(default=0, verbose_name='评分总和')
+    rating_count = models.IntegerField(default=0, verbose_name='评分数量')
     last_review_time = models.DateTimeField(null=True)
     pinyin = models.CharField(max_length=100, verbose_name='拼音', blank=True)
     search_vector = SearchVectorField(null=True)
+    version = models.PositiveIntegerField(default=0, verbose_name='课程详情缓存版本')
+    # 以下为列表展示用的冗余字段, 由 signal 维护, 列表与搜索无需再查询教师与学期
+    display_name = models.CharField(max_length=30, blank=True, verbose_name='展示名称')
+    teachers_display = models.TextField(blank=True, default='', verbose_name='教师')
+    teachers_brief = models.JSONField(default=list, verbose_name='教师id与姓名')
+    semesters_display = models.TextField(blank=True, default='', verbose_name='开课学期')
     objects = SearchManager()
 
+    # 评分, 点赞与评价数量的计数和 version 只通过 F() 原子更新, 教师与学期的展示字段由 signal 在事务提交后写入,
+    # 整行保存时都不写回, 避免用内存中的旧值覆盖并发的更新
+    counter_fields = {'average_rating', 'normalized_rating', 'like_count', 'dislike_count',
+                      'review_count', 'rating_sum', 'rating_count', 'last_review_time'}
+    derived_fields = {'version', 'teachers_display', 'teachers_brief', 'semesters_display',
+                      *counter_fields}
+
     def __str__(self):
         return f"{self.id}-{self.name}-{self.get_teachers()}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.derived_fields
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'classification' not in instance.get_deferred_fields():
+            instance.snapshot_classification()
+        return instance
+
+    def snapshot_classification(self):
+        """记录已入库的分类, 供 signal 更新各分类的课程数量"""
+        self._classification_snapshot = self.classification
+
     def get_name(self):
         return self.name.replace('）', ')').replace('（', '(')
 
@@ -98,6 +151,57 @@ class Course(models.Model):
 
     class Meta:
         ordering = ['school']
+        indexes = [
+            models.Index(normalized_course_name(), name='course_normalized_name_idx'),
+            # 课程列表的游标分页, 索引方向与 CourseList.keyset_orderings 一致; 不筛选分类时用不带分类的索引
+            models.Index(models.F('classification'), course_rating_key().desc(), models.F('like_count'),
+                         models.F('id'), name='course_class_rating_idx'),
+            models.Index(fields=['classification', '-review_count', 'like_count', 'id'],
+                         name='course_class_popular_idx'),
+            models.Index(course_rating_key().desc(), models.F('like_count'), models.F('id'),
+                         name='course_rating_idx'),
+            models.Index(fields=['-review_count', 'like_count', 'id'], name='course_popular_idx'),
+            GinIndex(fields=['search_vector'], name='course_search_vector_idx'),
+            *trigram_indexes('course', 'name', 'pinyin'),
+        ]
+
+
+class CourseRatingStats(models.Model):
+    """全站评分统计, 只有一行, 随评价的增删改增量更新"""
+
+    rating_sum = models.BigIntegerField(default=0, verbose_name='全站评分总和')
+    rating_count = models.IntegerField(default=0, verbose_name='全站评分数量')
+    rated_course_count = models.IntegerField(default=0, verbose_name='有评分的课程数量')
+
+    @classmethod
+    def get(cls):
+        stats, _ = cls.objects.get_or_create(pk=1)
+        return stats
+
+    @classmethod
+    def add(cls, rating_sum, rating_count, rated_course_count):
+        updated = cls.objects.filter(pk=1).update(
+            rating_sum=models.F('rating_sum') + rating_sum,
+            rating_count=models.F('rating_count') + rating_count,
+            rated_course_count=models.F('rated_course_count') + rated_course_count,
+        )
+        if not updated:
+            defaults = {'rating_sum': rating_sum, 'rating_count': rating_count,
+                        'rated_course_count': rated_course_count}
+            stats, created = cls.objects.get_or_create(pk=1, defaults=defaults)
+            if created:
+                return stats
+            return cls.add(rating_sum, rating_count, rated_course_count)
+        return cls.objects.get(pk=1)
+
+    def normalize(self, rating_sum, rating_count):
+        """贝叶斯平均: 以全站平均分和课程平均评价数作为先验"""
+        if self.rated_course_count > 0 and self.rating_count > 0:
+            site_avg_rating = self.rating_sum / self.rating_count
+            site_avg_reviews_count = self.rating_count / self.rated_course_count
+            return ((rating_sum + site_avg_rating * site_avg_reviews_count) /
+                    (rating_count + site_avg_reviews_count))
+        return rating_sum / rating_count if rating_count else 0.0  # 如果没有全站数据，用课程自身平均分
 
 
 class Review(SoftDeleteModel):
@@ -151,6 +255,28 @@ class Review(SoftDeleteModel):
             models.UniqueConstraint(fields=['course', 'created_by'], condition=models.Q(is_deleted=False),
                                     name='unique_review'),
         ]
+        indexes = [
+            models.Index(fields=['course', 'is_deleted', 'create_time', 'id'],
+                         name='review_course_time_idx'),
+            models.Index(fields=['course', 'is_deleted', 'like_count', 'id'],
+                         name='review_course_like_idx'),
+            GinIndex(fields=['search_vector'], name='review_search_vector_idx'),
+            *trigram_indexes('review', 'content', 'pinyin'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not {'course_id', 'rating', 'is_deleted'} & instance.get_deferred_fields():
+            instance.snapshot_rating()
+        return instance
+
+    def snapshot_rating(self):
+        """记录已入库的评分状态, 供 signal 计算评分增量"""
+        self._rating_snapshot = (self.course_id, self.rating_contribution())
+
+    def rating_contribution(self):
+        return (0, 0) if self.is_deleted else (self.rating, 1)
 
 
 class ReviewHistory(SoftDeleteModel):
@@ -169,15 +295,52 @@ class ReviewReply(SoftDeleteModel):
     parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, related_name='children')
 
 
-class ReviewAndReplyLike(models.Model):
+class LikeSnapshotMixin:
+    """记录已入库的 like 值, 供 signal 计算点赞/点踩计数的增量"""
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'like' not in instance.get_deferred_fields():
+            instance.snapshot_like()
+        return instance
+
+    def snapshot_like(self):
+        self._like_snapshot = self.like
+
+    def like_deltas(self, deleted=False):
+        old = getattr(self, '_like_snapshot', None)
+        new = None if deleted else self.like
+        return {'like_count': int(new == 1) - int(old == 1),
+                'dislike_count': int(new == -1) - int(old == -1)}
+
+
+class ReviewAndReplyLike(LikeSnapshotMixin, models.Model):
     review_reply = models.ForeignKey(ReviewReply, on_delete=models.CASCADE, null=True)
     review = models.ForeignKey(Review, on_delete=models.CASCADE)
     create_time = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     like = models.SmallIntegerField(default=0, null=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['review', 'created_by'],
+                                    condition=models.Q(review_reply=None), name='unique_review_like'),
+            models.UniqueConstraint(fields=['review_reply', 'created_by'],
+                                    condition=models.Q(review_reply__isnull=False),
+                                    name='unique_review_reply_like'),
+        ]
+
+
+class ReviewLikeBuffer(models.Model):
+    """写回模式下尚未合并到评价点赞/点踩计数的增量"""
+    review = models.ForeignKey(Review, on_delete=models.CASCADE)
+    like_delta = models.IntegerField(default=0)
+    dislike_delta = models.IntegerField(default=0)
+    create_time = models.DateTimeField(auto_now_add=True)
+
 
-class CourseLike(models.Model):
+class CourseLike(LikeSnapshotMixin, models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, null=True)
     create_time = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -0,0 +1,71 @@
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Count,
+    F,
+    FloatField,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Cast, Coalesce
+
+from course_assessment.models import Course, CourseRatingStats, Review
+
+
+def recompute_course_ratings(batch_size=10000):
+    """
+    全量重算所有课程的评分统计与归一化评分, 返回平均分或归一化评分发生变化的课程数.
+    评价按课程一次 GROUP BY 汇总, 只修正与汇总结果不一致的 rating_sum/rating_count,
+    再用一条 UPDATE 按全站先验写回变化了的平均分与归一化评分
+    """
+    with transaction.atomic():
+        aggregated = {
+            course_id: (rating_sum, rating_count)
+            for course_id, rating_sum, rating_count in Review.objects.order_by()
+            .values('course')
+            .annotate(s=Sum('rating'), c=Count('id'))
+            .values_list('course', 's', 'c')
+        }
+        drifted = [
+            course_id
+            for course_id, rating_sum, rating_count in Course.objects.values_list(
+                'id', 'rating_sum', 'rating_count'
+            )
+            if aggregated.get(course_id, (0, 0)) != (rating_sum, rating_count)
+        ]
+        reviews = Review.objects.filter(course=OuterRef('pk')).order_by().values('course')
+        for start in range(0, len(drifted), batch_size):
+            Course.objects.filter(id__in=drifted[start : start + batch_size]).update(
+                rating_sum=Coalesce(Subquery(reviews.annotate(s=Sum('rating')).values('s')), Value(0)),
+                rating_count=Coalesce(Subquery(reviews.annotate(c=Count('id')).values('c')), Value(0)),
+            )
+
+        stats, _ = CourseRatingStats.objects.update_or_create(
+            pk=1,
+            defaults={
+                'rating_sum': sum(rating_sum for rating_sum, _ in aggregated.values()),
+                'rating_count': sum(rating_count for _, rating_count in aggregated.values()),
+                'rated_course_count': len(aggregated),
+            },
+        )
+
+        rating_sum = Cast('rating_sum', FloatField())
+        average_rating = Case(
+            When(rating_count__gt=0, then=rating_sum / F('rating_count')), default=Value(0.0)
+        )
+        if stats.rated_course_count > 0 and stats.rating_count > 0:
+            # site_avg_rating * site_avg_reviews_count 化简为 rating_sum / rated_course_count
+            prior_sum = stats.rating_sum / stats.rated_course_count
+            prior_count = stats.rating_count / stats.rated_course_count
+            normalized_rating = (rating_sum + Value(prior_sum)) / (
+                F('rating_count') + Value(prior_count)
+            )
+        else:
+            normalized_rating = average_rating
+        return Course.objects.exclude(
+            Q(average_rating=average_rating) & Q(normalized_rating=normalized_rating)
+        ).update(average_rating=average_rating, normalized_rating=normalized_rating)
@@ -1,72 +1,89 @@
+from collections import defaultdict
 from enum import Enum
 
 from django.conf import settings
-from django.contrib.postgres.search import SearchVector
 from django.core.cache import cache
-from django.db.models import Avg, Sum, Count
-from django.db.models.signals import post_save, post_delete, pre_save
+from django.db.models import Count, F
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_save
 from django.dispatch import receiver
 from pypinyin import lazy_pinyin
 
 from common.models import ChatLike, ChatReply, Chat
 from common.signals import soft_delete_signal
 from user.models import User
+from utils.coalescer import add_delta, dirty_flusher, mark_dirty
+from utils.db import update_counters
+from utils.search_cache import search_cache
 from utils.utils import get_cache_key
-from .models import Review, Course, ReviewAndReplyLike, CourseLike, Teacher, ReviewReply
+from .autocomplete import mark_autocomplete_dirty
+from .managers import build_search_vector
+from .counters import ALL_COURSES, course_counter, review_counter
+from .models import Review, Course, ReviewAndReplyLike, CourseLike, Teacher, ReviewReply, \
+    CourseRatingStats, Semeseter
+
+
+def apply_course_rating_delta(course_id, rating_delta, count_delta):
+    """按增量更新课程与全站的评分统计, 开销与评价总数无关"""
+    if course_id is None or (rating_delta == 0 and count_delta == 0):
+        return
+    course_queryset = Course.objects.filter(pk=course_id)
+    course_queryset.update(rating_sum=F('rating_sum') + rating_delta,
+                           rating_count=F('rating_count') + count_delta)
+    course_rating = course_queryset.values_list('rating_sum', 'rating_count').first()
+    rated_course_delta = 0
+    if course_rating is not None:
+        rating_sum, rating_count = course_rating
+        previous_count = rating_count - count_delta
+        rated_course_delta = (int(previous_count <= 0 < rating_count)
+                              - int(rating_count <= 0 < previous_count))
+    stats = CourseRatingStats.add(rating_delta, count_delta, rated_course_delta)
+    if course_rating is not None:
+        course_queryset.update(average_rating=rating_sum / rating_count if rating_count else 0.0,
+                               normalized_rating=stats.normalize(rating_sum, rating_count))
 
 
 @receiver([post_save, post_delete], sender=Review)
-def update_course_average_rating(sender, instance, **kwargs):
-    course = instance.course
-    reviews = Review.objects.filter(course=course)
-    average_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0.0
-    course.average_rating = average_rating
-    course.save()
-
-
-@receiver([post_save, post_delete], sender=Review)
-def update_course_normalized_avg_rating(sender, instance, **kwargs):
-    course = instance.course
-    reviews = Review.objects.filter(course=course)
-    average_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0.0
-
-    # 计算归一化平均分
-    total_courses = Course.objects.filter(review__isnull=False).distinct().count()
-    site_avg_rating = Review.objects.aggregate(Avg('rating'))['rating__avg'] or 0.0
-    site_avg_reviews_count = Review.objects.values('course').annotate(count=Count('id')).aggregate(Avg('count'))[
-                                 'count__avg'] or 0.0
-
-    if total_courses > 0 and site_avg_reviews_count > 0:
-        normalized_rating = (((reviews.aggregate(Sum('rating'))['rating__sum'] or 0) +
-                              (site_avg_rating * site_avg_reviews_count)) /
-                             (reviews.count() + site_avg_reviews_count))
+def update_course_rating(sender, instance, signal, **kwargs):
+    if signal is post_delete:
+        old_course_id, old = getattr(instance, '_rating_snapshot',
+                                     (instance.course_id, instance.rating_contribution()))
+        new = (0, 0)
     else:
-        normalized_rating = average_rating  # 如果没有全站数据，用课程自身平均分
+        old_course_id, old = getattr(instance, '_rating_snapshot', (instance.course_id, (0, 0)))
+        new = instance.rating_contribution()
+        instance.snapshot_rating()
+    review_counter.add(new[1] - old[1])
+    if old_course_id != instance.course_id:
+        mark_dirty('course_rating', old_course_id, (-old[0], -old[1]), merge=add_delta)
+        mark_dirty('course_rating', instance.course_id, new, merge=add_delta)
+    else:
+        delta = (new[0] - old[0], new[1] - old[1])
+        mark_dirty('course_rating', instance.course_id, delta, merge=add_delta)
 
-    course.average_rating = average_rating
-    course.normalized_rating = normalized_rating
-    course.save()
 
+@dirty_flusher('course_rating')
+def flush_course_rating(items):
+    for course_id, (rating_delta, count_delta) in items.items():
+        apply_course_rating_delta(course_id, rating_delta, count_delta)
 
-def update_review_reply_like_dislike_counts(instance):
-    if instance.review and instance.review_reply is None:
-        review = instance.review
-        review.like_count = ReviewAndReplyLike.objects.filter(review=review, review_reply=None, like=1).count()
-        review.dislike_count = ReviewAndReplyLike.objects.filter(review=review, review_reply=None, like=-1).count()
-        review.save()
 
-    if instance.review_reply is not None:
-        review_reply = instance.review_reply
-        review_reply.like_count = ReviewAndReplyLike.objects.filter(review_reply=review_reply, like=1).count()
-        review_reply.dislike_count = ReviewAndReplyLike.objects.filter(review_reply=review_reply, like=-1).count()
-        review_reply.save()
+def update_review_reply_like_dislike_counts(instance, deleted=False):
+    if instance.review_reply_id is not None:
+        post_field, post_model, post_id = 'review_reply', ReviewReply, instance.review_reply_id
+    else:
+        post_field, post_model, post_id = 'review', Review, instance.review_id
+    counts = update_counters(post_model, post_id, **instance.like_deltas(deleted))
+    if counts is not None and instance._meta.get_field(post_field).is_cached(instance):
+        post = getattr(instance, post_field)
+        post.like_count, post.dislike_count = counts['like_count'], counts['dislike_count']
+    instance.counts = counts
+    instance.snapshot_like()
 
 
-def update_course_like_dislike_counts(instance):
-    course = instance.course
-    course.like_count = CourseLike.objects.filter(course=course, like=1).count()
-    course.dislike_count = CourseLike.objects.filter(course=course, like=-1).count()
-    course.save()
+def update_course_like_dislike_counts(instance, deleted=False):
+    counts = update_counters(Course, instance.course_id, **instance.like_deltas(deleted))
+    instance.counts = counts
+    instance.snapshot_like()
 
 
 def update_chat_like_counts(instance: ReviewAndReplyLike, sender):
@@ -86,11 +103,11 @@ def update_chat_like_counts(instance: ReviewAndReplyLike, sender):
         chat_like.raw_post_id = post.id
         chat_like.raw_post_classify = raw_post_classify
         chat_like.raw_post_content = post.content
-        chat_like.raw_post_course = post.course
+        chat_like.raw_post_course = instance.review.course
         chat_like.latest_like_datetime = instance.create_time
         chat_like.receiver = post.created_by
-        chat, _ = Chat.objects.get_or_create(receiver=post.created_by, classify='like',
-                                             sender=User.objects.get(id=settings.DEFAULT_SUPER_USER_ID))
+        chat, _ = Chat.get_or_create_chat(sender=User.objects.get(id=settings.DEFAULT_SUPER_USER_ID),
+                                          receiver=post.created_by, classify='like')
         chat_like.chat_item = chat
         chat_like.save()
 
@@ -121,9 +138,10 @@ def update_chat_reply(instance: ReviewReply, operate: Operate):
                                                   raw_post_classify=raw_post_classify,
                                                   raw_post_id=raw_post_id, raw_post_content=raw_post_content,
                                                   raw_post_course=raw_post_course)
-            reply_notices_count = ChatReply.objects.filter(reply_content=instance, receiver=receiver_user).count()
-            chat, _ = Chat.objects.update_or_create(receiver=receiver_user, classify='reply', sender=None,
-                                                    receiver_unread_count=reply_notices_count)
+            # 未读数由 ChatReply 的 signal 增量维护. sender 为空时唯一约束不生效, 以前可能创建了多个, 取最早的
+            chat = (Chat.objects.filter(receiver=receiver_user, classify='reply', sender=None)
+                    .order_by('pk').first()
+                    or Chat.objects.create(receiver=receiver_user, classify='reply'))
             chat_reply.chat_item = chat
             chat_reply.save()
         elif operate == Operate.DELETE:
@@ -146,27 +164,39 @@ def reply_saved(sender, instance, **kwargs):
 
 @receiver(post_save, sender=ReviewAndReplyLike)
 @receiver(post_delete, sender=ReviewAndReplyLike)
-def review_and_reply_like_changed(sender, instance, **kwargs):
-    update_review_reply_like_dislike_counts(instance)
-    update_chat_like_counts(instance, sender)
+def review_and_reply_like_changed(sender, instance, signal, **kwargs):
+    update_review_reply_like_dislike_counts(instance, deleted=signal is post_delete)
+    if instance.counts is not None:
+        update_chat_like_counts(instance, sender)
+        bump_course_version(instance.review.course_id)
 
 
 @receiver(post_save, sender=CourseLike)
 @receiver(post_delete, sender=CourseLike)
-def course_like_changed(sender, instance, **kwargs):
-    update_course_like_dislike_counts(instance)
+def course_like_changed(sender, instance, signal, **kwargs):
+    update_course_like_dislike_counts(instance, deleted=signal is post_delete)
+    bump_course_version(instance.course_id)
 
 
 @receiver(post_save, sender=Review)
 @receiver(soft_delete_signal, sender=Review)
 def review_created(sender, instance, **kwargs):
-    course = instance.course
-    reviews_of_courses = Review.objects.filter(course=course)
-    semesters = {review.semester for review in reviews_of_courses}
-    course.semester.set(semesters)
-    course.review_count = Review.objects.filter(course=course).count()
-    course.last_review_time = instance.modify_time
-    course.save()
+    mark_dirty('course_reviews', instance.course_id, instance.modify_time, merge=max)
+
+
+@dirty_flusher('course_reviews')
+def flush_course_reviews(items):
+    reviews = Review.objects.filter(course_id__in=items).order_by()
+    review_counts = dict(
+        reviews.values('course').annotate(count=Count('id')).values_list('course', 'count')
+    )
+    semesters = defaultdict(set)
+    for course_id, semester_id in reviews.values_list('course', 'semester').distinct():
+        semesters[course_id].add(semester_id)
+    for course_id, last_review_time in items.items():
+        Course(id=course_id).semester.set(semesters[course_id])
+        Course.objects.filter(pk=course_id).update(review_count=review_counts.get(course_id, 0),
+                                                   last_review_time=last_review_time)
 
 
 @receiver(pre_save, sender=Teacher)
@@ -177,26 +207,75 @@ def update_teacher_pinyin_and_vector(sender, instance, **kwargs):
 @receiver(pre_save, sender=Course)
 def update_course_pinyin_and_vector(sender, instance, **kwargs):
     instance.pinyin = ''.join(lazy_pinyin(instance.name))
+    instance.display_name = instance.get_name()
 
 
-@receiver(post_save, sender=Course)
-@receiver(post_delete, sender=Course)
-def update_course_count(sender, instance, **kwargs):
-    course_classification = instance.classification
-    course_total_key = get_cache_key('total_courses_count')
-    course_classify_total_key = course_total_key + course_classification
-    course_classify_total = Course.objects.filter(classification=course_classification).count()
-    cache.set(course_classify_total_key, course_classify_total, timeout=None)
-    course_total = Course.objects.count()
-    cache.set(course_total_key, course_total, timeout=None)
+def mark_course_card_dirty(course_ids):
+    for course_id in course_ids:
+        mark_dirty('course_card', course_id)
+        bump_course_version(course_id)
 
 
-@receiver(post_save, sender=Review)
-@receiver(soft_delete_signal, sender=Review)
-def update_review_count(sender, instance, **kwargs):
-    review_total_key = get_cache_key('total_review_count')
-    review_total = Review.objects.count()
-    cache.set(review_total_key, review_total, timeout=None)
+@receiver(m2m_changed, sender=Course.teachers.through)
+@receiver(m2m_changed, sender=Course.semester.through)
+def course_m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            mark_course_card_dirty([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        mark_course_card_dirty(pk_set)
+    elif action == 'pre_clear':
+        # 从教师/学期一侧清空时事后无法得知涉及哪些课程, 在清空前记录
+        mark_course_card_dirty(sender.objects.filter(**{instance._meta.model_name: instance})
+                               .values_list('course_id', flat=True))
+
+
+@receiver(post_save, sender=Teacher)
+@receiver(post_save, sender=Semeseter)
+def course_card_source_changed(sender, instance, created, **kwargs):
+    if not created:
+        lookup = 'teachers' if sender is Teacher else 'semester'
+        mark_course_card_dirty(Course.objects.filter(**{lookup: instance}).values_list('id', flat=True))
+
+
+@dirty_flusher('course_card')
+def flush_course_card(items):
+    teachers, semesters = defaultdict(list), defaultdict(list)
+    course_teachers = (Course.teachers.through.objects.filter(course_id__in=items)
+                       .order_by('teacher__school', 'teacher_id')
+                       .values_list('course_id', 'teacher_id', 'teacher__name'))
+    for course_id, teacher_id, teacher_name in course_teachers:
+        teachers[course_id].append({'id': teacher_id, 'name': teacher_name})
+    course_semesters = (Course.semester.through.objects.filter(course_id__in=items)
+                        .order_by('semeseter_id').values_list('course_id', 'semeseter__name'))
+    for course_id, semester_name in course_semesters:
+        semesters[course_id].append(semester_name)
+    courses = list(Course.objects.filter(pk__in=items).only('id'))
+    for course in courses:
+        course.teachers_brief = teachers[course.id]
+        course.teachers_display = ','.join(teacher['name'] for teacher in teachers[course.id])
+        course.semesters_display = ' '.join(semesters[course.id])
+    Course.objects.bulk_update(courses, ['teachers_brief', 'teachers_display', 'semesters_display'])
+    invalidate_search('course')
+
+
+@receiver([post_save, post_delete], sender=Course)
+def update_course_count(sender, instance, signal, **kwargs):
+    old = getattr(instance, '_classification_snapshot', None)
+    new = None if signal is post_delete else instance.classification
+    if old != new:
+        for classification, delta in ((old, -1), (new, 1)):
+            if classification is not None:
+                course_counter.add(delta, classification)
+                course_counter.add(delta, ALL_COURSES)
+    instance.snapshot_classification()
+
+
+@receiver([post_save, post_delete], sender=Teacher)
+@receiver([post_save, post_delete], sender=Course)
+def update_autocomplete(sender, instance, signal, **kwargs):
+    kind = 'course' if sender is Course else 'teacher'
+    mark_autocomplete_dirty(kind, instance, deleted=signal is post_delete)
 
 
 @receiver(pre_save, sender=Review)
@@ -206,20 +285,85 @@ def update_review_pinyin_and_vector(sender, instance, **kwargs):
 
 @receiver(post_save, sender=Teacher)
 def update_teacher_search_vector(sender, instance, **kwargs):
-    Teacher.objects.filter(pk=instance.pk).update(
-        search_vector=SearchVector('name', weight='A') + SearchVector('pinyin', weight='B')
+    mark_dirty('teacher_search_vector', instance.pk)
+
+
+@dirty_flusher('teacher_search_vector')
+def flush_teacher_search_vector(items):
+    Teacher.objects.filter(pk__in=items).update(
+        search_vector=build_search_vector('name')
     )
 
 
 @receiver(post_save, sender=Course)
 def update_course_search_vector(sender, instance, **kwargs):
-    Course.objects.filter(pk=instance.pk).update(
-        search_vector=SearchVector('name', weight='A') + SearchVector('pinyin', weight='B')
+    mark_dirty('course_search_vector', instance.pk)
+
+
+@dirty_flusher('course_search_vector')
+def flush_course_search_vector(items):
+    Course.objects.filter(pk__in=items).update(
+        search_vector=build_search_vector('name')
     )
 
 
 @receiver(post_save, sender=Review)
 def update_review_search_vector(sender, instance, **kwargs):
-    Review.objects.filter(pk=instance.pk).update(
-        search_vector=SearchVector('content', weight='A') + SearchVector('pinyin', weight='B')
+    mark_dirty('review_search_vector', instance.pk)
+
+
+@dirty_flusher('review_search_vector')
+def flush_review_search_vector(items):
+    Review.objects.filter(pk__in=items).update(
+        search_vector=build_search_vector('content')
     )
+
+
+def invalidate_search(*search_types):
+    """事务提交后使这些类型的搜索结果缓存失效, 同一事务内的多次改动只失效一次"""
+    for search_type in search_types:
+        mark_dirty('search_generation', search_type)
+
+
+@receiver([post_save, post_delete], sender=Teacher)
+@receiver([post_save, post_delete], sender=Course)
+@receiver([post_save, post_delete, soft_delete_signal], sender=Review)
+def search_source_changed(sender, instance, **kwargs):
+    # 评价的搜索结果中含有课程名
+    invalidate_search(*{Teacher: ['teacher'], Course: ['course', 'review'], Review: ['review']}[sender])
+
+
+# 需在 search_vector 重算之后执行, 否则期间的搜索会把旧结果缓存到新的代数下
+@dirty_flusher('search_generation')
+def flush_search_generation(items):
+    search_cache.bump_generations(items)
+
+
+def bump_course_version(course_id):
+    """课程详情的公共部分发生变化, 事务提交后递增课程的缓存版本"""
+    if course_id is not None:
+        mark_dirty('course_version', course_id)
+
+
+@receiver([post_save, post_delete], sender=Course)
+def course_changed(sender, instance, **kwargs):
+    bump_course_version(instance.pk)
+
+
+@receiver([post_save, post_delete, soft_delete_signal], sender=Review)
+def review_changed(sender, instance, **kwargs):
+    bump_course_version(instance.course_id)
+
+
+@receiver([post_save, soft_delete_signal], sender=ReviewReply)
+def review_reply_changed(sender, instance, **kwargs):
+    bump_course_version(instance.review.course_id)
+
+
+# 需在其它课程相关的重算之后执行, 故最后注册
+@dirty_flusher('course_version')
+def flush_course_version(items):
+    Course.objects.filter(pk__in=items).update(version=F('version') + 1)
+    course_version_key = get_cache_key('course_version')
+    cache.set_many({f'{course_version_key}{course_id}': version for course_id, version in
+                    Course.objects.filter(pk__in=items).values_list('id', 'version')}, timeout=None)
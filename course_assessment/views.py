@@ -1,10 +1,13 @@
 import logging
-from typing import List
+from collections import defaultdict
+from typing import Dict, List
 
 from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.postgres.aggregates import StringAgg
 from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Count
+from django.db.models import Count, F, Value
 from django.db.models.functions import TruncDate
 from rest_framework import status
 from rest_framework.generics import GenericAPIView
@@ -13,16 +16,19 @@ from rest_framework.response import Response
 from rest_framework.status import HTTP_404_NOT_FOUND
 from rest_framework.views import APIView
 
+from course_assessment.counters import course_counter, review_counter
+from course_assessment.likes import LikeConflictError, merge_pending_review_likes, toggle_course_like, \
+    toggle_review_like
 from course_assessment.models import Course, Review, ReviewHistory, School, Teacher, Semeseter, ReviewReply, \
-    ReviewAndReplyLike, CourseLike
+    ReviewAndReplyLike, CourseLike, course_rating_key, normalized_course_name
 from course_assessment.permissions import CustomPermission
 from course_assessment.serializer import MyReviewSerializer, AddReviewSerializer, AddReviewReplySerializer, \
     DeleteReviewReplySerializer, ReviewAndReplyLikeSerializer, AddCourseSerializer, \
     CourseLikeSerializer, AddTeacherSerializer, DeleteReviewSerializer
 from user.models import User
-from utils.custom_pagination import StandardResultsSetPagination
+from utils.custom_pagination import KeysetPagination, StandardResultsSetPagination
 from utils.throttle import CaptchaAnonRateThrottle, CaptchaUserRateThrottle
-from utils.utils import return_response, get_err_msg, get_msg_msg, userUtils
+from utils.utils import return_response, get_err_msg, get_msg_msg, userUtils, get_cache_key
 
 logger = logging.getLogger(__name__)
 
@@ -30,43 +36,43 @@ logger = logging.getLogger(__name__)
 class CourseList(GenericAPIView):
     permission_classes = [CustomPermission]
     pagination_class = StandardResultsSetPagination
+    # 评分可能为 NULL, 按 annotate 的 rating_key 排序, 与游标及索引中的表达式一致
+    keyset_orderings = {
+        'rating': ('-rating_key', 'like_count', 'id'),
+        'popular': ('-review_count', 'like_count', 'id'),
+    }
 
     def get(self, request):
         course_type = request.query_params.get('course_type', 'all')
         order_by = request.query_params.get('order_by', 'rating')
         course_type = course_type if course_type in {choice[0] for choice in Course.classification_choices} else 'all'
-        order_by = {'rating': '-average_rating', 'popular': '-review_count'}.get(order_by, 'average_rating')
-        total_key = 'total_courses_count' + course_type
-        total = cache.get(total_key)
-        if total is None:
-            total = Course.objects.count() if course_type == 'all' else Course.objects.filter(
-                classification=course_type).count()
-            cache.set(total_key, total, timeout=None)
-        courses = Course.objects.select_related('school').prefetch_related('semester', 'teachers')
+        self.course_type = course_type
+        self.keyset_ordering = self.keyset_orderings.get(order_by, ('rating_key', 'like_count', 'id'))
+        courses = Course.objects.annotate(rating_key=course_rating_key())
         if course_type != 'all':
             courses = courses.filter(classification=course_type)
-        courses = courses.order_by(order_by, 'like_count')
+        if 'cursor' in request.query_params:
+            # 游标模式, 翻页开销与页数无关且不统计总数, 首页传空的 cursor
+            self.pagination_class = KeysetPagination
+        else:
+            courses = courses.order_by(*self.keyset_ordering)
         course_page = self.paginate_queryset(courses)
         courses_list = [{'id': course.id,
-                         'name': course.get_name(),
+                         'name': course.display_name,
                          'classification': course.get_classification(),
-                         'teacher': course.get_teachers(),
-                         'semester': course.get_semester(),
+                         'teacher': course.teachers_display,
+                         'semester': course.semesters_display,
                          'review_count': course.review_count,
                          'average_rating': course.average_rating,
                          'normalized_rating': course.normalized_rating,
                          } for course in course_page]
         return self.get_paginated_response(courses_list)
 
+    def get_total_count(self):
+        return course_counter.get(self.course_type)
 
-class CourseView(APIView):
-    permission_classes = [CustomPermission]
-
-    def get_throttles(self):
-        if self.request.method == 'POST':
-            return [CaptchaAnonRateThrottle(), CaptchaUserRateThrottle()]
-        return []
 
+class CourseReviewMixin:
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.user_likes_cache = {}
@@ -95,32 +101,16 @@ class CourseView(APIView):
         key = (review.id, reply.id if reply else None)
         return self.user_likes_cache.get(key, 0)
 
-    def get(self, request, course_id):
-        try:
-            course = (Course.objects
-                      .select_related('school', 'created_by')
-                      .prefetch_related('teachers', 'semester', 'teachers__school')
-                      .get(id=course_id))
-        except Course.DoesNotExist:
-            return return_response(errors={'course': get_err_msg('course_not_exist')},
-                                   status_code=status.HTTP_404_NOT_FOUND)
-        reviews = (Review.objects.filter(course_id=course_id)
-                   .select_related('created_by', 'semester')
-                   .order_by('-create_time'))
-        self.preload_user_likes(request.user, reviews=reviews)
-        try:
-            if not request.user.is_anonymous:
-                request_user_review = Review.objects.get(course_id=course_id, created_by=request.user)
-                request_user_review_id = request_user_review.id
-            else:
-                request_user_review_id = None
-        except Review.DoesNotExist:
-            request_user_review_id = None
+    def build_reviews_data(self, reviews, user):
+        self.preload_user_likes(user, reviews=reviews)
+        # 一次取出所有评价的回复, 按评价分组, 组内顺序即楼层
+        review_replies: Dict[int, List[ReviewReply]] = defaultdict(list)
+        review_ids = [review.id for review in reviews]
+        for review_reply in (ReviewReply.all_objects.filter(review_id__in=review_ids)
+                             .select_related('created_by').order_by('create_time', 'id')):
+            review_replies[review_reply.review_id].append(review_reply)
         reviews_data = []
         for review in reviews:
-            review_replies: List[ReviewReply] = ReviewReply.all_objects.filter(review=review).select_related(
-                'created_by', 'parent').order_by(
-                'create_time')
             reviews_data.append({
                 'id': review.id,
                 'content': review.content,
@@ -130,14 +120,14 @@ class CourseView(APIView):
                 'edited': review.edited,
                 'like': {'like': review.like_count,
                          'dislike': review.dislike_count,
-                         'user_option': self.get_user_option(review=review, user=request.user)},
+                         'user_option': self.get_user_option(review=review, user=user)},
                 'difficulty': review.difficulty,
                 'grade': review.grade,
                 'homework': review.homework,
                 'reward': review.reward,
                 'semester': review.semester.name,
                 'author': {'id': -1 if (
-                        review.anonymous and review.created_by.id != request.user.id) else review.created_by.id,
+                        review.anonymous and review.created_by.id != user.id) else review.created_by.id,
                            'nickname': get_msg_msg(
                                'anonymous_user_nickname') if review.anonymous else review.created_by.nickname,
                            'avatar': settings.ANONYMOUS_USER_AVATAR_UUID if review.anonymous else review.created_by.avatar_uuid,
@@ -146,25 +136,102 @@ class CourseView(APIView):
                            'floor_number': index + 1,
                            'content': reviewReply.content if not reviewReply.is_deleted else "内容已删除",
                            'created_time': reviewReply.create_time,
-                           'parent': 0 if (reviewReply.parent is None) else reviewReply.parent.id,
+                           'parent': reviewReply.parent_id or 0,
                            'created_by': {'id': reviewReply.created_by.id if not reviewReply.is_deleted else 0,
                                           'name': reviewReply.created_by.nickname if not reviewReply.is_deleted else "未知用户",
                                           'avatar': reviewReply.created_by.avatar_uuid if not reviewReply.is_deleted else ""},
                            'is_deleted': reviewReply.is_deleted, }
-                          for index, reviewReply in enumerate(review_replies)]
+                          for index, reviewReply in enumerate(review_replies[review.id])]
             })
-            reviews_data.sort(key=lambda x: x['created_time'])
+        return reviews_data
+
+
+class CourseView(CourseReviewMixin, APIView):
+    permission_classes = [CustomPermission]
+
+    def get_throttles(self):
+        if self.request.method == 'POST':
+            return [CaptchaAnonRateThrottle(), CaptchaUserRateThrottle()]
+        return []
+
+    def get(self, request, course_id):
+        # reviews=0 时评价通过 CourseReviewsView 分页获取
+        with_reviews = request.query_params.get('reviews', '1') != '0'
+        course_info = self.get_public_course_info(course_id, with_reviews)
+        if course_info is None:
+            return return_response(errors={'course': get_err_msg('course_not_exist')},
+                                   status_code=status.HTTP_404_NOT_FOUND)
+        if not request.user.is_anonymous:
+            self.apply_user_overlay(course_info, request.user)
+        return return_response(contents=course_info)
+
+    def get_public_course_info(self, course_id, with_reviews):
+        """
+        所有访客相同的课程详情, 按课程的 version 缓存, 评价、回复、点赞变化时 version 递增, 旧缓存随之失效.
+        课程信息与评价列表分开缓存, 只要课程信息时不必取出全部评价
+        """
+        course_version_key = f"{get_cache_key('course_version')}{course_id}"
+        version = cache.get(course_version_key)
+        if version is None:
+            version = Course.objects.filter(id=course_id).values_list('version', flat=True).first()
+            if version is None:
+                return None
+            cache.set(course_version_key, version, timeout=None)
+        course_key = f"{get_cache_key('course_document')}{course_id}_{version}"
+        reviews_key = f'{course_key}_reviews'
+        cached = cache.get_many([course_key, reviews_key] if with_reviews else [course_key])
+        course_info = cached.get(course_key)
+        if course_info is None:
+            course_info = self.build_course_info(course_id)
+            if course_info is None:
+                return None
+            cache.set(course_key, course_info)
+        if with_reviews:
+            reviews_data = cached.get(reviews_key)
+            if reviews_data is None:
+                reviews_data = self.build_reviews_data(
+                    merge_pending_review_likes(Review.objects.filter(course_id=course_id)
+                                               .select_related('created_by', 'semester')
+                                               .order_by('create_time')), AnonymousUser())
+                cache.set(reviews_key, reviews_data)
+            course_info['reviews'] = reviews_data
+        return course_info
+
+    def build_course_info(self, course_id):
+        try:
+            course = (Course.objects
+                      .select_related('school', 'created_by')
+                      .prefetch_related('teachers', 'semester', 'teachers__school')
+                      .get(id=course_id))
+        except Course.DoesNotExist:
+            return None
+        teachers = course.teachers.all()
+        # 一次取出所有教师的其它课程
+        teacher_courses = defaultdict(list)
+        other_courses = (Course.teachers.through.objects
+                         .filter(teacher__in=teachers).exclude(course_id=course_id)
+                         .annotate(course_name=normalized_course_name('course__name'))
+                         .order_by('course__school', 'course_id')
+                         .values_list('teacher_id', 'course_id', 'course_name'))
+        for teacher_id, other_course_id, other_course_name in other_courses:
+            teacher_courses[teacher_id].append({'id': other_course_id, 'name': other_course_name})
         teachers_data = []
-        for teacher in course.teachers.all():
+        for teacher in teachers:
             teachers_data.append({
                 'id': teacher.id,
                 'avatar_uuid': teacher.avatar_uuid,
                 'name': teacher.name,
                 'school': teacher.school.get_name() if teacher.school else None,
-                'course': [{'id': course.id, 'name': course.get_name()} for course in
-                           Course.objects.filter(teachers__id=teacher.id) if course.id != course_id]
+                'course': teacher_courses[teacher.id]
             })
-        course_info = {
+        # 同名课程及其教师一次取出, 按规范化后的课程名匹配以命中 course_normalized_name_idx
+        dup_name_courses = (Course.objects.annotate(normalized_name=normalized_course_name())
+                            .filter(normalized_name=course.get_name()).exclude(id=course_id)
+                            .annotate(teacher_names=StringAgg('teachers__name', delimiter=',',
+                                                              ordering='teachers__school',
+                                                              default=Value('')))
+                            .values_list('id', 'teacher_names', 'normalized_rating'))
+        return {
             'id': course_id,
             'code': course.course_code,
             'name': course.get_name(),
@@ -172,18 +239,40 @@ class CourseView(APIView):
             'teachers': teachers_data,
             'semester': [semester.name for semester in course.semester.all()],
             'school': course.school.get_name(),
-            'like': {'like': course.like_count, 'dislike': course.dislike_count,
-                     'user_option': self.get_user_option(review=None, course=course, user=request.user)},
+            'like': {'like': course.like_count, 'dislike': course.dislike_count, 'user_option': 0},
             'rating_avg': f"{course.average_rating:.1f}",
             'normalized_rating_avg': f"{course.normalized_rating:.1f}",
-            'request_user_review_id': request_user_review_id,
-            'reviews': reviews_data,
+            'request_user_review_id': None,
             'other_dup_name_course': [
-                {'course_id': course.id, 'teacher_name': course.get_teachers(), 'rating': course.normalized_rating} for
-                course in
-                Course.objects.filter(name=course.get_name()) if course.id != course_id]
+                {'course_id': dup_course_id, 'teacher_name': teacher_names, 'rating': normalized_rating}
+                for dup_course_id, teacher_names, normalized_rating in dup_name_courses]
         }
-        return return_response(contents=course_info)
+
+    @staticmethod
+    def apply_user_overlay(course_info, user):
+        """用一条查询取出用户对课程与各评价的点赞状态以及自己的评价, 覆盖到公共的课程详情上"""
+        course_id = course_info['id']
+        review_likes = (ReviewAndReplyLike.objects.filter(created_by=user, review__course_id=course_id,
+                                                          review_reply=None)
+                        .annotate(kind=Value('review_like'), target=F('review_id'), option=F('like')))
+        course_likes = (CourseLike.objects.filter(created_by=user, course_id=course_id)
+                        .annotate(kind=Value('course_like'), target=F('course_id'), option=F('like')))
+        own_reviews = (Review.objects.filter(created_by=user, course_id=course_id)
+                       .annotate(kind=Value('review'), target=F('id'), option=Value(0)))
+        review_options = {}
+        for kind, target, option in review_likes.values_list('kind', 'target', 'option').union(
+                course_likes.values_list('kind', 'target', 'option'),
+                own_reviews.values_list('kind', 'target', 'option'), all=True):
+            if kind == 'review_like':
+                review_options[target] = option or 0
+            elif kind == 'course_like':
+                course_info['like']['user_option'] = option or 0
+            else:
+                course_info['request_user_review_id'] = target
+        for review in course_info.get('reviews', []):
+            review['like']['user_option'] = review_options.get(review['id'], 0)
+            if review['id'] == course_info['request_user_review_id'] and review['author']['anonymous']:
+                review['author']['id'] = user.id
 
     def post(self, request):
         serializer = AddCourseSerializer(data=request.data, context={'request': request})
@@ -194,6 +283,27 @@ class CourseView(APIView):
             return return_response(errors=serializer.errors, status_code=status.HTTP_400_BAD_REQUEST)
 
 
+class CourseReviewsView(CourseReviewMixin, GenericAPIView):
+    permission_classes = [CustomPermission]
+    pagination_class = KeysetPagination
+    keyset_orderings = {
+        'new': ('-create_time', '-id'),
+        'top': ('-like_count', '-id'),
+    }
+
+    def get(self, request, course_id):
+        if not Course.objects.filter(id=course_id).exists():
+            return return_response(errors={'course': get_err_msg('course_not_exist')},
+                                   status_code=status.HTTP_404_NOT_FOUND)
+        self.keyset_ordering = self.keyset_orderings.get(request.query_params.get('order', 'new'))
+        if self.keyset_ordering is None:
+            return return_response(errors={'order': get_err_msg('invalid_order')},
+                                   status_code=status.HTTP_400_BAD_REQUEST)
+        reviews = Review.objects.filter(course_id=course_id).select_related('created_by', 'semester')
+        page = merge_pending_review_likes(self.paginate_queryset(reviews))
+        return self.get_paginated_response(self.build_reviews_data(page, request.user))
+
+
 class SchoolView(APIView):
     permission_classes = [AllowAny]
 
@@ -211,7 +321,7 @@ class LatestReviewView(GenericAPIView):
     def get(self, request):
         desc = request.query_params.get('desc', '1')
         review_all_set = Review.objects.all().order_by(('-' if desc == '1' else '') + 'modify_time').select_related(
-            'created_by', 'course', 'course__school').prefetch_related('course__teachers')
+            'created_by', 'course', 'semester')
 
         page = self.paginate_queryset(review_all_set)
         if page is not None:
@@ -220,6 +330,9 @@ class LatestReviewView(GenericAPIView):
 
         return return_response(errors={'review': get_err_msg('review_not_exist')})
 
+    def get_total_count(self):
+        return review_counter.get()
+
     def build_review_list(self, review_page):
         review_list = []
         for review in review_page:
@@ -228,12 +341,12 @@ class LatestReviewView(GenericAPIView):
                 'author': userUtils.get_user_info_in_review(review),
                 'datetime': review.modify_time,
                 'course': {
-                    "name": review.course.get_name(),
+                    "name": review.course.display_name,
                     "id": review.course.id,
                     'semester': review.semester.name,
                 },
                 'content': review.content,
-                "teachers": [{"name": teacher.name, "id": teacher.id} for teacher in review.course.teachers.all()],
+                "teachers": review.course.teachers_brief,
                 'edited': review.edited,
             })
         return review_list
@@ -248,6 +361,7 @@ class ReviewView(APIView):
             return [CaptchaAnonRateThrottle(), CaptchaUserRateThrottle()]
         return []
 
+    @transaction.atomic
     def put(self, request):
         serializer = AddReviewSerializer(data=request.data)
         if serializer.is_valid():
@@ -269,6 +383,7 @@ class ReviewView(APIView):
         else:
             return return_response(errors=serializer.errors, status_code=status.HTTP_400_BAD_REQUEST)
 
+    @transaction.atomic
     def post(self, request):
         serializer = AddReviewSerializer(data=request.data)
         if serializer.is_valid():
@@ -290,14 +405,13 @@ class ReviewView(APIView):
                     reward=serializer.data['reward'],
                     semester=semester,
                 )
-                if semester not in course.semester.all():
-                    course.semester.add(semester)
                 return return_response(message=get_msg_msg('review_create_success'), contents={'review_id': review.id})
             return return_response(contents={'review': review.id}, errors={'review': get_err_msg('review_has_exist')},
                                    status_code=HTTP_404_NOT_FOUND)
         else:
             return return_response(errors=serializer.errors, status_code=status.HTTP_400_BAD_REQUEST)
 
+    @transaction.atomic
     def delete(self, request):
         serializer = DeleteReviewSerializer(data=request.data)
         if serializer.is_valid():
@@ -432,13 +546,13 @@ class MyReviewView(GenericAPIView):
                     Review.objects.filter(created_by=lookup_user_id)
                     .order_by(('-' if desc == '1' else '') + 'modify_time')
                     .select_related('created_by', 'course', 'semester')
-                    .prefetch_related('course__teachers')
                 )
             else:
                 query_set = (
                     ReviewReply.objects.filter(created_by=lookup_user_id)
                     .order_by(('-' if desc == '1' else '') + 'create_time')
-                    .select_related('created_by', 'review')
+                    .select_related('created_by', 'review', 'review__created_by', 'review__course',
+                                    'review__semester')
                 )
             page = self.paginate_queryset(query_set)
             if page is not None:
@@ -457,7 +571,8 @@ class MyReviewView(GenericAPIView):
                 'review': {'author': userUtils.get_user_info_in_review(review_reply.review),
                            'content': review_reply.review.content},
                 'datetime': review_reply.create_time,
-                'course': {"name": review_reply.review.course.get_name(), "id": review_reply.review.course.id,
+                'course': {"name": review_reply.review.course.display_name,
+                           "id": review_reply.review.course.id,
                            'semester': review_reply.review.semester.name, },
                 'reply': {'id': review_reply.review.id, 'content': review_reply.content},
                 'like': {'like': review_reply.like_count, 'dislike': review_reply.dislike_count},
@@ -466,6 +581,7 @@ class MyReviewView(GenericAPIView):
 
     def build_my_review_list(self, my_review_page, is_me: bool):
         my_review_list = []
+        my_review_page = merge_pending_review_likes(my_review_page)
         for review in my_review_page:
             if is_me or not review.anonymous:
                 content_history = MyReviewSerializer(review).data
@@ -474,16 +590,13 @@ class MyReviewView(GenericAPIView):
                     'datetime': review.modify_time,
                     'semester': review.semester.name,
                     'course': {
-                        "name": review.course.get_name(),
+                        "name": review.course.display_name,
                         "id": review.course.id,
                         'semester': review.semester.name,
                     },
                     'like': {'like': review.like_count, 'dislike': review.dislike_count},
                     'content': {"current_content": review.content},
-                    "teachers": [
-                        {"name": teacher.name, "id": teacher.id}
-                        for teacher in review.course.teachers.all()
-                    ],
+                    "teachers": review.course.teachers_brief,
                     'rating': {
                         'rating': review.rating,
                         'difficulty': review.difficulty,
@@ -580,14 +693,6 @@ class ReviewAndReplyLikeView(APIView):
             return [CaptchaAnonRateThrottle(), CaptchaUserRateThrottle()]
         return []
 
-    def like_dislike_count(self, review_object, review_reply_object):
-        if review_reply_object:
-            review_reply_object.refresh_from_db()
-            return {'like': review_reply_object.like_count, 'dislike': review_reply_object.dislike_count}
-        else:
-            review_object.refresh_from_db()
-            return {'like': review_object.like_count, 'dislike': review_object.dislike_count}
-
     def post(self, request):
         serializer = ReviewAndReplyLikeSerializer(data=request.data)
         if serializer.is_valid():
@@ -600,22 +705,13 @@ class ReviewAndReplyLikeView(APIView):
                                        status_code=status.HTTP_404_NOT_FOUND)
 
             try:
-                review_and_reply_like = ReviewAndReplyLike.objects.get(review=review_object, created_by=request.user,
-                                                                       review_reply=review_reply_object)
-            except ReviewAndReplyLike.DoesNotExist:
-                ReviewAndReplyLike.objects.create(review=review_object, review_reply=review_reply_object,
-                                                  like=serializer.validated_data['like_or_dislike'],
-                                                  created_by=request.user)
-                return return_response(contents={'like': self.like_dislike_count(review_object, review_reply_object)})
-
-            if serializer.validated_data['like_or_dislike'] == 0 or serializer.validated_data[
-                'like_or_dislike'] == review_and_reply_like.like:
-                review_and_reply_like.delete()
-            else:
-                review_and_reply_like.like = serializer.validated_data['like_or_dislike']
-                review_and_reply_like.save()
-
-            return return_response(contents={'like': self.like_dislike_count(review_object, review_reply_object)}, )
+                counts = toggle_review_like(review_object, review_reply_object, request.user,
+                                            serializer.validated_data['like_or_dislike'])
+            except LikeConflictError:
+                return return_response(errors={'like': get_err_msg('like_conflict')},
+                                       status_code=status.HTTP_409_CONFLICT)
+            return return_response(contents={'like': {'like': counts['like_count'],
+                                                      'dislike': counts['dislike_count']}})
         else:
             return return_response(errors=serializer.errors, status_code=status.HTTP_400_BAD_REQUEST)
 
@@ -628,23 +724,18 @@ class CourseLikeView(APIView):
             return [CaptchaAnonRateThrottle(), CaptchaUserRateThrottle()]
         return []
 
-    @transaction.atomic
     def post(self, request):
         serializer = CourseLikeSerializer(data=request.data)
         if serializer.is_valid():
             course = Course.objects.get(id=serializer.validated_data['course_id'])
-            course_like, created = CourseLike.objects.get_or_create(
-                course=course,
-                created_by=request.user,
-            )
-            if course_like.like == serializer.validated_data['like']:
-                course_like.delete()
-            else:
-                course_like.like = serializer.validated_data['like']
-                course_like.save()
-            course.refresh_from_db()
+            try:
+                counts = toggle_course_like(course, request.user, serializer.validated_data['like'])
+            except LikeConflictError:
+                return return_response(errors={'like': get_err_msg('like_conflict')},
+                                       status_code=status.HTTP_409_CONFLICT)
             return return_response(contents={'name': course.get_name(), 'id': course.id,
-                                             'like': {'like': course.like_count, 'dislike': course.dislike_count}})
+                                             'like': {'like': counts['like_count'],
+                                                      'dislike': counts['dislike_count']}})
         else:
             return return_response(errors=serializer.errors, status_code=status.HTTP_400_BAD_REQUEST)
 
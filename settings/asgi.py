@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# 需在 Django 初始化之后导入
+from common.stream import MessageStreamApp  # noqa: E402
+
+application = MessageStreamApp(django_application)
@@ -234,6 +234,18 @@ ANONYMOUS_USER_AVATAR_UUID = env('ANONYMOUS_USER_AVATAR_UUID')
 # 站外链接
 RESOURCES_WEBSITE_URL = env('RESOURCES_WEBSITE_URL')
 
+# 评价点赞计数写回模式: 点赞增量先写入缓冲表, 由 flush_like_buffer 定期合并到评价
+REVIEW_LIKE_WRITE_BEHIND = env.bool('REVIEW_LIKE_WRITE_BEHIND', default=False)
+
+# 搜索使用的文本搜索配置, 如基于 zhparser 分词的 chinese; 为空或数据库中没有该配置时使用默认配置
+SEARCH_CONFIG = env('SEARCH_CONFIG', default='')
+
+# 搜索耗时统计: 记录各类搜索的延迟直方图, 超过 SEARCH_SLOW_QUERY_MS 毫秒的语句保存 EXPLAIN 的执行计划
+SEARCH_INSTRUMENTATION = env.bool('SEARCH_INSTRUMENTATION', default=False)
+SEARCH_SLOW_QUERY_MS = env.int('SEARCH_SLOW_QUERY_MS', default=500)
+# 课程/教师/评价搜索每条语句的最长执行时间(毫秒), 超时后退化为前缀匹配, 0 为不限制
+SEARCH_STATEMENT_TIMEOUT_MS = env.int('SEARCH_STATEMENT_TIMEOUT_MS', default=2000)
+
 # 邮箱设置
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.getenv('EMAIL_HOST', "smtp.your.email.server")
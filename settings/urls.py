@@ -27,11 +27,13 @@ from common.views import (
     AboutView,
     CaptchaView,
     TextContentView, MessageBoxView, BulletinListView, MessageUnreadView, CourseTeacherSearchView, IndexView,
+    SearchAutocompleteView, SearchCacheStatsView, SearchStatsView, MessageStreamView,
 )
 from course_assessment.views import (
     MyReviewView,
     ReviewView,
     CourseView,
+    CourseReviewsView,
     TeacherView,
     ReviewReplyView,
     ReviewAndReplyLikeView, CourseList, CourseLikeView, SchoolView,
@@ -55,6 +57,8 @@ api_patterns = [
     path('assessment/latest-review/', LatestReviewView.as_view(), name='latest_review'),
     path('assessment/courselist/', CourseList.as_view(), name='course_list'),
     path('assessment/course/<int:course_id>/', CourseView.as_view(), name='course'),
+    path('assessment/course/<int:course_id>/reviews/', CourseReviewsView.as_view(),
+         name='course_reviews'),
     path('assessment/course/', CourseView.as_view(), name='add_course'),
     path('assessment/course/like/', CourseLikeView.as_view(), name='course_like'),
     path('assessment/teacher/<int:teacher_id>/', TeacherView.as_view(), name='teacher'),
@@ -88,6 +92,7 @@ api_patterns = [
     # 站内信
     path('message/', MessageBoxView.as_view(), name='send_message'),
     path('message/unread/', MessageUnreadView.as_view(), name='unread_message'),
+    path('message/stream/', MessageStreamView.as_view(), name='message_stream'),
     path('message/<str:classify>/<int:chatter_id>', MessageBoxView.as_view(), name='check_particular_message'),
     path('message/<str:classify>/', MessageBoxView.as_view(), name='check_all_message'),
 
@@ -108,6 +113,9 @@ api_patterns = [
 
     # 搜索
     path('search/', CourseTeacherSearchView.as_view(), name='search'),
+    path('search/autocomplete/', SearchAutocompleteView.as_view(), name='search_autocomplete'),
+    path('search/cache-stats/', SearchCacheStatsView.as_view(), name='search_cache_stats'),
+    path('search/stats/', SearchStatsView.as_view(), name='search_stats'),
 ]
 urlpatterns = [
     path('admin/', admin.site.urls),
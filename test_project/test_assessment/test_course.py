@@ -1,9 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
 from django.core.management import call_command
+from django.db import connection, connections
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.test import APITestCase, APIClient, APITransactionTestCase
 
-from course_assessment.models import Semeseter, Teacher, Course
+from course_assessment.counters import course_counter
+from course_assessment.models import Semeseter, Teacher, Course, School
 from test_project.common import create_user, login_user
 
 
@@ -89,6 +97,27 @@ class CourseTests(APITestCase):
         self.assertEqual(course_like_response.data['contents']['like']['like'], 0)
         self.assertEqual(course_like_response.data['contents']['like']['dislike'], 0)
 
+    def test_course_like_conflict(self):
+        self.test_add_course()
+        course = Course.objects.get()
+        # 每次尝试都与并发的点赞冲突时, 重试次数用尽后返回 409 而不是 500
+        with mock.patch('course_assessment.likes.MAX_TOGGLE_ATTEMPTS', 0):
+            course_like_response = self.client.post(self.course_like_url,
+                                                    data={'course_id': course.id, 'like': 1})
+        self.assertEqual(course_like_response.status_code, 409)
+        self.assertEqual(course_like_response.data['errors'][0]['err_code'], 'like_conflict')
+        course.refresh_from_db()
+        self.assertEqual((course.like_count, course.dislike_count), (0, 0))
+
+    def test_reconcile_counters_command(self):
+        self.test_add_course()
+        course = Course.objects.get()
+        self.client.post(self.course_like_url, data={"course_id": course.id, "like": "1"})
+        Course.objects.filter(id=course.id).update(like_count=5, dislike_count=2)
+        call_command('reconcile_counters', stdout=StringIO())
+        course.refresh_from_db()
+        self.assertEqual((course.like_count, course.dislike_count), (1, 0))
+
     def test_course_list(self):
         self.test_add_course()
         course_list_response = self.client.get(self.course_list_url)
@@ -97,3 +126,160 @@ class CourseTests(APITestCase):
         course_list_response = self.client.get(self.course_list_url + '?course_type=pe')
         self.assertEqual(len(course_list_response.data['contents']['courses']), 0)
         self.assertEqual(course_list_response.data['contents']['total'], 0)
+
+    def test_course_teacher_and_dup_name_courses(self):
+        school = School.objects.first()
+
+        def add_course(name, teachers):
+            course = Course.objects.create(name=name, school=school, classification='general')
+            course.teachers.set(teachers)
+            return course
+
+        def get_course_info():
+            # 每次都重新构建公共文档, 以统计缓存未命中时的查询数
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('api:course', args=[course.id]), {'reviews': 0})
+            cache.clear()
+            return response.data['contents'], len(queries)
+
+        teachers = [Teacher.objects.create(name=f'testTeacher{i}', school=school) for i in range(3)]
+        course = add_course('testCourse(上)', teachers[:1])
+        sibling = add_course('siblingCourse（下）', teachers[:1])
+        dup = add_course('testCourse（上）', teachers[1:3])
+        contents, query_count = get_course_info()
+        self.assertEqual(contents['teachers'][0]['course'],
+                         [{'id': sibling.id, 'name': 'siblingCourse(下)'}])
+        self.assertEqual(contents['other_dup_name_course'],
+                         [{'course_id': dup.id, 'teacher_name': 'testTeacher1,testTeacher2',
+                           'rating': 0.0}])
+
+        course.teachers.add(*teachers[1:])
+        add_course('testCourse(上)', [])
+        add_course('otherCourse', teachers)
+        contents, more_query_count = get_course_info()
+        self.assertEqual(more_query_count, query_count)
+        self.assertEqual([len(teacher['course']) for teacher in contents['teachers']], [2, 2, 2])
+        teacher_names = [dup_course['teacher_name'] for dup_course in contents['other_dup_name_course']]
+        self.assertEqual(sorted(teacher_names), ['', 'testTeacher1,testTeacher2'])
+
+    def test_course_list_cursor_pagination(self):
+        school = School.objects.first()
+        # 没有评分(NULL)的课程按 0 分排在最后, 不会在翻页时被跳过或重复
+        stats = [(4.0, 3, 1), (4.0, 1, 5), (2.5, 0, 2), (4.0, 1, 0), (3.0, 2, 5), (2.5, 0, 9),
+                 (None, 0, 3)]
+        courses = [Course.objects.create(name=f'testCourse{i}', school=school, classification='general',
+                                         average_rating=average_rating, like_count=like_count,
+                                         review_count=review_count)
+                   for i, (average_rating, like_count, review_count) in enumerate(stats)]
+        Course.objects.create(name='peCourse', school=school, classification='pe', average_rating=5.0)
+
+        def list_courses(order_by, **params):
+            return self.client.get(self.course_list_url,
+                                   {'order_by': order_by, 'course_type': 'general', **params})
+
+        def walk(order_by):
+            ids, cursor = [], ''
+            while cursor is not None:
+                response = list_courses(order_by, pageSize=2, cursor=cursor)
+                self.assertEqual(response.status_code, 200)
+                ids += [course['id'] for course in response.data['contents']['results']]
+                cursor = response.data['contents']['next']
+            return ids
+
+        self.assertEqual(walk('rating'), [courses[i].id for i in (1, 3, 0, 4, 2, 5, 6)])
+        self.assertEqual(walk('popular'), [courses[i].id for i in (5, 1, 4, 6, 2, 0, 3)])
+        page_response = list_courses('rating', pageSize=7)
+        page_ids = [course['id'] for course in page_response.data['contents']['results']]
+        self.assertEqual(page_ids, walk('rating'))
+        self.assertEqual(self.client.get(self.course_list_url, {'cursor': 'invalid'}).status_code, 400)
+        invalid_page_size_response = self.client.get(self.course_list_url,
+                                                     {'cursor': '', 'pageSize': -3})
+        self.assertEqual(invalid_page_size_response.status_code, 400)
+        self.assertEqual(invalid_page_size_response.data['errors'][0]['err_code'], 'invalid_page_size')
+
+    def test_course_counters(self):
+        school = School.objects.first()
+
+        def counts():
+            return [course_counter.get(classification) for classification in ('all', 'general', 'pe')]
+
+        self.assertEqual(course_counter.get('all'), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            courses = [Course.objects.create(name=f'testCourse{i}', school=school,
+                                             classification='general')
+                       for i in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            courses[0].classification = 'pe'
+            courses[0].save()
+            Course.objects.get(id=courses[1].id).delete()
+        self.assertEqual(counts(), [2, 1, 1])
+        # 列表的总数从计数缓存读取, 不再统计课程表
+        with CaptureQueriesContext(connection) as queries:
+            course_list_response = self.client.get(self.course_list_url, {'course_type': 'general'})
+        self.assertEqual(course_list_response.data['contents']['count'], 1)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'] and
+                          'course_assessment_course' in query['sql']])
+        # 绕过 signal 的批量写入造成的偏差由 rebuild_counters 修复
+        Course.objects.bulk_create([Course(name='bulkCourse', school=school, classification='pe')])
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(counts(), [3, 1, 2])
+
+    def test_course_card_columns(self):
+        school = School.objects.first()
+        teachers = [Teacher.objects.create(name=f'testTeacher{i}', school=school) for i in range(3)]
+        semester = Semeseter.objects.first()
+
+        def card(course):
+            course.refresh_from_db()
+            return (course.display_name, course.teachers_display, course.teachers_brief,
+                    course.semesters_display)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            course = Course.objects.create(name='testCourse（上）', school=school,
+                                           classification='general')
+            course.teachers.add(teachers[0], teachers[1])
+            course.semester.add(semester)
+        teachers_brief = [{'id': teachers[0].id, 'name': 'testTeacher0'},
+                          {'id': teachers[1].id, 'name': 'testTeacher1'}]
+        self.assertEqual(card(course),
+                         ('testCourse(上)', 'testTeacher0,testTeacher1', teachers_brief, semester.name))
+        stale_course = Course.objects.get(id=course.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            teachers[2].books.add(course)
+            course.teachers.remove(teachers[0])
+            teachers[1].name = 'renamedTeacher'
+            teachers[1].save()
+        # 整行保存不会用内存中的旧值覆盖冗余字段
+        stale_course.save()
+        self.assertEqual(card(course)[1], 'renamedTeacher,testTeacher2')
+        with self.captureOnCommitCallbacks(execute=True):
+            teachers[2].books.clear()
+            semester.course_set.clear()
+        teachers_brief = [{'id': teachers[1].id, 'name': 'renamedTeacher'}]
+        self.assertEqual(card(course)[1:], ('renamedTeacher', teachers_brief, ''))
+
+        # 课程列表只查询课程表
+        with CaptureQueriesContext(connection) as queries:
+            course_list_response = self.client.get(self.course_list_url, {'cursor': ''})
+        self.assertEqual(course_list_response.data['contents']['results'][0]['teacher'],
+                         'renamedTeacher')
+        self.assertFalse([query for query in queries if 'course_assessment_teacher' in query['sql'] or
+                          'course_assessment_course_semester' in query['sql']])
+
+
+class CounterConcurrencyTests(APITransactionTestCase):
+    def test_concurrent_flushes_keep_every_delta(self):
+        cache.delete(course_counter.cache_key('general'))
+        self.assertEqual(course_counter.get('general'), 0)
+
+        # 不在事务中时每次 add 立即写回, 多个线程同时写回同一计数
+        def worker(_):
+            try:
+                for _ in range(20):
+                    course_counter.add(1, 'general')
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(worker, range(8)))
+        self.assertEqual(course_counter.get('general'), 160)
@@ -0,0 +1,129 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APITransactionTestCase
+
+from course_assessment.likes import (
+    flush_review_like_buffer,
+    merge_pending_review_likes,
+    toggle_course_like,
+    toggle_review_like,
+)
+from course_assessment.models import (
+    Course,
+    CourseLike,
+    Review,
+    ReviewAndReplyLike,
+    ReviewLikeBuffer,
+    ReviewReply,
+    School,
+    Semeseter,
+    Teacher,
+)
+from test_project.common import create_user
+
+
+class LikeToggleConcurrencyTests(APITransactionTestCase):
+    reset_sequences = True
+
+    def setUp(self):
+        call_command('loaddata', 'school_initial_data.json')
+        call_command('update_semester', start_year=2017)
+        call_command('create_super_user')
+        school = School.objects.first()
+        self.users = [create_user(username=f'user{i}', email=f'user{i}@example.com') for i in range(8)]
+        teacher = Teacher.objects.create(name='testTeacher', school=school)
+        self.course = Course.objects.create(name='testCourse', school=school, classification='general')
+        self.course.teachers.add(teacher)
+        self.review = Review.objects.create(
+            course=self.course, content='test', rating=3, anonymous=False, difficulty=1, grade=1,
+            homework=1, reward=1, semester=Semeseter.objects.first(), created_by=self.users[0],
+        )
+        self.review_reply = ReviewReply.objects.create(review=self.review, content='reply',
+                                                       created_by=self.users[0])
+
+    def hammer(self, toggle, rounds=25):
+        # 每个用户同时由两个线程点击, 以覆盖同一条点赞记录上的插入冲突
+        def worker(user):
+            rng = random.Random(user.id)
+            try:
+                for _ in range(rounds):
+                    toggle(user, rng.choice([1, -1]))
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(worker, self.users * 2))
+
+    def toggle_like(self, user, like):
+        # 每次重新读取评价, 与接口中的用法一致
+        return toggle_review_like(Review.objects.get(id=self.review.id), None, user, like)
+
+    def test_toggle_course_like_concurrently(self):
+        self.hammer(lambda user, like: toggle_course_like(self.course, user, like))
+        self.course.refresh_from_db()
+        likes = CourseLike.objects.filter(course=self.course)
+        self.assertEqual(self.course.like_count, likes.filter(like=1).count())
+        self.assertEqual(self.course.dislike_count, likes.filter(like=-1).count())
+
+    def test_toggle_review_and_reply_like_concurrently(self):
+        def toggle_reply_like(user, like):
+            return toggle_review_like(Review.objects.get(id=self.review.id),
+                                      ReviewReply.objects.get(id=self.review_reply.id), user, like)
+
+        self.hammer(self.toggle_like)
+        self.hammer(toggle_reply_like)
+        self.review.refresh_from_db()
+        self.review_reply.refresh_from_db()
+        review_likes = ReviewAndReplyLike.objects.filter(review=self.review, review_reply=None)
+        reply_likes = ReviewAndReplyLike.objects.filter(review_reply=self.review_reply)
+        self.assertEqual(self.review.like_count, review_likes.filter(like=1).count())
+        self.assertEqual(self.review.dislike_count, review_likes.filter(like=-1).count())
+        self.assertEqual(self.review_reply.like_count, reply_likes.filter(like=1).count())
+        self.assertEqual(self.review_reply.dislike_count, reply_likes.filter(like=-1).count())
+        self.assertLessEqual(review_likes.count(), len(self.users))
+        self.assertLessEqual(reply_likes.count(), len(self.users))
+
+    def test_toggle_course_like(self):
+        user = self.users[1]
+        for like, counts in ((1, (1, 0)), (-1, (0, 1)), (-1, (0, 0))):
+            self.assertEqual(toggle_course_like(self.course, user, like),
+                             {'like_count': counts[0], 'dislike_count': counts[1]})
+        self.assertFalse(CourseLike.objects.filter(course=self.course, created_by=user).exists())
+
+    @override_settings(REVIEW_LIKE_WRITE_BEHIND=True)
+    def test_toggle_review_like_write_behind(self):
+        self.assertEqual(toggle_review_like(self.review, None, self.users[1], 1),
+                         {'like_count': 1, 'dislike_count': 0})
+        self.assertEqual(toggle_review_like(self.review, None, self.users[2], -1),
+                         {'like_count': 1, 'dislike_count': 1})
+        stored = Review.objects.get(id=self.review.id)
+        self.assertEqual((stored.like_count, stored.dislike_count), (0, 0))
+        merged, = merge_pending_review_likes([stored])
+        self.assertEqual((merged.like_count, merged.dislike_count), (1, 1))
+
+        self.hammer(self.toggle_like)
+        flush_review_like_buffer()
+        self.assertFalse(ReviewLikeBuffer.objects.exists())
+        self.review.refresh_from_db()
+        likes = ReviewAndReplyLike.objects.filter(review=self.review, review_reply=None)
+        self.assertEqual(self.review.like_count, likes.filter(like=1).count())
+        self.assertEqual(self.review.dislike_count, likes.filter(like=-1).count())
+
+    @override_settings(REVIEW_LIKE_WRITE_BEHIND=True)
+    def test_flush_like_buffer_invalidates_course_detail(self):
+        course_url = reverse('api:course', args=[self.course.id])
+
+        def review_likes():
+            return self.client.get(course_url).data['contents']['reviews'][0]['like']
+
+        toggle_review_like(self.review, None, self.users[1], 1)
+        self.assertEqual(review_likes()['like'], 1)
+        # 取消点赞后缓冲表中的增量相互抵消, 写回后课程详情同样不能保留合并过的旧计数
+        toggle_review_like(self.review, None, self.users[1], 1)
+        self.assertEqual(flush_review_like_buffer(), 1)
+        self.assertEqual(review_likes()['like'], 0)
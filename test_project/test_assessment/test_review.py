@@ -1,11 +1,23 @@
+from unittest import mock
+
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.management import call_command
+from django.db import connection, transaction
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework.test import APITestCase, APIClient
 
-from course_assessment.models import ReviewHistory, Review, Semeseter
+from course_assessment.counters import review_counter
+from course_assessment.models import (
+    Course,
+    CourseRatingStats,
+    Review,
+    ReviewHistory,
+    ReviewReply,
+    Semeseter,
+)
 from test_project.common import create_user, login_user
 
 
@@ -27,6 +39,11 @@ class ReviewTests(APITestCase):
         course_id = course_response.data['contents']['course_id']
         return course_id
 
+    def create_review(self, created_by, content='test_message', rating=3, **kwargs):
+        return Review.objects.create(course_id=self.course_id, content=content, created_by=created_by,
+                                     rating=rating, difficulty=2, grade=1, homework=2, reward=1,
+                                     semester_id=1, **kwargs)
+
     def setUp(self):
         call_command('flush', '--noinput')
         call_command('loaddata', 'school_initial_data.json')
@@ -37,7 +54,9 @@ class ReviewTests(APITestCase):
         self.user = create_user(is_active=True)
         login_user(self.client)
         self.user_id = self.user.id
-        self.course_id = self.add_teacher_course()
+        # 准备数据时的改动在提交后才重算, 之后的测试只需捕获各自的改动
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course_id = self.add_teacher_course()
 
     def test_add_review(self):
         review_data = {
@@ -87,7 +106,8 @@ class ReviewTests(APITestCase):
 
     def test_delete_review(self):
         review_id, _ = self.test_add_review()
-        delete_review_response = self.client.delete(self.review_url, data={'review_id': review_id})
+        with self.captureOnCommitCallbacks(execute=True):  # 评价总数在事务提交后更新
+            delete_review_response = self.client.delete(self.review_url, data={'review_id': review_id})
         self.assertEqual(delete_review_response.data['contents']['review_id'], review_id)
         latest_review_list_response = self.client.get(self.review_list_url)
         with self.assertRaises(ObjectDoesNotExist):
@@ -124,6 +144,205 @@ class ReviewTests(APITestCase):
         self.assertEqual(review.reward, edit_review_data['reward'])
         self.assertEqual(review.semester_id, edit_review_data['semester'])
         self.assertEqual(review.anonymous, edit_review_data['anonymous'])
+        return review_id, course_id
+
+    def test_course_rating_aggregates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            review_id, course_id = self.test_edit_review()
+        course = Course.objects.get(id=course_id)
+        self.assertEqual((course.rating_sum, course.rating_count), (3, 1))
+        self.assertEqual(course.average_rating, 3.0)
+        self.assertEqual(course.normalized_rating, 3.0)
+
+        userB = create_user(is_active=True, username='test_userB', email='testB@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_review(userB, content='test_message_b', rating=5)
+        # 整行保存不会用内存中的旧计数覆盖原子更新的结果
+        with self.captureOnCommitCallbacks(execute=True):
+            course.save()
+        course.refresh_from_db()
+        self.assertEqual((course.rating_sum, course.rating_count, course.review_count), (8, 2, 2))
+        self.assertEqual(course.average_rating, 4.0)
+        stats = CourseRatingStats.get()
+        self.assertEqual((stats.rating_sum, stats.rating_count, stats.rated_course_count), (8, 2, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(self.review_url, data={'review_id': review_id})
+        course.refresh_from_db()
+        self.assertEqual((course.rating_sum, course.rating_count), (5, 1))
+        self.assertEqual(course.average_rating, 5.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.all_objects.get(id=review_id).restore()
+        course.refresh_from_db()
+        self.assertEqual((course.rating_sum, course.rating_count), (8, 2))
+
+    def test_update_course_rating_command(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            _, course_id = self.test_edit_review()
+        Course.objects.filter(id=course_id).update(rating_sum=0, rating_count=0, average_rating=0.0,
+                                                   normalized_rating=0.0)
+        CourseRatingStats.objects.all().delete()
+        call_command('update_course_rating')
+        course = Course.objects.get(id=course_id)
+        self.assertEqual((course.rating_sum, course.rating_count), (3, 1))
+        self.assertEqual(course.average_rating, 3.0)
+        self.assertEqual(course.normalized_rating, 3.0)
+        stats = CourseRatingStats.get()
+        self.assertEqual((stats.rating_sum, stats.rating_count, stats.rated_course_count), (3, 1, 1))
+
+    def test_add_review_query_count(self):
+        course = Course.objects.get(id=self.course_id)
+
+        def add_review(i, rating=2):
+            user = create_user(is_active=True, username=f'test_user{i}', email=f'test{i}@example.com')
+            return self.create_review(user, content=f'test_message{i}', rating=rating)
+
+        existing = 0
+        for review_total in (1, 10, 50):
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(existing, review_total):
+                    add_review(i)
+            existing = review_total
+            with self.subTest(review_total=review_total):
+                self.assertEqual(review_counter.get(), review_total)
+                user = create_user(is_active=True, username=f'test_userB{existing}',
+                                   email=f'testB{existing}@example.com')
+                # 插入 1 条, 提交时评分增量 5 条, 课程评价数与学期 4 条, 评价总数缓存与咨询锁 6 条,
+                # 搜索向量 1 条, 搜索缓存代数 1 条, 课程缓存版本 6 条, 其余为 savepoint,
+                # 不随课程已有评价数增长
+                with self.assertNumQueries(40), self.captureOnCommitCallbacks(execute=True):
+                    with transaction.atomic():
+                        self.create_review(user, content='test_message_b', rating=4)
+                existing += 1
+                course.refresh_from_db()
+                self.assertEqual((course.review_count, course.rating_count), (existing, existing))
+                self.assertEqual(review_counter.get(), existing)
+                self.assertEqual(list(course.semester.values_list('id', flat=True)), [1])
+
+    def test_rolled_back_savepoint_is_not_flushed(self):
+        course = Course.objects.get(id=self.course_id)
+        userB = create_user(is_active=True, username='test_userB', email='testB@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.create_review(self.user, rating=2)
+                try:
+                    with transaction.atomic():
+                        self.create_review(userB, content='test_message_b', rating=4)
+                        raise ValueError
+                except ValueError:
+                    pass
+        course.refresh_from_db()
+        self.assertEqual((course.review_count, course.rating_sum, course.rating_count), (1, 2, 1))
+
+    def test_failed_flush_is_logged(self):
+        course = Course.objects.get(id=self.course_id)
+        # 重算在提交后执行, 某一类失败只记录日志, 不影响其它类
+        failing_rating = mock.patch('course_assessment.signals.apply_course_rating_delta',
+                                    side_effect=RuntimeError)
+        with failing_rating, self.assertLogs('utils.coalescer', 'ERROR') as logs, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.create_review(self.user, rating=2)
+        self.assertIn('course_rating', logs.output[0])
+        course.refresh_from_db()
+        self.assertEqual((course.review_count, course.rating_count), (1, 0))
+
+    def test_course_view_query_count(self):
+        def add_reviews(start, total):
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(start, start + total):
+                    user = create_user(is_active=True, username=f'test_user{i}',
+                                       email=f'test{i}@example.com')
+                    review = self.create_review(user, content=f'test_message{i}')
+                    ReviewReply.objects.create(review=review, content='reply', created_by=self.user)
+                    ReviewReply.objects.create(review=review, content='reply', created_by=user)
+
+        course_url = reverse('api:course', args=[self.course_id])
+        add_reviews(0, 1)
+        # 缓存未命中时评价与回复各 1 条查询, 与评价数量无关
+        with CaptureQueriesContext(connection) as one_review:
+            self.client.get(course_url)
+        add_reviews(1, 5)
+        with CaptureQueriesContext(connection) as six_reviews:
+            course_response = self.client.get(course_url)
+        self.assertEqual(len(one_review), len(six_reviews))
+        reviews = course_response.data['contents']['reviews']
+        self.assertEqual([review['content'] for review in reviews],
+                         [f'test_message{i}' for i in range(6)])
+        self.assertEqual([[reply['floor_number'] for reply in review['reply']] for review in reviews],
+                         [[1, 2]] * 6)
+        # 命中缓存时匿名用户只有版本号与文档 2 条缓存查询,
+        # 登录用户另有 session、用户与点赞状态 3 条查询
+        with self.assertNumQueries(5):
+            self.assertEqual(self.client.get(course_url).data['contents'],
+                             course_response.data['contents'])
+        with self.assertNumQueries(2):
+            APIClient().get(course_url)
+
+    def test_course_view_cache_invalidation(self):
+        call_command('create_super_user')
+        course_url = reverse('api:course', args=[self.course_id])
+        with self.captureOnCommitCallbacks(execute=True):
+            review = self.create_review(create_user(is_active=True, username='test_userB',
+                                                    email='testB@example.com'), anonymous=True)
+        self.assertEqual(self.client.get(course_url).data['contents']['reviews'][0]['reply'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            ReviewReply.objects.create(review=review, content='reply', created_by=self.user)
+            self.client.post(reverse('api:review_like'),
+                             data={'review_id': review.id, 'reply_id': 0, 'like_or_dislike': 1})
+            self.client.post(reverse('api:course_like'),
+                             data={'course_id': self.course_id, 'like': -1})
+        contents = self.client.get(course_url).data['contents']
+        self.assertEqual(len(contents['reviews'][0]['reply']), 1)
+        self.assertEqual(contents['reviews'][0]['like'], {'like': 1, 'dislike': 0, 'user_option': 1})
+        self.assertEqual(contents['like'], {'like': 0, 'dislike': 1, 'user_option': -1})
+        self.assertIsNone(contents['request_user_review_id'])
+        # 公共文档不含当前用户的状态, 匿名评价的作者只对本人可见
+        anonymous_contents = APIClient().get(course_url).data['contents']
+        self.assertEqual(anonymous_contents['reviews'][0]['like'],
+                         {'like': 1, 'dislike': 0, 'user_option': 0})
+        self.assertEqual(anonymous_contents['like']['user_option'], 0)
+        self.assertEqual(anonymous_contents['reviews'][0]['author']['id'], -1)
+        author_client = APIClient()
+        author_client.force_authenticate(review.created_by)
+        author_contents = author_client.get(course_url).data['contents']
+        self.assertEqual(author_contents['request_user_review_id'], review.id)
+        self.assertEqual(author_contents['reviews'][0]['author']['id'], review.created_by_id)
+
+    def test_course_reviews_cursor_pagination(self):
+        reviews = [self.create_review(create_user(is_active=True, username=f'test_user{i}',
+                                                  email=f'test{i}@example.com'),
+                                      content=f'test_message{i}')
+                   for i in range(5)]
+        for review, like_count in zip(reviews, [3, 1, 3, 0, 2]):
+            Review.objects.filter(id=review.id).update(like_count=like_count)
+        course_reviews_url = reverse('api:course_reviews', args=[self.course_id])
+
+        def walk(order):
+            ids, cursor = [], ''
+            while cursor is not None:
+                response = self.client.get(course_reviews_url,
+                                           {'order': order, 'pageSize': 2, 'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                ids += [review['id'] for review in response.data['contents']['results']]
+                cursor = response.data['contents']['next']
+            return ids
+
+        self.assertEqual(walk('new'), [review.id for review in reversed(reviews)])
+        self.assertEqual(walk('top'), [reviews[i].id for i in (2, 0, 4, 1, 3)])
+        self.assertEqual(self.client.get(course_reviews_url, {'order': 'old'}).status_code, 400)
+        invalid_cursor_response = self.client.get(course_reviews_url, {'cursor': 'invalid'})
+        self.assertEqual(invalid_cursor_response.status_code, 400)
+        self.assertEqual(invalid_cursor_response.data['errors'][0]['field'], 'cursor')
+        self.assertEqual(invalid_cursor_response.data['errors'][0]['err_code'], 'invalid_cursor')
+        for page_size in (0, -3):
+            invalid_page_size_response = self.client.get(course_reviews_url, {'pageSize': page_size})
+            self.assertEqual(invalid_page_size_response.status_code, 400)
+            self.assertEqual(invalid_page_size_response.data['errors'][0]['field'], 'pageSize')
+            self.assertEqual(invalid_page_size_response.data['errors'][0]['err_code'],
+                             'invalid_page_size')
+
+        course_response = self.client.get(reverse('api:course', args=[self.course_id]), {'reviews': 0})
+        self.assertNotIn('reviews', course_response.data['contents'])
 
     def test_my_review(self):
         self.test_edit_review()
@@ -147,7 +366,7 @@ class ReviewTests(APITestCase):
 
     def test_review_like_dislike(self):
         clientB = APIClient()
-        userB = create_user(is_active=True, username='test_userB', email='testB@example.com')
+        create_user(is_active=True, username='test_userB', email='testB@example.com')
         login_user(clientB, user_info_dict={'username': 'test_userB', 'password': 'test_password'})
 
         review_id, _ = self.test_add_review()
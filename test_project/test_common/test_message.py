@@ -1,9 +1,15 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 
-from common.models import Chat
+from common.models import Chat, ChatLike
+from test_project.common import create_user
 
 
 @override_settings(DEBUG=True)
@@ -118,4 +124,90 @@ class MessageTests(APITestCase):
             format='json')
         B_unread_count = self.client_B.get(self.unread_count_url).data['contents']['total']
         self.assertEqual(B_unread_count, 6 - (10 - 6))
+
     # def test_like_notice(self):
+
+
+@override_settings(DEBUG=True)
+class UnreadCountTests(APITestCase):
+    def setUp(self):
+        self.user_A = create_user(username='testUserA', email='userA@example.com', is_active=True)
+        self.user_B = create_user(username='testUserB', email='userB@example.com', is_active=True)
+        self.client_A, self.client_B = APIClient(), APIClient()
+        self.client_A.force_authenticate(self.user_A)
+        self.client_B.force_authenticate(self.user_B)
+        self.send_message_url = reverse('api:send_message')
+        self.unread_count_url = reverse('api:unread_message')
+
+    def unread(self, client):
+        return client.get(self.unread_count_url).data['contents']
+
+    def unread_totals(self):
+        return self.unread(self.client_A)['total'], self.unread(self.client_B)['total']
+
+    def send(self, client, receiver, content):
+        client.post(self.send_message_url, {'receiver': receiver.id, 'content': content}, format='json')
+
+    def read_messages(self, client, chatter):
+        kwargs = {'classify': 'user', 'chatter_id': chatter.id}
+        client.get(reverse('api:check_particular_message', kwargs=kwargs), format='json')
+
+    def test_unread_count_cached(self):
+        for i in range(3):
+            self.send(self.client_A, self.user_B, f'Hello{i}')
+        self.send(self.client_B, self.user_A, 'Hi')
+        Chat.objects.create(receiver=self.user_B, classify='reply', receiver_unread_count=2)
+        with CaptureQueriesContext(connection) as queries:
+            contents = self.unread(self.client_B)
+        self.assertEqual((contents['unread'], contents['total']),
+                         ({'user': 3, 'system': 0, 'like': 0, 'reply': 2}, 5))
+        self.assertEqual(len([query for query in queries if '"common_chat"' in query['sql']]), 1)
+        # 再次请求命中缓存, 不查询 Chat
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.unread(self.client_B)['total'], 5)
+        self.assertFalse([query for query in queries if '"common_chat"' in query['sql']])
+        self.assertEqual(self.unread(self.client_A)['unread']['user'], 1)
+        # 读消息与收到新消息后缓存失效
+        self.read_messages(self.client_B, self.user_A)
+        self.assertEqual(self.unread(self.client_B)['total'], 2)
+        self.send(self.client_B, self.user_A, 'Hi')
+        self.assertEqual(self.unread(self.client_A)['unread']['user'], 2)
+
+    def test_incremental_unread_and_reconcile(self):
+        for i in range(3):
+            self.send(self.client_A, self.user_B, f'Hello{i}')
+        for i in range(2):
+            self.send(self.client_B, self.user_A, f'Hi{i}')
+        self.assertEqual(self.unread_totals(), (2, 3))
+        chat = Chat.get_chat_object(self.user_A, self.user_B)
+        unread_total = chat.receiver_unread_count + chat.sender_unread_count
+        self.assertEqual((chat.last_message_content, unread_total), ('Hi1', 5))
+        self.read_messages(self.client_B, self.user_A)
+        # 再读一次不会重复减少
+        self.read_messages(self.client_B, self.user_A)
+        self.assertEqual(self.unread_totals(), (2, 0))
+
+        like_chat, _ = Chat.get_or_create_chat(
+            sender=self.user_A, receiver=self.user_B, classify='like'
+        )
+        notices = [
+            ChatLike.objects.create(
+                raw_post_classify='review',
+                raw_post_id=i,
+                receiver=self.user_B,
+                chat_item=like_chat,
+                like_count=1,
+            )
+            for i in range(2)
+        ]
+        self.assertEqual(self.unread(self.client_B)['unread']['like'], 2)
+        notices[0].read = True
+        notices[0].save()
+        notices[1].delete()
+        self.assertEqual(self.unread(self.client_B)['unread']['like'], 0)
+
+        Chat.objects.filter(pk=chat.pk).update(sender_unread_count=7, receiver_unread_count=7)
+        output = StringIO()
+        call_command('reconcile_unread_counts', stdout=output)
+        self.assertIn('Repaired unread counters for 1 chats', output.getvalue())
+        self.assertEqual(self.unread_totals(), (2, 0))
@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from common.notifications import broker
+from settings.asgi import application
+from test_project.common import create_user
+
+
+def run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            # sync_to_async 的线程中打开的连接不会随请求结束关闭, 否则无法删除测试数据库
+            await sync_to_async(connections.close_all)()
+
+    return asyncio.run(main())
+
+
+def parse_events(body):
+    events = []
+    for chunk in body.decode().strip().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in chunk.split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+@override_settings(DEBUG=True)
+class MessageStreamTests(TransactionTestCase):
+    def setUp(self):
+        self.user_A = create_user(username='testUserA', email='userA@example.com', is_active=True)
+        self.user_B = create_user(username='testUserB', email='userB@example.com', is_active=True)
+        self.client_A = APIClient()
+        self.client_A.force_authenticate(self.user_A)
+        self.stream_url = reverse('api:message_stream')
+        self.addCleanup(broker.stop)
+
+    async def wait_listening(self):
+        await sync_to_async(broker.listener.listening.wait, thread_sensitive=False)(5)
+
+    def send_message(self, content):
+        self.client_A.post(
+            reverse('api:send_message'), {'receiver': self.user_B.id, 'content': content}, format='json'
+        )
+
+    def test_broker_fan_out(self):
+        async def main():
+            async with broker.subscribe(self.user_B.id) as first, broker.subscribe(
+                self.user_B.id
+            ) as second, broker.subscribe(self.user_A.id) as other:
+                self.assertEqual(broker.connection_count(), 3)
+                await self.wait_listening()
+                # 请求在其它线程中提交, 监听线程收到 NOTIFY 后转发给 B 的两个连接
+                await sync_to_async(self.send_message)('Hello')
+                events = [await asyncio.wait_for(queue.get(), 5) for queue in (first, second)]
+                self.assertTrue(other.empty())
+            self.assertEqual(broker.connection_count(), 0)
+            return events
+
+        events = run(main())
+        self.assertEqual(events[0], events[1])
+        self.assertEqual(
+            (events[0]['type'], events[0]['content'], events[0]['created_by']),
+            ('message', 'Hello', self.user_A.id),
+        )
+
+    def open_stream(self, session_key=None):
+        """直接调用 ASGI application, 返回响应消息的队列与模拟客户端断开的 Future"""
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'.encode() if session_key else b''
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': self.stream_url,
+            'headers': [(b'cookie', cookie)],
+        }
+        messages, disconnect = asyncio.Queue(), asyncio.get_running_loop().create_future()
+
+        async def receive():
+            await disconnect
+            return {'type': 'http.disconnect'}
+
+        task = asyncio.create_task(application(scope, receive, messages.put))
+        return messages, disconnect, task
+
+    def test_stream(self):
+        self.client.force_login(self.user_B)
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+
+        async def main():
+            messages, disconnect, task = self.open_stream(session_key)
+            start = await messages.get()
+            self.assertEqual(
+                (start['status'], dict(start['headers'])[b'content-type']), (200, b'text/event-stream')
+            )
+            self.assertEqual((await messages.get())['body'], b'retry: 5000\n\n')
+            self.assertEqual(
+                parse_events((await messages.get())['body']),
+                [('unread', {'unread': {'user': 0, 'system': 0, 'like': 0, 'reply': 0}, 'total': 0})],
+            )
+            await self.wait_listening()
+            await sync_to_async(self.send_message)('Hello')
+            events = parse_events((await asyncio.wait_for(messages.get(), 5))['body'])
+            disconnect.set_result(None)
+            await asyncio.wait_for(task, 5)
+            return events
+
+        (message_type, message), (unread_type, unread) = run(main())
+        self.assertEqual(
+            (message_type, message['content'], unread_type), ('message', 'Hello', 'unread')
+        )
+        self.assertEqual(unread['unread']['user'], 1)
+        self.assertEqual(broker.connection_count(), 0)
+
+    def test_requires_login_and_asgi(self):
+        async def main():
+            messages, _, task = self.open_stream('invalid')
+            await asyncio.wait_for(task, 5)
+            return await messages.get(), await messages.get()
+
+        start, body = run(main())
+        self.assertEqual(start['status'], 401)
+        self.assertEqual(json.loads(body['body'])['errors'][0]['err_code'], 'not_login')
+        # 没有通过 ASGI 部署时由 Django 的视图返回
+        self.client_A.force_login(self.user_A)
+        self.assertEqual(self.client_A.get(self.stream_url).status_code, 501)
@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase
+
+from common.resources.client import CircuitBreaker, ResourceSearchClient
+from utils.search_cache import search_cache
+
+
+class StubResourceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server.requests.append((self.client_address, body))
+        if server.delay:
+            time.sleep(server.delay)
+        if server.status != 200:
+            payload = b'error'
+        elif server.malformed:
+            payload = json.dumps(
+                {'code': 200, 'data': {'content': [{'name': body['keywords']}]}}
+            ).encode()
+        else:
+            payload = json.dumps(
+                {
+                    'code': 200,
+                    'data': {
+                        'total': 3,
+                        'content': [
+                            {
+                                'name': f"{body['keywords']}.pdf",
+                                'size': 1024,
+                                'parent': '/docs',
+                                'is_dir': False,
+                            },
+                            {'name': body['keywords'], 'size': 0, 'parent': '/', 'is_dir': True},
+                        ],
+                    },
+                }
+            ).encode()
+        self.send_response(server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ResourceSearchTests(APITestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubResourceHandler)
+        self.server.requests, self.server.delay, self.server.status, self.server.malformed = (
+            [],
+            0,
+            200,
+            False,
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+        search_cache.clear()
+        self.addCleanup(search_cache.clear)
+
+    def test_search(self):
+        client = ResourceSearchClient(self.base_url)
+        page_info, files = client.search('高数', 1, 2)
+        self.assertEqual(
+            files[0],
+            {
+                'name': '高数.pdf',
+                'size': 1024,
+                'path': '/docs',
+                'type': 'file',
+                'url': f'{self.base_url}/docs',
+            },
+        )
+        self.assertEqual((page_info['total_pages'], page_info['has_next']), (2, True))
+        self.assertNotIn('degraded', page_info)
+        # 命中缓存不再请求资源站
+        self.assertEqual(client.search('高数', 1, 2), (page_info, files))
+        self.assertEqual(len(self.server.requests), 1)
+        # 不同的搜索复用同一个连接
+        client.search('线代', 1, 2)
+        self.assertEqual(len({address for address, _ in self.server.requests}), 1)
+
+        with override_settings(RESOURCES_WEBSITE_URL=self.base_url):
+            response = APIClient().post(
+                reverse('api:search'), data={'type': 'resource', 'keyword': '概率论'}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['contents']['search_result'][1]['name'], '概率论')
+        self.assertEqual(self.server.requests[-1][1]['keywords'], '概率论')
+
+    def test_timeout_degrades(self):
+        self.server.delay = 1
+        client = ResourceSearchClient(self.base_url, read_timeout=0.1)
+        start = time.monotonic()
+        page_info, files = client.search('高数', 1, 10)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual((page_info['degraded'], page_info['total_count'], files), (True, 0, []))
+        # 降级的结果不缓存
+        self.server.delay = 0
+        self.assertEqual(len(client.search('高数', 1, 10)[1]), 2)
+
+    def test_circuit_breaker(self):
+        self.server.status = 500
+        client = ResourceSearchClient(
+            self.base_url, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+        )
+        for keyword in ('a', 'b', 'c'):
+            self.assertTrue(client.search(keyword, 1, 10)[0]['degraded'])
+        # 熔断后不再请求资源站
+        self.assertEqual(len(self.server.requests), 2)
+        time.sleep(0.3)
+        # 试探请求失败, 继续熔断
+        self.assertTrue(client.search('d', 1, 10)[0]['degraded'])
+        self.assertTrue(client.search('e', 1, 10)[0]['degraded'])
+        self.assertEqual(len(self.server.requests), 3)
+        self.server.status = 200
+        time.sleep(0.3)
+        self.assertNotIn('degraded', client.search('f', 1, 10)[0])
+        self.assertNotIn('degraded', client.search('g', 1, 10)[0])
+        self.assertEqual(len(self.server.requests), 5)
+
+    def test_malformed_payload_degrades(self):
+        self.server.malformed = True
+        client = ResourceSearchClient(
+            self.base_url, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+        )
+        self.assertTrue(client.search('a', 1, 10)[0]['degraded'])
+        time.sleep(0.3)
+        # 试探请求收到格式错误的响应, 计为失败并重新熔断, 而不是停留在试探中
+        self.assertTrue(client.search('b', 1, 10)[0]['degraded'])
+        self.assertFalse(client.breaker.probing)
+        self.server.malformed = False
+        time.sleep(0.3)
+        self.assertNotIn('degraded', client.search('c', 1, 10)[0])
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_local_errors_do_not_open_breaker(self):
+        client = ResourceSearchClient(
+            self.base_url, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        )
+        # 非法的分页参数在请求资源站之前拒绝
+        for current_page, page_size in ((1, 0), (1, -3), (0, 10)):
+            with self.assertRaises(ValueError):
+                client.search('a', current_page, page_size)
+        self.assertEqual(self.server.requests, [])
+        # 本地的错误与 4xx 响应都不计入熔断
+        with mock.patch.object(ResourceSearchClient, 'parse', side_effect=ZeroDivisionError):
+            with self.assertRaises(ZeroDivisionError):
+                client.search('b', 1, 10)
+        self.server.status = 404
+        self.assertTrue(client.search('c', 1, 10)[0]['degraded'])
+        self.server.status = 200
+        self.assertNotIn('degraded', client.search('d', 1, 10)[0])
+        self.assertEqual((len(self.server.requests), client.breaker.failures), (3, 0))
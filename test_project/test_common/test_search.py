@@ -0,0 +1,410 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from common import search
+from course_assessment.autocomplete import AutocompleteIndex, autocomplete_index
+from course_assessment.managers import get_search_config
+from course_assessment.models import Course, Review, School, Semeseter, Teacher
+from test_project.common import create_user
+from utils.search_cache import search_cache
+from utils.search_stats import (
+    LATENCY_BUCKETS,
+    get_search_stats,
+    incr_counter,
+    latency_key,
+)
+
+COURSE_NAMES = ('高等数学', '线性代数', '数学建模', '大学英语')
+REVIEW_CONTENT = '老师讲得很好, 高数基础一般也能听懂'
+
+
+def create_course(name):
+    return Course.objects.create(name=name, school=School.objects.first(), classification='general')
+
+
+def create_review(course, content, created_by):
+    return Review.objects.create(
+        course=course,
+        content=content,
+        rating=5,
+        difficulty=1,
+        grade=1,
+        homework=1,
+        reward=1,
+        semester=Semeseter.objects.first(),
+        created_by=created_by,
+    )
+
+
+def create_search_data(test_case, commit):
+    """commit 为保证事务提交后的回调执行的上下文"""
+    call_command('loaddata', 'school_initial_data.json')
+    call_command('update_semester', start_year=2017)
+    with commit:
+        test_case.courses = [create_course(name) for name in COURSE_NAMES]
+        create_review(test_case.courses[3], REVIEW_CONTENT, create_user(is_active=True))
+
+
+@override_settings(DEBUG=True)
+class SearchTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.search_url = reverse('api:search')
+        # 进程内的缓存不随测试事务回滚
+        search_cache.clear()
+        self.addCleanup(search_cache.clear)
+        create_search_data(self, self.captureOnCommitCallbacks(execute=True))
+
+    def search(self, search_type, keyword, **data):
+        response = self.client.post(
+            self.search_url, data={'type': search_type, 'keyword': keyword, **data}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.data['contents']
+
+    def test_search(self):
+        contents = self.search('course', '数学')
+        self.assertEqual(
+            {course['id'] for course in contents['search_result']},
+            {self.courses[0].id, self.courses[2].id},
+        )
+        self.assertEqual(contents['total_count'], 2)
+        # 拼音匹配
+        self.assertEqual(
+            [course['id'] for course in self.search('course', 'xianxing')['search_result']],
+            [self.courses[1].id],
+        )
+        self.assertEqual(self.search('review', '高数')['total_count'], 1)
+
+    def test_search_count_without_rank(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.search('course', '数学', page_size=1)
+        count_queries = [
+            query['sql']
+            for query in queries
+            if 'COUNT(' in query['sql'] and 'course_assessment_course' in query['sql']
+        ]
+        self.assertEqual(len(count_queries), 1)
+        self.assertNotIn('SIMILARITY', count_queries[0].upper())
+        self.assertNotIn('TO_TSVECTOR', count_queries[0].upper())
+
+    def test_search_config(self):
+        # 测试库没有 zhparser, 用内置的 simple 配置代替分词配置
+        with override_settings(SEARCH_CONFIG='simple'):
+            call_command('rebuild_search_vectors', batch_size=1, stdout=StringIO())
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.search('review', '高数')['total_count'], 1)
+                contents = self.search('course', '数学')
+            self.assertEqual(
+                {course['id'] for course in contents['search_result']},
+                {self.courses[0].id, self.courses[2].id},
+            )
+            self.assertTrue(any('TS_RANK_CD' in query['sql'].upper() for query in queries))
+        # 配置不存在时退回默认配置
+        cache.clear()
+        search_cache.clear()
+        with override_settings(SEARCH_CONFIG='missing_config'), self.assertLogs(
+            'course_assessment.managers'
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.search('course', '数学')['total_count'], 2)
+            self.assertFalse(any('REGCONFIG' in query['sql'].upper() for query in queries))
+        # 启动后创建的配置在检查结果过期后生效
+        with override_settings(SEARCH_CONFIG='late_config'), self.assertLogs(
+            'course_assessment.managers'
+        ):
+            self.assertIsNone(get_search_config())
+            with connection.cursor() as cursor:
+                cursor.execute('CREATE TEXT SEARCH CONFIGURATION late_config (COPY = simple)')
+            self.assertIsNone(get_search_config())
+            with mock.patch('course_assessment.managers.SEARCH_CONFIG_CHECK_INTERVAL', 0):
+                self.assertEqual(get_search_config(), 'late_config')
+
+    def test_autocomplete(self):
+        # 索引是进程级的, 不随测试事务回滚
+        autocomplete_index.clear()
+        self.addCleanup(autocomplete_index.clear)
+        url = reverse('api:search_autocomplete')
+
+        def complete(keyword, **params):
+            response = self.client.get(url, {'keyword': keyword, **params})
+            self.assertEqual(response.status_code, 200)
+            return [
+                (suggestion['type'], suggestion['name'])
+                for suggestion in response.data['contents']['suggestions']
+            ]
+
+        self.assertEqual(complete('gdsx'), [('course', '高等数学')])
+        self.assertEqual(complete('Shu'), [('course', '数学建模')])
+        self.assertEqual(complete('高等'), [('course', '高等数学')])
+        self.assertEqual(complete('x', limit=1), [('course', '线性代数')])
+        with self.captureOnCommitCallbacks(execute=True):
+            teacher = Teacher.objects.create(name='高翔')
+            create_course('高等数学')
+            self.courses[1].name = '高级语言程序设计'
+            self.courses[1].save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                complete('g'), [('course', '高等数学'), ('course', '高级语言程序设计'), ('teacher', '高翔')]
+            )
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(complete('gx', type='teacher'), [('teacher', '高翔')])
+        self.assertEqual(complete('xxds'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            teacher.delete()
+            self.courses[0].delete()
+        # 同名课程仍有一门, 补全保留
+        self.assertEqual(complete('g'), [('course', '高等数学'), ('course', '高级语言程序设计')])
+        self.assertEqual(self.client.get(url, {'keyword': 'g', 'limit': 0}).status_code, 400)
+
+    def test_autocomplete_builds_once(self):
+        index = AutocompleteIndex()
+
+        def slow_build():
+            time.sleep(0.2)
+            index.load([('course', 1, '高等数学')])
+
+        # 并发的首次查询只建立一次索引, 且都能读到建立后的结果
+        with mock.patch.object(index, 'build', side_effect=slow_build) as build:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(lambda _: index.complete('gd'), range(8)))
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(results, [[{'type': 'course', 'name': '高等数学'}]] * 8)
+
+    def test_search_cache(self):
+        self.assertEqual(self.search('course', '数学')['total_count'], 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.search('course', ' 数学')['total_count'], 2)
+        # 命中进程内缓存时代数也从进程内读取, 不再查询课程表与共享缓存
+        self.assertFalse(
+            any(
+                'course_assessment_course' in query['sql'] or 'search_' in query['sql']
+                for query in queries
+            )
+        )
+        search_cache.local.clear()
+        self.assertEqual(self.search('course', '数学')['total_count'], 2)
+        self.assertEqual(
+            (search_cache.local_hits, search_cache.shared_hits, search_cache.misses), (1, 1, 1)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            course = create_course('离散数学')
+        self.assertEqual(self.search('course', '数学')['total_count'], 3)
+        self.assertEqual(search_cache.misses, 2)
+        # 课程改名后评价搜索结果中的课程名也需更新
+        self.assertEqual(self.search('review', '高数')['search_result'][0]['course']['name'], '大学英语')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.courses[3].name = '大学英语一'
+            self.courses[3].save()
+        self.assertEqual(self.search('review', '高数')['search_result'][0]['course']['name'], '大学英语一')
+        with self.captureOnCommitCallbacks(execute=True):
+            course.teachers.add(Teacher.objects.create(name='testTeacher'))
+        self.assertIn(
+            'testTeacher',
+            [result['teacher'] for result in self.search('course', '数学')['search_result']],
+        )
+
+        stats_url = reverse('api:search_cache_stats')
+        self.assertIn(self.client.get(stats_url).status_code, (401, 403))
+        self.client.force_authenticate(
+            create_user(username='staff', email='staff@example.com', is_staff=True)
+        )
+        response = self.client.get(stats_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['contents']['misses'], search_cache.misses)
+
+    def test_search_all(self):
+        Teacher.objects.create(name='数学老师', school=School.objects.first())
+        contents = self.search('all', '数学', page_size=1)['search_result']
+        self.assertEqual(contents['course']['total_count'], 2)
+        self.assertEqual(len(contents['course']['search_result']), 1)
+        self.assertEqual(contents['teacher']['search_result'][0]['name'], '数学老师')
+        self.assertEqual(contents['review']['total_count'], 0)
+        # 与单独搜索共用缓存
+        self.assertEqual(
+            self.search('course', '数学', page_size=1)['search_result'],
+            contents['course']['search_result'],
+        )
+        self.assertEqual(search_cache.local_hits, 1)
+        # 分页参数需为正数且有上限
+        for data in ({'page_size': 0}, {'page_size': 101}, {'current_page': 0}):
+            response = self.client.post(self.search_url, data={'type': 'all', 'keyword': '数学', **data})
+            self.assertEqual(response.status_code, 400)
+
+    def test_review_snippet_and_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, course in enumerate(self.courses[:3]):
+                content = '前言' * 100 + f'第{i}条, 高数老师讲得好' + '后记' * 100
+                user = create_user(username=f'snippet_{i}', email=f'snippet_{i}@example.com')
+                create_review(course, content, user)
+        pages = [self.search('review', '高数', page_size=2, current_page=page) for page in (1, 2)]
+        self.assertEqual([page['current_page'] for page in pages], [1, 2])
+        self.assertEqual(len({review['id'] for page in pages for review in page['search_result']}), 4)
+        long_review = next(
+            review
+            for review in pages[0]['search_result'] + pages[1]['search_result']
+            if review['id'] != self.courses[3].review_set.get().id
+        )
+        self.assertNotIn('content', long_review)
+        snippet = long_review['snippet']
+        self.assertLessEqual(len(snippet['text']), 80)
+        start, end = snippet['highlights'][0]
+        self.assertEqual(snippet['text'][start:end], '高数')
+        content = Review.objects.get(id=long_review['id']).content
+        offset = snippet['offset']
+        self.assertEqual(content[offset : offset + len(snippet['text'])], snippet['text'])
+        # 拼音匹配时高亮对应的汉字
+        snippet = self.search('review', 'GaoShu', page_size=1)['search_result'][0]['snippet']
+        start, end = snippet['highlights'][0]
+        self.assertEqual(snippet['text'][start:end], '高数')
+        review = self.search('review', '高数', page_size=1, full_content=True)['search_result'][0]
+        self.assertEqual(review['content'], Review.objects.get(id=review['id']).content)
+
+    def test_search_stats(self):
+        Teacher.objects.create(name='数学老师', school=School.objects.first())
+        self.search('course', '数学')
+        self.assertEqual(
+            get_search_stats()['latency_ms']['course'], {str(bucket): 0 for bucket in LATENCY_BUCKETS}
+        )
+        with override_settings(SEARCH_INSTRUMENTATION=True, SEARCH_SLOW_QUERY_MS=0):
+            self.search('teacher', ' ShuXue ')
+            self.search('review', '高数')
+        stats = get_search_stats()
+        self.assertEqual(sum(stats['latency_ms']['teacher'].values()), 1)
+        self.assertEqual(sum(stats['latency_ms']['review'].values()), 1)
+        # 分页总数与当前页两条语句
+        self.assertEqual(
+            [(entry['type'], entry['keyword']) for entry in stats['slow_queries']],
+            [('teacher', 'shuxue')] * 2 + [('review', '高数')] * 2,
+        )
+        # 只生成执行计划, 不再次执行慢查询
+        self.assertIn('cost=', stats['slow_queries'][0]['plan'])
+        self.assertNotIn('actual time', stats['slow_queries'][0]['plan'])
+
+        stats_url = reverse('api:search_stats')
+        self.assertIn(self.client.get(stats_url).status_code, (401, 403))
+        self.client.force_authenticate(
+            create_user(username='staff', email='staff@example.com', is_staff=True)
+        )
+        response = self.client.get(stats_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['contents']['slow_queries']), 4)
+        output = StringIO()
+        call_command('dump_search_stats', clear=True, stdout=output)
+        self.assertIn('4 slow queries', output.getvalue())
+        self.assertEqual(get_search_stats()['slow_queries'], [])
+
+    def test_failed_search_is_recorded(self):
+        with override_settings(SEARCH_INSTRUMENTATION=True), mock.patch(
+            'course_assessment.managers.SearchQuerySet.search_filter', side_effect=ValueError
+        ):
+            with self.assertRaises(ValueError):
+                Course.objects.search('数学')
+        stats = get_search_stats()
+        self.assertEqual(sum(stats['latency_ms']['course'].values()), 1)
+        self.assertEqual(stats['outcomes']['course'], {'degraded': 0, 'failed': 1})
+
+    def test_search_timeout_degrades(self):
+        def slow_ranking(execute, sql, params, many, context):
+            # 在完整搜索的语句前执行一条超时的语句, 模拟排序过慢被取消
+            if 'SIMILARITY' in sql.upper():
+                execute('SELECT pg_sleep(1)', None, False, context)
+            return execute(sql, params, many, context)
+
+        with override_settings(SEARCH_STATEMENT_TIMEOUT_MS=100), connection.execute_wrapper(
+            slow_ranking
+        ):
+            with override_settings(SEARCH_INSTRUMENTATION=True, SEARCH_SLOW_QUERY_MS=50):
+                contents = self.search('course', '高等')
+            self.assertEqual(
+                ([course['id'] for course in contents['search_result']], contents['degraded']),
+                ([self.courses[0].id], True),
+            )
+            # 超时的搜索同样计入统计
+            stats = get_search_stats()
+            self.assertEqual(
+                (sum(stats['latency_ms']['course'].values()), stats['outcomes']['course']['degraded']),
+                (1, 1),
+            )
+            self.assertEqual(
+                [
+                    (entry['outcome'], entry['timed_out'], entry['sql'])
+                    for entry in stats['slow_queries']
+                ],
+                [('degraded', True, 'SELECT pg_sleep(1)')],
+            )
+            # 退化搜索只按名称或拼音前缀匹配
+            self.assertEqual(
+                [course['id'] for course in self.search('course', 'ShuXue')['search_result']],
+                [self.courses[2].id],
+            )
+            self.assertEqual(self.search('course', '代数')['search_result'], [])
+            contents = self.search('review', '高数', page_size=1)
+            self.assertEqual(
+                (contents['total_count'], contents['has_next'], contents['degraded']), (1, False, True)
+            )
+            self.assertIn('snippet', contents['search_result'][0])
+        # 退化的结果不缓存, 恢复后重新完整搜索
+        contents = self.search('course', '数学')
+        self.assertNotIn('degraded', contents)
+        self.assertEqual(contents['total_count'], 2)
+
+
+@override_settings(DEBUG=True)
+class ConcurrentSearchTests(APITransactionTestCase):
+    """合并搜索在事务外才会并发, 各线程的连接需看到已提交的数据"""
+
+    def setUp(self):
+        search_cache.clear()
+        self.addCleanup(search_cache.clear)
+        # 缓存表不随 TransactionTestCase 清空
+        self.addCleanup(cache.clear)
+        # 线程池中的连接保持打开, 结束时关闭, 否则无法删除测试数据库
+        self.addCleanup(search.close_pool_connections)
+        create_search_data(self, transaction.atomic())
+
+    def test_search_all(self):
+        with mock.patch('common.search._run_in_pool', wraps=search._run_in_pool) as run:
+            response = APIClient().post(
+                reverse('api:search'), data={'type': 'all', 'keyword': 'gaoshu'}
+            )
+        self.assertEqual(response.status_code, 200)
+        contents = response.data['contents']['search_result']
+        self.assertEqual([course['name'] for course in contents['course']['search_result']], [])
+        self.assertEqual(contents['review']['search_result'][0]['course']['name'], '大学英语')
+        self.assertEqual(contents['teacher']['total_count'], 0)
+        # 课程与教师在线程池中搜索, 搜索结束后线程的连接保留, 供之后的搜索复用
+        self.assertEqual(run.call_count, 2)
+        self.assertTrue(search._pool_connections)
+        self.assertTrue(
+            all(
+                pool_connection.connection is not None and not pool_connection.connection.closed
+                for pool_connection in search._pool_connections
+            )
+        )
+
+    def test_concurrent_stats_keep_every_count(self):
+        key = latency_key('course', 5)
+        self.addCleanup(cache.delete, key)
+
+        def worker(_):
+            try:
+                for _ in range(20):
+                    incr_counter(key)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(worker, range(8)))
+        self.assertEqual(get_search_stats()['latency_ms']['course']['5'], 160)
@@ -0,0 +1,107 @@
+import logging
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+_flushers = {}
+_local = threading.local()
+
+
+def dirty_flusher(kind):
+    """
+    注册某一类脏数据的批量重算函数, 函数接收 {key: value} 字典.
+    同一事务内被标记的对象在事务提交后按注册顺序各重算一次
+    """
+
+    def decorator(func):
+        _flushers[kind] = func
+        return func
+
+    return decorator
+
+
+def mark_dirty(kind, key, value=None, merge=None):
+    """
+    标记对象需要重算. 同一个 key 多次标记时, 若给出 merge 则用 merge(旧值, 新值) 合并, 否则保留最新值.
+    不在事务中时立即重算, 即退化为逐次重算. 在 savepoint 中的标记随 savepoint 回滚作废
+    """
+    marks = getattr(_local, 'marks', None)
+    if marks is not None:
+        # 重算过程中产生的标记在本轮重算结束后统一再重算
+        marks.append((kind, key, value, merge))
+        return
+    connection = connections[DEFAULT_DB_ALIAS]
+    if not connection.in_atomic_block:
+        _flush({kind: {key: value}})
+        return
+    _current_batch(connection).add(kind, key, value, merge)
+
+
+def _current_batch(connection):
+    """
+    每个事务(或 savepoint)层级一批, 按连接保存. 每批注册一个 on_commit 回调, 与其中的标记处于同一层级,
+    savepoint 回滚时回调连同标记一起被丢弃. 提交或回滚后 Django 会换用新的回调列表, 此时之前的各批均已失效
+    """
+    pending = _local.__dict__.setdefault('pending', {})
+    queue, batches = pending.get(connection.alias, (None, None))
+    if queue is not connection.run_on_commit:
+        queue, batches = pending[connection.alias] = (connection.run_on_commit, {})
+    level = tuple(connection.savepoint_ids)
+    batch = batches.get(level)
+    if batch is None:
+        batch = batches[level] = _Batch(batches, level)
+        transaction.on_commit(batch, robust=True)
+    return batch
+
+
+def add_delta(old, new):
+    return tuple(a + b for a, b in zip(old, new))
+
+
+def _merge_into(target, kind, items, merge):
+    target_items = target.setdefault(kind, {})
+    for key, value in items.items():
+        if merge is not None and key in target_items:
+            value = merge(target_items[key], value)
+        target_items[key] = value
+
+
+def _flush(batch):
+    """
+    逐类重算, 某一类失败只记录日志, 不影响其它类. 数据已经提交, 不应让请求因此失败.
+    重算中新标记的对象(如评分变化后需更新的课程缓存版本)合并为下一轮, 失败的重算中的标记随之作废
+    """
+    while batch:
+        next_batch = {}
+        for kind, flusher in _flushers.items():
+            items = batch.get(kind)
+            if not items:
+                continue
+            marks = _local.marks = []
+            try:
+                with transaction.atomic():
+                    flusher(items)
+            except Exception:
+                logger.exception(f'Failed to flush dirty {kind}: {list(items)}')
+                continue
+            finally:
+                _local.marks = None
+            for mark_kind, key, value, merge in marks:
+                _merge_into(next_batch, mark_kind, {key: value}, merge)
+        batch = next_batch
+
+
+class _Batch:
+    def __init__(self, batches, level):
+        self.batches, self.level = batches, level
+        self.items = {}
+
+    def add(self, kind, key, value, merge):
+        _merge_into(self.items, kind, {key: value}, merge)
+
+    def __call__(self):
+        if self.batches.get(self.level) is self:
+            del self.batches[self.level]
+        _flush(self.items)
@@ -17,9 +17,11 @@ errcode_dict = {
     'invalid_token': '无效的token',
     'have_login': '已经登录',
     'not_login': '尚未登录',
+    'asgi_required': '消息推送需要通过ASGI部署',
     'password_incorrect': '密码错误',
     'rating_out_range': '评分超过范围',
     'operation_error': '操作错误',
+    'like_conflict': '点赞操作过于频繁, 请稍后重试',
     'teacher_id_when_exist': '教师已存在应提交ID',
     'teacher_name_when_not_exist': '教师不存在应提交姓名',
     'teacher_school_when_not_exist': '教师不存在应提交学院',
@@ -57,6 +59,9 @@ errcode_dict = {
     'send_reset_password_email_error': '发送重置密码邮件错误',
     'private_review_error': '评价隐私错误',
     'private_reply_error': '回复隐私错误',
+    'invalid_cursor': '无效的游标',
+    'invalid_page_size': '每页数量须为正整数',
+    'invalid_order': '非法排序方式',
 }
 
 message_dict = {
@@ -77,4 +82,12 @@ message_dict = {
 cache_key_dict = {
     'total_review_count': 'total_review_count',
     'total_courses_count': 'total_courses_count',
+    'course_version': 'course_version_',
+    'course_document': 'course_document_',
+    'search_generation': 'search_generation_',
+    'search_result': 'search_result_',
+    'search_latency': 'search_latency_',
+    'search_outcome': 'search_outcome_',
+    'search_slow_queries': 'search_slow_queries',
+    'unread_count': 'unread_count_',
 }
@@ -0,0 +1,73 @@
+import operator
+
+from django.core.cache import cache
+
+from utils.coalescer import dirty_flusher, mark_dirty
+from utils.db import named_xact_lock
+from utils.utils import get_cache_key
+
+_counters = {}
+
+
+class Counter:
+    """
+    缓存在 cache 中的计数. 缓存键由 cache_key_dict 中的前缀与分组派生, 写入时按增量更新, 缓存中没有时重新统计.
+    count(group) 从数据库统计某一分组, groups() 给出重建时需要统计的全部分组
+    """
+
+    def __init__(self, name, count, groups=None):
+        self.name = name
+        self.count = count
+        self.groups = groups or (lambda: [None])
+
+    def cache_key(self, group=None):
+        prefix = get_cache_key(self.name)
+        return prefix if group is None else f'{prefix}_{group}'
+
+    def get(self, group=None):
+        key = self.cache_key(group)
+        value = cache.get(key)
+        if value is None:
+            value = self.count(group)
+            cache.set(key, value, timeout=None)
+        return value
+
+    def add(self, delta, group=None):
+        """事务提交后把增量累加到缓存, 同一事务内的多次改动合并为一次"""
+        if delta:
+            mark_dirty('counter', (self.name, group), delta, merge=operator.add)
+
+    def rebuild(self):
+        values = {self.cache_key(group): self.count(group) for group in self.groups()}
+        cache.set_many(values, timeout=None)
+        return values
+
+
+def register_counter(name, count, groups=None):
+    counter = _counters[name] = Counter(name, count, groups)
+    return counter
+
+
+def get_counter(name):
+    return _counters[name]
+
+
+def all_counters():
+    return list(_counters.values())
+
+
+@dirty_flusher('counter')
+def flush_counters(items):
+    """
+    DatabaseCache 的 incr 是先读后写, 并发写回会丢失增量. 在 flush 的事务中按缓存键加咨询锁,
+    各进程对同一计数的读写依次进行, 按键排序加锁避免死锁
+    """
+    deltas = {_counters[name].cache_key(group): delta
+              for (name, group), delta in items.items() if delta}
+    for key in sorted(deltas):
+        named_xact_lock(key)
+        try:
+            cache.incr(key, deltas[key])
+        except ValueError:
+            # 缓存中没有该计数, 下次读取时重新统计
+            pass
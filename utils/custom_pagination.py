@@ -1,13 +1,37 @@
+import base64
+import json
+from functools import partial
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
 from rest_framework.pagination import PageNumberPagination
 
-from utils.utils import return_response
+from utils.utils import InvalidParameter, return_response
+
+
+class CountedPaginator(Paginator):
+    """总数由调用方给出时不再执行 COUNT(*)"""
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            self.count = count
 
 
 class StandardResultsSetPagination(PageNumberPagination):
+    """视图定义了 get_total_count 时总数从计数缓存中读取, 见 utils.counters"""
     page_size = 10
     page_size_query_param = 'pageSize'
     max_page_size = 100
 
+    def paginate_queryset(self, queryset, request, view=None):
+        get_total_count = getattr(view, 'get_total_count', None)
+        count = get_total_count() if get_total_count is not None else None
+        self.django_paginator_class = partial(CountedPaginator, count=count)
+        return super().paginate_queryset(queryset, request, view)
+
     def get_page_size(self, request):
         page_size = request.query_params.get(self.page_size_query_param, None)
         if page_size is None:
@@ -24,3 +48,67 @@ class StandardResultsSetPagination(PageNumberPagination):
             'count': self.page.paginator.count,
             'results': data
         })
+
+
+class KeysetPagination(StandardResultsSetPagination):
+    """
+    游标分页, 按 view.keyset_ordering 排序, 写法同 order_by, 字段前加 - 表示降序, 最后一个字段需唯一.
+    排序字段可以是 queryset 上的 annotation, 字段的值不能为 NULL, 可为空的字段需用 Coalesce 等表达式 annotate 后排序.
+    游标记录上一页最后一条的排序字段值, 翻页开销与翻到第几页无关, 也不需要统计总数
+    """
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = view.keyset_ordering
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self.request = request
+        page_size = self.get_page_size(request)
+        if page_size is None:
+            page_size = self.page_size
+        elif page_size < 1:
+            raise InvalidParameter(self.page_size_query_param, 'invalid_page_size')
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.after(queryset, cursor))
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        results = results[:page_size]
+        self.next_cursor = self.encode_cursor(results[-1]) if self.has_next else None
+        return results
+
+    def encode_cursor(self, instance):
+        values = [getattr(instance, field) for field in self.fields]
+        return base64.urlsafe_b64encode(json.dumps(values, cls=DjangoJSONEncoder).encode()).decode()
+
+    @staticmethod
+    def output_field(queryset, field):
+        annotation = queryset.query.annotations.get(field)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(field)
+
+    def after(self, queryset, cursor):
+        """排在游标之后的行: 降序的 a 与升序的 b 展开为 a < va OR (a = va AND b > vb)"""
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = [self.output_field(queryset, field).to_python(value)
+                      for field, value in zip(self.fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidParameter('cursor', 'invalid_cursor')
+        if len(values) != len(self.fields) or None in values:
+            raise InvalidParameter('cursor', 'invalid_cursor')
+        condition = Q()
+        for index, ordering in reversed(list(enumerate(self.ordering))):
+            equal = {field: value for field, value in zip(self.fields[:index], values)}
+            lookup = 'lt' if ordering.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{self.fields[index]}__{lookup}': values[index]})
+        # OR 展开的条件无法作为索引的扫描范围, 额外给出第一个字段的范围, 使索引从游标处开始扫描
+        first_lookup = 'lte' if self.ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{self.fields[0]}__{first_lookup}': values[0]}) & condition
+
+    def get_paginated_response(self, data):
+        return return_response(contents={
+            'next': self.next_cursor,
+            'results': data
+        })
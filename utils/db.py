@@ -0,0 +1,63 @@
+import zlib
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from psycopg2 import errorcodes
+
+
+def update_counters(model, pk, **deltas):
+    """
+    以一条 UPDATE ... RETURNING 原子地累加计数字段, 返回更新后的值, 行不存在时返回 None.
+    增量全为 0 时只读取当前值, 不重写整行
+    """
+    manager = model._base_manager
+    if not any(deltas.values()):
+        return manager.filter(pk=pk).values(*deltas).first()
+    meta = model._meta
+    quote_name = connection.ops.quote_name
+    columns = [quote_name(meta.get_field(name).column) for name in deltas]
+    assignments = ', '.join(f'{column} = {column} + %s' for column in columns)
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {quote_name(meta.db_table)} SET {assignments} '
+                       f'WHERE {quote_name(meta.pk.column)} = %s RETURNING {", ".join(columns)}',
+                       [*deltas.values(), pk])
+        row = cursor.fetchone()
+    return None if row is None else dict(zip(deltas, row))
+
+
+def advisory_xact_lock(model, pk):
+    """对 (model, pk) 加事务级的咨询锁, 用于串行化与该对象相关的写入, 不会锁住或改写对象所在的行"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)',
+                       [zlib.crc32(model._meta.db_table.encode()) - 2 ** 31, pk])
+
+
+def named_xact_lock(name):
+    """对任意字符串加事务级的咨询锁, 与 advisory_xact_lock 的双参数锁互不冲突"""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [name])
+
+
+def is_statement_timeout(error):
+    """数据库异常是否由 statement_timeout 取消语句引起"""
+    return getattr(error.__cause__, 'pgcode', None) == errorcodes.QUERY_CANCELED
+
+
+@contextmanager
+def statement_timeout(milliseconds):
+    """
+    在事务(已在事务中时为 savepoint)内以 SET LOCAL 限制每条语句的执行时间, 超时抛出 OperationalError,
+    可用 is_statement_timeout 判断. milliseconds 为 0 时不限制
+    """
+    if not milliseconds:
+        yield
+        return
+    in_outer_transaction = connection.in_atomic_block
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", [str(milliseconds)])
+        yield
+    if in_outer_transaction:
+        # 释放 savepoint 后 SET LOCAL 仍会持续到外层事务结束, 需手动恢复; 出错回滚 savepoint 时已一并撤销
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL statement_timeout TO DEFAULT')
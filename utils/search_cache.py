@@ -0,0 +1,124 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from utils import constants
+
+# 进程内 LRU 的容量, 以及两级缓存的过期时间. 点赞数, 评分等计数的变化不会使缓存失效, 过期前可能展示旧值
+LOCAL_MAX_SIZE = 512
+TIMEOUT = 60
+# 代数在进程内缓存的秒数. 共享 cache 是数据库缓存, 每次查询都读取代数会使进程内缓存的命中也要访问数据库;
+# 本进程的改动立即生效, 其它进程的改动最迟在这之后生效
+GENERATION_TTL = 2
+
+
+def normalize_keyword(keyword):
+    """搜索对大小写与多余空白不敏感, 归一化后作为缓存键"""
+    return ' '.join(keyword.split()).lower()
+
+
+class SearchCache:
+    """
+    搜索结果的两级缓存: 进程内的有界 LRU 在前, 共享的 cache 在后.
+    每种搜索类型在共享 cache 中有一个代数, 缓存键包含代数, 相关模型保存后代数加一, 旧结果随之失效
+    """
+
+    def __init__(self, max_size=LOCAL_MAX_SIZE, timeout=TIMEOUT, generation_ttl=GENERATION_TTL):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.generation_ttl = generation_ttl
+        self.lock = threading.Lock()
+        self.local = OrderedDict()
+        self.generations = {}
+        self.local_hits = self.shared_hits = self.misses = 0
+
+    def generation_key(self, search_type):
+        return f"{constants.cache_key_dict['search_generation']}{search_type}"
+
+    def generation(self, search_type):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.generations.get(search_type)
+            if cached is not None and cached[0] > now:
+                return cached[1]
+        key = self.generation_key(search_type)
+        value = cache.get(key)
+        if value is None:
+            # 代数被清除后不能从 0 重新开始, 否则可能命中清除前同一代数的旧结果
+            cache.add(key, time.time_ns() // 1000, timeout=None)
+            value = cache.get(key)
+        with self.lock:
+            self.generations[search_type] = (now + self.generation_ttl, value)
+        return value
+
+    def bump_generations(self, search_types):
+        """使这些类型已缓存的搜索结果失效"""
+        for search_type in search_types:
+            try:
+                cache.incr(self.generation_key(search_type))
+            except ValueError:
+                # 代数不在缓存中, 下次读取时重新生成
+                pass
+            with self.lock:
+                self.generations.pop(search_type, None)
+
+    def cache_key(self, search_type, keyword, current_page, page_size):
+        digest = hashlib.md5(normalize_keyword(keyword).encode()).hexdigest()
+        prefix = constants.cache_key_dict['search_result']
+        generation = self.generation(search_type)
+        return f'{prefix}{search_type}_{generation}_{digest}_{current_page}_{page_size}'
+
+    def get_or_set(self, search_type, keyword, current_page, page_size, search, should_cache=None):
+        """返回缓存的搜索结果, 都未命中时调用 search() 计算并写入两级缓存, should_cache(结果) 为假时不写入"""
+        key = self.cache_key(search_type, keyword, current_page, page_size)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.local.get(key)
+            if entry is not None and entry[0] > now:
+                self.local.move_to_end(key)
+                self.local_hits += 1
+                return entry[1]
+        value = cache.get(key)
+        shared_hit = value is not None
+        if not shared_hit:
+            value = search()
+            if should_cache is not None and not should_cache(value):
+                with self.lock:
+                    self.misses += 1
+                return value
+            cache.set(key, value, timeout=self.timeout)
+        with self.lock:
+            if shared_hit:
+                self.shared_hits += 1
+            else:
+                self.misses += 1
+            self.local[key] = (now + self.timeout, value)
+            self.local.move_to_end(key)
+            while len(self.local) > self.max_size:
+                self.local.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.local.clear()
+            self.generations.clear()
+            self.local_hits = self.shared_hits = self.misses = 0
+
+    def stats(self):
+        """本进程的命中统计"""
+        with self.lock:
+            total = self.local_hits + self.shared_hits + self.misses
+            return {
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': (total - self.misses) / total if total else None,
+                'local_size': len(self.local),
+                'local_max_size': self.max_size,
+            }
+
+
+search_cache = SearchCache()
@@ -0,0 +1,180 @@
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from utils import constants
+from utils.db import is_statement_timeout, named_xact_lock, statement_timeout
+from utils.search_cache import normalize_keyword
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TYPES = ('course', 'teacher', 'review')
+# 延迟直方图各桶的上界(毫秒), 更慢的计入 inf
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 'inf')
+# 除完整搜索外单独计数的结果: 超时后退化的搜索与出错的搜索
+OUTCOMES = ('degraded', 'failed')
+# 慢查询环形缓冲区的容量, 每条记录占用一个缓存键
+SLOW_QUERY_BUFFER_SIZE = 50
+
+
+def latency_key(search_type, bucket):
+    return f"{constants.cache_key_dict['search_latency']}{search_type}_{bucket}"
+
+
+def outcome_key(search_type, outcome):
+    return f"{constants.cache_key_dict['search_outcome']}{search_type}_{outcome}"
+
+
+def slow_query_key(slot):
+    return f"{constants.cache_key_dict['search_slow_queries']}_{slot}"
+
+
+def incr_counter(key):
+    """
+    DatabaseCache 的 incr 是先读后写, 与 flush_counters 相同, 在事务中按缓存键加咨询锁,
+    多个进程同时累加时不丢失计数. 返回累加后的值
+    """
+    with transaction.atomic():
+        named_xact_lock(key)
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+class QueryRecorder:
+    """记录连接上执行的每条语句, 耗时以及是否因 statement_timeout 被取消"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return execute(sql, params, many, context)
+        except DatabaseError as e:
+            timed_out = is_statement_timeout(e)
+            raise
+        finally:
+            if not many:
+                self.queries.append((sql, params, (time.perf_counter() - start) * 1000, timed_out))
+
+
+class SearchSample:
+    """
+    一次搜索的统计. 调用方在 recording() 中执行需要记录的语句, 超时退化时把 outcome 改为 degraded,
+    出错时由 instrument_search 记为 failed
+    """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.outcome = 'ok'
+        self.recorder = QueryRecorder()
+
+    @contextmanager
+    def recording(self):
+        if not self.enabled:
+            yield
+            return
+        with connection.execute_wrapper(self.recorder):
+            yield
+
+
+@contextmanager
+def instrument_search(search_type, keyword):
+    """
+    开启 SEARCH_INSTRUMENTATION 时统计一次搜索(含分页总数与超时后的退化搜索)的耗时, 计入该类型的延迟直方图,
+    退化与出错的搜索另外计数. recording() 中超过 SEARCH_SLOW_QUERY_MS 的语句在搜索结束后 EXPLAIN,
+    执行计划存入慢查询缓冲区. 应在 statement_timeout 之外使用, 以免已超时的事务中无法 EXPLAIN
+    """
+    sample = SearchSample(settings.SEARCH_INSTRUMENTATION)
+    if not sample.enabled:
+        yield sample
+        return
+    start = time.perf_counter()
+    try:
+        yield sample
+    except BaseException:
+        sample.outcome = 'failed'
+        raise
+    finally:
+        try:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            record_search(search_type, keyword, elapsed_ms, sample.recorder.queries, sample.outcome)
+        except Exception:
+            # 统计失败不应掩盖搜索本身的结果或异常
+            logger.exception(f'Failed to record {search_type} search stats')
+
+
+def explain(sql, params):
+    """只生成执行计划, 不再次执行语句. 同样受 SEARCH_STATEMENT_TIMEOUT_MS 限制, 不会拖慢请求"""
+    with statement_timeout(settings.SEARCH_STATEMENT_TIMEOUT_MS), connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN {sql}', params)
+        return '\n'.join(line for line, in cursor.fetchall())
+
+
+def record_search(search_type, keyword, duration, queries, outcome='ok'):
+    bucket = next(bucket for bucket in LATENCY_BUCKETS if bucket == 'inf' or duration <= bucket)
+    incr_counter(latency_key(search_type, bucket))
+    if outcome in OUTCOMES:
+        incr_counter(outcome_key(search_type, outcome))
+
+    slow_queries = []
+    for sql, params, query_duration, timed_out in queries:
+        if query_duration < settings.SEARCH_SLOW_QUERY_MS:
+            continue
+        try:
+            plan = explain(sql, params)
+        except DatabaseError:
+            logger.exception(f'Failed to explain slow {search_type} search query')
+            continue
+        slow_queries.append({
+            'time': timezone.now(),
+            'type': search_type,
+            'keyword': normalize_keyword(keyword),
+            'outcome': outcome,
+            'search_ms': round(duration, 1),
+            'query_ms': round(query_duration, 1),
+            'timed_out': timed_out,
+            'sql': sql,
+            'params': [str(param) for param in params or ()],
+            'plan': plan,
+        })
+    for entry in slow_queries:
+        # 按递增的序号轮流写入各个槽位, 多个进程同时写入时互不覆盖
+        entry['id'] = incr_counter(constants.cache_key_dict['search_slow_queries'])
+        cache.set(slow_query_key(entry['id'] % SLOW_QUERY_BUFFER_SIZE), entry, timeout=None)
+
+
+def get_search_stats():
+    """
+    各类型搜索的延迟直方图 {类型: {桶上界: 次数}}, 退化与出错的次数 {类型: {结果: 次数}} 与最近的慢查询,
+    由所有进程共同写入
+    """
+    keys = {(search_type, bucket): latency_key(search_type, bucket)
+            for search_type in SEARCH_TYPES for bucket in LATENCY_BUCKETS}
+    keys.update({(search_type, outcome): outcome_key(search_type, outcome)
+                 for search_type in SEARCH_TYPES for outcome in OUTCOMES})
+    counts = cache.get_many(keys.values())
+    slow_queries = cache.get_many([slow_query_key(slot) for slot in range(SLOW_QUERY_BUFFER_SIZE)])
+    return {
+        'latency_ms': {search_type: {str(bucket): counts.get(keys[(search_type, bucket)], 0)
+                                     for bucket in LATENCY_BUCKETS} for search_type in SEARCH_TYPES},
+        'outcomes': {search_type: {outcome: counts.get(keys[(search_type, outcome)], 0)
+                                   for outcome in OUTCOMES} for search_type in SEARCH_TYPES},
+        'slow_queries': sorted(slow_queries.values(), key=lambda entry: entry['id']),
+    }
+
+
+def clear_search_stats():
+    cache.delete_many([latency_key(search_type, bucket)
+                       for search_type in SEARCH_TYPES for bucket in LATENCY_BUCKETS] +
+                      [outcome_key(search_type, outcome)
+                       for search_type in SEARCH_TYPES for outcome in OUTCOMES] +
+                      [slow_query_key(slot) for slot in range(SLOW_QUERY_BUFFER_SIZE)] +
+                      [constants.cache_key_dict['search_slow_queries']])
@@ -2,7 +2,7 @@ import json
 import random
 
 from rest_framework import status
-from rest_framework.exceptions import NotAuthenticated, Throttled
+from rest_framework.exceptions import APIException, NotAuthenticated, Throttled
 from rest_framework.response import Response
 from rest_framework.views import exception_handler
 
@@ -55,12 +55,24 @@ def get_cache_key(cache_key: str):
     return constants.cache_key_dict[cache_key]
 
 
+class InvalidParameter(APIException):
+    """视图调用的组件(如分页)发现请求参数错误时抛出, 由 custom_exception_handler 转换为 return_response 格式的 400"""
+    status_code = status.HTTP_400_BAD_REQUEST
+
+    def __init__(self, field: str, err_code: str):
+        self.errors = {field: get_err_msg(err_code)}
+        super().__init__(self.errors[field]['err_msg'], err_code)
+
+
 def custom_exception_handler(exc, context):
     response = exception_handler(exc, context)
 
     if isinstance(exc, NotAuthenticated):
         return return_response(errors={'login': get_err_msg('not_login')}, status_code=status.HTTP_401_UNAUTHORIZED)
 
+    if isinstance(exc, InvalidParameter):
+        return return_response(errors=exc.errors, status_code=exc.status_code)
+
     if isinstance(exc, Throttled):
         return return_response(errors={'throttle': get_err_msg('too_many_requests')},
                                status_code=status.HTTP_429_TOO_MANY_REQUESTS)